@@ -0,0 +1,464 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+شبیه‌ساز محلی پنل Hiddify برای تست و بنچمارک
+
+کاربران در حافظه نگه داشته می‌شوند و مسیرهای ادمین (admin/user/، admin/server_status/،
+admin/me/، panel/ping/، panel/info/) و مسیرهای کاربر پاسخ داده می‌شوند. مسیرهای کاربر
+هم به شکل کوتاهی که HiddifyAPI استفاده می‌کند ({user_proxy}/{uuid}/me/) و هم به شکل
+مستندات API (‏{user_proxy}/{uuid}/api/v2/user/me/ و ‏{proxy}/api/v2/user/me/ با کلید کاربر)
+در دسترس هستند.
+
+پاسخ‌های بزرگ‌تر از ۱ کیلوبایت برای کلاینت‌هایی که gzip را می‌پذیرند فشرده می‌شوند (--no-gzip).
+تعداد کاربران (تا ۱۰۰ هزار و بیشتر)، تأخیر، نرخ خطا و حجم پاسخ قابل تنظیم است:
+
+    python bench/fake_panel.py --users 100000 --latency 0.05 --jitter 0.02 --error-rate 0.01 --payload-bytes 512
+
+برای بررسی test_connection.check_hiddify_panel روی شبیه‌ساز:
+
+    HIDDIFY_API_BASE_URL=http://127.0.0.1:8082 HIDDIFY_PROXY_PATH=proxy HIDDIFY_USER_PROXY_PATH=proxy \\
+    HIDDIFY_API_KEY=bench-key python -c "from bot.test_connection import check_hiddify_panel; check_hiddify_panel()"
+"""
+
+import argparse
+import gzip
+import json
+import random
+import re
+import threading
+import time
+import uuid as uuidlib
+from collections import Counter
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+_UUID = r"[0-9a-fA-F-]{36}"
+# پاسخ‌های کوچک‌تر فشرده نمی‌شوند (مثل gzip_min_length در nginx)
+GZIP_MIN_LENGTH = 1024
+USER_ENDPOINTS = ("me", "short", "apps", "all-configs", "mtproxies")
+
+
+class FakePanelState:
+    """کاربران پنل، تنظیمات شبیه‌سازی و شمارنده درخواست‌ها"""
+
+    def __init__(
+        self,
+        proxy_path: str = "proxy",
+        user_proxy_path: str = "proxy",
+        api_key: str = "bench-key",
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        error_status: int = 503,
+        payload_bytes: int = 0,
+        configs_per_user: int = 4,
+        compress: bool = True,
+        seed: Optional[int] = None
+    ):
+        self.proxy_path = proxy_path
+        self.user_proxy_path = user_proxy_path
+        self.api_key = api_key
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.payload_bytes = payload_bytes
+        self.configs_per_user = configs_per_user
+        self.compress = compress
+        self.seed = seed
+        # فقط برای ساخت داده اولیه در ترد اصلی؛ هر درخواست RNG جداگانه خود را دارد (request_random)
+        self.random = random.Random(seed)
+        self._requests = 0
+        self.users: Dict[str, Dict] = {}
+        self.calls: Counter = Counter()
+        self.errors: Counter = Counter()
+        self._lock = threading.Lock()
+        # لیست کامل کاربران فقط پس از تغییر دوباره سریال‌سازی می‌شود
+        self._list_cache: Optional[bytes] = None
+        self._list_cache_gzip: Optional[Tuple[bytes, bytes]] = None
+
+    def request_random(self) -> random.Random:
+        """RNG مستقل برای یک درخواست؛ با seed یکسان، درخواست nام همیشه همان اعداد را می‌گیرد"""
+        with self._lock:
+            self._requests += 1
+            sequence = self._requests
+        if self.seed is None:
+            return random.Random()
+        return random.Random(f"{self.seed}:{sequence}")
+
+    def _build_user(self, data: Dict, rng: Optional[random.Random] = None) -> Dict:
+        rng = rng or self.random
+        user_uuid = data.get("uuid") or str(uuidlib.UUID(int=rng.getrandbits(128), version=4))
+        user = {
+            "uuid": user_uuid,
+            "name": data.get("name", user_uuid[:8]),
+            "usage_limit_GB": data.get("usage_limit_GB", 0),
+            "package_days": data.get("package_days", 30),
+            "start_date": data.get("start_date") or datetime.utcnow().strftime("%Y-%m-%d"),
+            "current_usage_GB": data.get("current_usage_GB", 0.0),
+            "enable": data.get("enable", True),
+            "is_active": data.get("is_active", True),
+            "comment": data.get("comment"),
+            "mode": data.get("mode", "no_reset"),
+            "lang": data.get("lang", "fa"),
+            "telegram_id": data.get("telegram_id"),
+            "last_online": data.get("last_online"),
+            "added_by_uuid": data.get("added_by_uuid")
+        }
+        if self.payload_bytes:
+            # فیلد اضافه برای شبیه‌سازی پنل‌هایی با داده بیشتر به ازای هر کاربر
+            user["extra"] = "x" * self.payload_bytes
+        return user
+
+    def add_user(self, data: Dict, rng: Optional[random.Random] = None) -> Dict:
+        user = self._build_user(data, rng)
+        with self._lock:
+            self.users[user["uuid"]] = user
+            self._list_cache = None
+        return user
+
+    def update_user(self, user_uuid: str, data: Dict) -> Optional[Dict]:
+        with self._lock:
+            user = self.users.get(user_uuid)
+            if user is not None:
+                user.update({key: value for key, value in data.items() if key != "uuid"})
+                self._list_cache = None
+            return user
+
+    def delete_user(self, user_uuid: str) -> bool:
+        with self._lock:
+            removed = self.users.pop(user_uuid, None) is not None
+            if removed:
+                self._list_cache = None
+            return removed
+
+    def seed_users(self, count: int, name_prefix: str = "t"):
+        """ساخت count کاربر با مصرف و تاریخ‌های متنوع (قابل تکرار با seed یکسان)"""
+        today = datetime.utcnow().date()
+        users = {}
+        for i in range(count):
+            limit = self.random.choice((5, 30, 30, 50, 100))
+            user = self._build_user({
+                "name": f"{name_prefix}{1_000_000 + i}",
+                "usage_limit_GB": limit,
+                "package_days": self.random.choice((3, 30, 30, 90)),
+                "start_date": (today - timedelta(days=self.random.randint(0, 60))).strftime("%Y-%m-%d"),
+                "current_usage_GB": round(self.random.uniform(0, limit * 1.1), 3),
+                "enable": self.random.random() > 0.05,
+                "telegram_id": 1_000_000 + i
+            })
+            users[user["uuid"]] = user
+        with self._lock:
+            self.users.update(users)
+            self._list_cache = None
+
+    def user_list_body(self) -> bytes:
+        with self._lock:
+            if self._list_cache is None:
+                self._list_cache = json.dumps(list(self.users.values())).encode()
+            return self._list_cache
+
+    def gzip_body(self, body: bytes) -> bytes:
+        """فشرده‌سازی پاسخ؛ نسخه فشرده لیست کاربران تا تغییر بعدی کش می‌شود"""
+        cached = self._list_cache_gzip
+        if cached is not None and cached[0] is body:
+            return cached[1]
+        compressed = gzip.compress(body, compresslevel=6)
+        if body is self._list_cache:
+            self._list_cache_gzip = (body, compressed)
+        return compressed
+
+    def record(self, endpoint: str, failed: bool = False):
+        with self._lock:
+            self.calls[endpoint] += 1
+            if failed:
+                self.errors[endpoint] += 1
+
+    def delay(self, rng: random.Random) -> float:
+        if not self.latency and not self.jitter:
+            return 0.0
+        return max(0.0, self.latency + rng.uniform(-self.jitter, self.jitter))
+
+    def should_fail(self, rng: random.Random) -> bool:
+        return self.error_rate > 0 and rng.random() < self.error_rate
+
+
+def profile(user: Dict) -> Dict:
+    """پاسخ me/ برای یک کاربر (طرح Profile در مستندات API)"""
+    return {
+        "profile_title": user["name"],
+        "profile_url": f"https://bench.local/{user['uuid']}/",
+        "profile_usage_current": user["current_usage_GB"],
+        "profile_usage_total": user["usage_limit_GB"],
+        "profile_remaining_days": user["package_days"],
+        "profile_reset_days": 0,
+        "usage_current_GB": user["current_usage_GB"],
+        "lang": user["lang"],
+        "telegram_id": user["telegram_id"],
+        "telegram_bot_url": "",
+        "admin_message_html": "",
+        "admin_message_url": "",
+        "brand_title": "FoxyBench",
+        "brand_icon_url": "",
+        "doh": "",
+        "speedtest_enable": False,
+        "telegram_proxy_enable": False
+    }
+
+
+def short_link(user: Dict) -> Dict:
+    return {
+        "short": user["uuid"][:6],
+        "short_url": f"https://bench.local/s/{user['uuid'][:6]}",
+        "full_url": f"https://bench.local/{user['uuid']}/",
+        "expire_in": 600
+    }
+
+
+def configs(user: Dict, count: int) -> list:
+    return [
+        {
+            "name": f"config-{i}",
+            "domain": "bench.local",
+            "link": f"vless://{user['uuid']}@bench.local:443?type=ws#config-{i}",
+            "protocol": "vless",
+            "security": "tls",
+            "transport": "ws",
+            "type": "all"
+        }
+        for i in range(count)
+    ]
+
+
+def apps() -> list:
+    return [
+        {
+            "title": name,
+            "name": name,
+            "description": "",
+            "icon_url": "",
+            "guide_url": "",
+            "link": f"https://bench.local/apps/{name}",
+            "deeplink": f"{name}://import",
+            "install": [{"title": name, "type": "google_play", "url": f"https://bench.local/apps/{name}"}]
+        }
+        for name in ("hiddify", "v2rayng", "streisand")
+    ]
+
+
+def mtproxies() -> list:
+    return [{"title": "MTProxy", "link": "tg://proxy?server=bench.local&port=443&secret=ee00"}]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    state: FakePanelState = None
+    protocol_version = "HTTP/1.1"
+    # هدر و بدنه در یک بسته ارسال شوند تا delayed ACK تأخیر مصنوعی ایجاد نکند
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _body(self) -> Dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length)) if length else {}
+
+    def _accepts_gzip(self) -> bool:
+        accepted = self.headers.get("Accept-Encoding") or ""
+        return self.state.compress and "gzip" in [part.split(";")[0].strip() for part in accepted.split(",")]
+
+    def _send(self, status: int, payload):
+        body = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        if len(body) >= GZIP_MIN_LENGTH and self._accepts_gzip():
+            body = self.state.gzip_body(body)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _user_endpoint(self, user: Optional[Dict], endpoint: str, label: str) -> Tuple[int, object, str]:
+        if user is None:
+            return 404, {"message": "User not found"}, label
+        if endpoint == "me":
+            return 200, profile(user), label
+        if endpoint == "short":
+            return 200, short_link(user), label
+        if endpoint == "apps":
+            return 200, apps(), label
+        if endpoint == "all-configs":
+            return 200, configs(user, self.state.configs_per_user), label
+        return 200, mtproxies(), label
+
+    def _route(self, method: str, path: str) -> Tuple[int, object, str]:
+        state = self.state
+        admin_prefix = f"/{state.proxy_path}/api/v2/"
+        user_prefix = re.escape(state.user_proxy_path)
+        endpoints = "|".join(re.escape(name) for name in USER_ENDPOINTS)
+
+        # مسیر کاربر با uuid در آدرس: کوتاه (HiddifyAPI) یا کامل (مستندات API)
+        match = re.fullmatch(rf"/{user_prefix}/({_UUID})/(?:api/v2/user/)?({endpoints})/", path)
+        if match and method == "GET":
+            endpoint = match.group(2)
+            return self._user_endpoint(state.users.get(match.group(1)), endpoint, f"user/{endpoint}")
+
+        if not path.startswith(admin_prefix):
+            return 404, {"message": "Not Found"}, "not_found"
+        endpoint = path[len(admin_prefix):]
+        api_key = self.headers.get("Hiddify-API-Key")
+
+        # مسیر کاربر بدون uuid: کلید API همان uuid کاربر است
+        match = re.fullmatch(rf"user/({endpoints})/", endpoint)
+        if match and method == "GET":
+            return self._user_endpoint(state.users.get(api_key or ""), match.group(1), f"api/user/{match.group(1)}")
+
+        if endpoint == "panel/ping/":
+            # ping بدون کلید هم پاسخ می‌دهد
+            return 200, {"msg": "PONG"}, "panel/ping"
+
+        if api_key != state.api_key:
+            return 401, {"message": "Unauthorized"}, "unauthorized"
+
+        if endpoint == "panel/info/":
+            return 200, {"version": "10.0.0-bench"}, "panel/info"
+        if endpoint == "admin/me/":
+            return 200, {
+                "uuid": state.api_key, "name": "bench-admin", "mode": "super_admin",
+                "can_add_admin": True, "max_users": 0, "max_active_users": 0, "lang": "fa"
+            }, "admin/me"
+        if endpoint == "admin/server_status/":
+            # stats.cpu/ram/disk همان کلیدهایی است که ربات ادمین نمایش می‌دهد
+            return 200, {
+                "stats": {
+                    "cpu": 12.5, "ram": 30.0, "disk": 41.2,
+                    "system": {"cpu_percent": 12.5, "ram_used": 1.2, "ram_total": 4.0}
+                },
+                "usage_history": {"today": {"online": len(state.users)}}
+            }, "admin/server_status"
+        if endpoint == "admin/user/":
+            if method == "GET":
+                return 200, state.user_list_body(), "admin/user:list"
+            if method == "POST":
+                return 200, state.add_user(self._body(), self.rng), "admin/user:create"
+
+        match = re.fullmatch(rf"admin/user/({_UUID})/", endpoint)
+        if match:
+            user_uuid = match.group(1)
+            label = f"admin/user/{{uuid}}:{method.lower()}"
+            if method == "GET":
+                user = state.users.get(user_uuid)
+            elif method == "PATCH":
+                user = state.update_user(user_uuid, self._body())
+            elif method == "DELETE":
+                if state.delete_user(user_uuid):
+                    return 200, {"status": 200, "msg": "ok"}, label
+                user = None
+            else:
+                return 405, {"message": "Method Not Allowed"}, label
+            if user is None:
+                return 404, {"message": "User not found"}, label
+            return 200, user, label
+
+        return 404, {"message": "Not Found"}, "not_found"
+
+    def _handle(self):
+        state = self.state
+        path = urlsplit(self.path).path
+        # یک RNG مشترک بین تردها ترتیب اعداد را به زمان‌بندی تردها وابسته می‌کرد
+        self.rng = state.request_random()
+        status, payload, label = self._route(self.command, path)
+
+        delay = state.delay(self.rng)
+        if delay:
+            time.sleep(delay)
+        if status < 400 and state.should_fail(self.rng):
+            status, payload = state.error_status, {"message": "Injected failure"}
+
+        state.record(label, failed=status >= 500)
+        self._send(status, payload)
+
+    do_GET = _handle
+    do_POST = _handle
+    do_PATCH = _handle
+    do_PUT = _handle
+    do_DELETE = _handle
+
+
+class FakePanelServer:
+    """اجرای پنل در یک ترد پس‌زمینه؛ domain به عنوان دامنه پنل در دیتابیس ثبت می‌شود"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, users: int = 0, **state_options):
+        self.state = FakePanelState(**state_options)
+        if users:
+            self.state.seed_users(users)
+        handler = type("FakePanelHandler", (_Handler,), {"state": self.state})
+        self._server = ThreadingHTTPServer((host, port), handler)
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def domain(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakePanelServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-panel", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Local Hiddify panel simulator")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8082)
+    parser.add_argument("--users", type=int, default=1000, help="Users to pre-populate")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random +/- seconds around --latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with --error-status")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--payload-bytes", type=int, default=0, help="Extra bytes carried by every user object")
+    parser.add_argument("--configs-per-user", type=int, default=4)
+    parser.add_argument("--no-gzip", action="store_true", help="Never compress responses, even if the client accepts gzip")
+    parser.add_argument("--proxy-path", default="proxy")
+    parser.add_argument("--user-proxy-path", default="proxy")
+    parser.add_argument("--api-key", default="bench-key")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed for reproducible data and failures")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    server = FakePanelServer(
+        host=args.host,
+        port=args.port,
+        users=args.users,
+        proxy_path=args.proxy_path,
+        user_proxy_path=args.user_proxy_path,
+        api_key=args.api_key,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        payload_bytes=args.payload_bytes,
+        configs_per_user=args.configs_per_user,
+        compress=not args.no_gzip,
+        seed=args.seed
+    ).start()
+    print(
+        f"Fake Hiddify panel with {len(server.state.users)} users listening on {server.domain} "
+        f"(proxy path '{args.proxy_path}', API key '{args.api_key}')"
+    )
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+        print(f"Requests: {dict(server.state.calls)}")
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+سرور محلی شبیه Bot API تلگرام برای بنچمارک ربات‌ها
+
+همه متدها با پاسخ موفق و معتبر (از نظر python-telegram-bot) جواب داده می‌شوند
+و تعداد فراخوانی هر متد برای گزارش نگه داشته می‌شود.
+"""
+
+import json
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+from urllib.parse import parse_qs
+
+# متدهایی که یک پیام برمی‌گردانند
+MESSAGE_METHODS = {
+    "sendMessage", "editMessageText", "editMessageReplyMarkup", "editMessageCaption",
+    "sendPhoto", "sendDocument", "forwardMessage", "copyMessage"
+}
+
+
+class FakeTelegramState:
+    """وضعیت مشترک سرور: شمارنده‌ها و شناسه پیام‌ها"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self._lock = threading.Lock()
+        self._message_id = 0
+
+    def next_message_id(self) -> int:
+        with self._lock:
+            self._message_id += 1
+            return self._message_id
+
+    def record(self, method: str):
+        with self._lock:
+            self.calls[method] += 1
+
+
+def _bot_user(token: str) -> Dict:
+    bot_id = int(token.split(":", 1)[0]) if token.split(":", 1)[0].isdigit() else 1
+    return {
+        "id": bot_id,
+        "is_bot": True,
+        "first_name": "FoxyBench",
+        "username": f"foxy_bench_{bot_id}_bot",
+        "can_join_groups": False,
+        "can_read_all_group_messages": False,
+        "supports_inline_queries": False
+    }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    state: FakeTelegramState = None
+    protocol_version = "HTTP/1.1"
+    # هدر و بدنه در یک بسته ارسال شوند تا delayed ACK تأخیر مصنوعی ایجاد نکند
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _params(self) -> Dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        content_type = self.headers.get("Content-Type", "")
+        if not body:
+            return {}
+        if content_type.startswith("application/json"):
+            return json.loads(body)
+        if content_type.startswith("application/x-www-form-urlencoded"):
+            return {key: values[0] for key, values in parse_qs(body.decode()).items()}
+        # multipart (ارسال فایل) برای بنچمارک لازم نیست پارس شود
+        return {}
+
+    def _result(self, token: str, method: str, params: Dict):
+        if method == "getMe":
+            return _bot_user(token)
+        if method in MESSAGE_METHODS:
+            chat_id = int(params.get("chat_id") or 0)
+            message_id = params.get("message_id")
+            return {
+                "message_id": int(message_id) if message_id else self.state.next_message_id(),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": _bot_user(token),
+                "text": params.get("text") or params.get("caption") or ""
+            }
+        if method == "getUpdates":
+            return []
+        return True
+
+    def _handle(self):
+        # مسیر به شکل /bot<token>/<method>
+        parts = self.path.split("?", 1)[0].strip("/").split("/")
+        if len(parts) != 2 or not parts[0].startswith("bot"):
+            self._send(404, {"ok": False, "error_code": 404, "description": "Not Found"})
+            return
+
+        token, method = parts[0][3:], parts[1]
+        params = self._params()
+        self.state.record(method)
+        if self.state.latency:
+            time.sleep(self.state.latency)
+        self._send(200, {"ok": True, "result": self._result(token, method, params)})
+
+    def _send(self, status: int, payload: Dict):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = _handle
+    do_POST = _handle
+
+
+class FakeTelegramServer:
+    """اجرای سرور در یک ترد پس‌زمینه؛ base_url برای ApplicationBuilder.base_url است"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0):
+        self.state = FakeTelegramState(latency)
+        handler = type("FakeTelegramHandler", (_Handler,), {"state": self.state})
+        self._server = ThreadingHTTPServer((host, port), handler)
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/bot"
+
+    def start(self) -> "FakeTelegramServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-telegram", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+if __name__ == "__main__":
+    server = FakeTelegramServer(port=8081).start()
+    print(f"Fake Bot API listening on {server.base_url}<token>/<method>")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
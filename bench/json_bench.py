@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+بنچمارک دریافت و دیکد لیست کاربران پنل
+
+لیست کاربران پنل شبیه‌سازی‌شده (bench/fake_panel.py) با HiddifyAPI در چند حالت دریافت می‌شود:
+دیکد کامل با json استاندارد، دیکد کامل با orjson (در صورت نصب) و پارس جریانی آرایه
+(iter_users)، هر کدام با و بدون فشرده‌سازی gzip. برای هر حالت بهترین زمان، حجم
+داده روی شبکه و اوج حافظه (tracemalloc) گزارش می‌شود.
+
+مثال:
+    python bench/json_bench.py --users 100000
+    python bench/json_bench.py --users 20000 --payload-bytes 512 --report json_bench.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Callable, Dict, List
+
+import requests
+
+# اضافه کردن مسیر پروژه به سیستم
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from bench.fake_panel import FakePanelServer
+from bot.utils import hiddify
+from bot.utils.hiddify import HiddifyAPI
+
+logger = logging.getLogger("json_bench")
+
+ENCODINGS = {"gzip": "gzip, deflate", "identity": "identity"}
+
+
+def full_decode(api: HiddifyAPI) -> int:
+    return len(api.get_all_users())
+
+
+def stream_decode(api: HiddifyAPI) -> int:
+    return sum(1 for _ in api.iter_users())
+
+
+def modes() -> Dict[str, tuple]:
+    """نام حالت: (تابع، ماژول orjson یا None برای json استاندارد)"""
+    available = {
+        "json": (full_decode, None),
+        "stream": (stream_decode, None)
+    }
+    if hiddify.orjson is not None:
+        available["orjson"] = (full_decode, hiddify.orjson)
+    return available
+
+
+def wire_bytes(api: HiddifyAPI, accept_encoding: str) -> int:
+    """حجم بدنه پاسخ لیست کاربران روی شبکه (قبل از باز کردن فشرده‌سازی)"""
+    headers = dict(api.headers, **{"Accept-Encoding": accept_encoding})
+    with requests.get(f"{api.base_url}/admin/user/", headers=headers, stream=True) as response:
+        response.raise_for_status()
+        return len(response.raw.read(decode_content=False))
+
+
+def measure(api: HiddifyAPI, func: Callable[[HiddifyAPI], int], backend, repeat: int) -> Dict:
+    original = hiddify.orjson
+    hiddify.orjson = backend
+    try:
+        timings: List[float] = []
+        count = 0
+        for _ in range(repeat):
+            start = time.perf_counter()
+            count = func(api)
+            timings.append(time.perf_counter() - start)
+
+        # اوج حافظه جدا اندازه گرفته می‌شود چون tracemalloc اجرا را کند می‌کند
+        tracemalloc.start()
+        try:
+            func(api)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    finally:
+        hiddify.orjson = original
+    return {"users": count, "best_s": round(min(timings), 3), "peak_mb": round(peak / 2 ** 20, 1)}
+
+
+def run(users: int, payload_bytes: int, repeat: int) -> List[Dict]:
+    logger.info(f"Starting fake panel with {users:,} users")
+    server = FakePanelServer(users=users, payload_bytes=payload_bytes).start()
+    try:
+        # محدودیت نرخ پنل روی بنچمارک اثر نگذارد
+        api = HiddifyAPI(server.domain, "proxy", "bench-key", rate_limit=0, max_concurrency=0)
+        api.get_server_status()
+        results = []
+        for encoding, accept_encoding in ENCODINGS.items():
+            api.headers["Accept-Encoding"] = accept_encoding
+            size = wire_bytes(api, accept_encoding)
+            for name, (func, backend) in modes().items():
+                logger.info(f"Measuring {name} over {encoding}")
+                result = measure(api, func, backend, repeat)
+                result.update({"mode": name, "encoding": encoding, "wire_mb": round(size / 2 ** 20, 1)})
+                results.append(result)
+        return results
+    finally:
+        server.stop()
+
+
+def print_report(results: List[Dict]):
+    print(f"\n{'mode':<10}{'encoding':<10}{'users':>10}{'wire MB':>10}{'best s':>10}{'peak MB':>10}")
+    for result in results:
+        print(
+            f"{result['mode']:<10}{result['encoding']:<10}{result['users']:>10,}"
+            f"{result['wire_mb']:>10}{result['best_s']:>10}{result['peak_mb']:>10}"
+        )
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Panel user list download and JSON decoding benchmark")
+    parser.add_argument("--users", type=int, default=100_000, help="Users on the fake panel")
+    parser.add_argument("--payload-bytes", type=int, default=0, help="Extra bytes carried by every user object")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per mode (the best is reported)")
+    parser.add_argument("--report", help="Write the JSON report to this file")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.WARNING)
+    logger.setLevel(logging.INFO)
+    if hiddify.orjson is None:
+        logger.warning("orjson is not installed; only the stdlib json modes are measured")
+
+    results = run(args.users, args.payload_bytes, args.repeat)
+    print_report(results)
+
+    if args.report:
+        report = {
+            "meta": {
+                "timestamp": datetime.utcnow().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "users": args.users,
+                "payload_bytes": args.payload_bytes,
+                "repeat": args.repeat
+            },
+            "results": results
+        }
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
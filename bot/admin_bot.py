@@ -1,4 +1,5 @@
 import logging
+import os
 from typing import Dict, List, Optional
 from datetime import datetime
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton
@@ -11,13 +12,24 @@ from telegram.ext import (
     ContextTypes
 )
 from sqlalchemy.orm import Session
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+import asyncio
 
-from config import ADMIN_BOT_TOKEN, DATABASE_URL
+from config import ADMIN_BOT_TOKEN, ADMIN_TELEGRAM_ID
 from db import models, crud
+from db.session import engine, SessionLocal
 from bot.utils.hiddify import HiddifyAPI
+from bot.utils.ratelimit import BACKGROUND, offload_panel, run_panel
+from bot.utils.catalog import CATALOG
 from bot.utils.payment import PaymentManager
+from bot.utils.instrumentation import InstrumentedRequest, call_after_update, instrument_application, instrument_engine
+from bot.utils.callbacks import ACCESS_DENIED_MESSAGE, CallbackRouter, callback_data
+from bot.utils.persistence import DatabasePersistence
+from bot.utils.state_sweeper import StateSweeper
+from bot.utils.scheduler import ADMIN, PriorityUpdateProcessor
+from bot.utils.throttle import USER_THROTTLE
+from bot.utils.executor import DB_POOL, offload_module, run_blocking
+from bot.utils.panel_backup import backup_panel, format_panel_summary
+from bot.utils.migration import PanelMigration, format_progress
 
 # تنظیمات لاگینگ
 logging.basicConfig(
@@ -26,21 +38,51 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# تنظیمات دیتابیس
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# حداکثر حجم فایلی که ربات می‌تواند در تلگرام ارسال کند
+MAX_DOCUMENT_SIZE = 50 * 1024 * 1024
+
+# نسخه غیرمسدودکننده توابع crud که در استخر نخ‌های دیتابیس اجرا می‌شوند
+acrud = offload_module(crud, DB_POOL)
+
+# engine مشترک بین هر دو ربات و کارهای پس‌زمینه
+instrument_engine(engine, "main")
 
 def get_db():
     db = SessionLocal()
+    # هندلرها نشست را با next(get_db()) می‌گیرند؛ اتصال آن پس از پایان آپدیت آزاد می‌شود
+    call_after_update(db.close)
     try:
         yield db
     finally:
         db.close()
 
 class AdminBot:
-    def __init__(self):
-        self.application = Application.builder().token(ADMIN_BOT_TOKEN).build()
+    def __init__(self, base_url: Optional[str] = None):
+        builder = (
+            Application.builder()
+            .token(ADMIN_BOT_TOKEN)
+            .request(InstrumentedRequest("admin"))
+            # وضعیت گفتگو (user_data) در دیتابیس نگه داشته می‌شود تا ری‌استارت آن را پاک نکند
+            .persistence(DatabasePersistence(SessionLocal, "admin"))
+            # آپدیت‌های ادمین (از جمله تأیید پرداخت‌ها) در شلوغی ربات کاربر بدون انتظار در صف اجرا می‌شوند
+            .concurrent_updates(PriorityUpdateProcessor("admin", lambda update: ADMIN))
+        )
+        if base_url:
+            # آدرس جایگزین Bot API (برای سرور محلی یا ابزار بنچمارک)
+            builder = builder.base_url(base_url)
+        self.application = builder.build()
         self.setup_handlers()
+        instrument_application(self.application, "admin")
+        # پس از instrument_application ثبت می‌شود تا هندلر ردیابی استفاده اندازه‌گیری نشود
+        self.state_sweeper = StateSweeper(self.application, "admin")
+        # پنل‌هایی که بکاپ آن‌ها در حال انجام است
+        self.panel_backups_running = set()
+        # پنل‌هایی که در یک انتقال (به عنوان مبدأ یا مقصد) شرکت دارند
+
+    def is_admin(self, update: Update) -> bool:
+        """فقط کاربر ADMIN_TELEGRAM_ID اجازه کارهای حساس (انتقال و بکاپ پنل و ...) را دارد"""
+        user = update.effective_user
+        return bool(ADMIN_TELEGRAM_ID) and user is not None and user.id == ADMIN_TELEGRAM_ID
 
     def setup_handlers(self):
         """تنظیم هندلرهای ربات"""
@@ -52,6 +94,7 @@ class AdminBot:
         # مدیریت پنل‌ها
         self.application.add_handler(CommandHandler("add_panel", self.add_panel_command))
         self.application.add_handler(CommandHandler("panels", self.list_panels_command))
+        self.application.add_handler(CommandHandler("migrate_panel", self.migrate_panel_command))
         
         # مدیریت کاربران
         self.application.add_handler(CommandHandler("users", self.list_users_command))
@@ -62,6 +105,7 @@ class AdminBot:
         self.application.add_handler(CommandHandler("transactions", self.list_transactions_command))
         
         # هندلرهای کالبک
+        self.setup_callbacks()
         self.application.add_handler(CallbackQueryHandler(self.handle_callback))
         
         # هندلرهای پیام
@@ -105,7 +149,7 @@ class AdminBot:
         
         reply_markup = InlineKeyboardMarkup(user_management_keyboard)
         
-        await update.message.reply_text(
+        await update.effective_message.reply_text(
             "👤 مدیریت کاربران",
             reply_markup=reply_markup
         )
@@ -117,6 +161,7 @@ class AdminBot:
             "/menu - منوی اصلی\n"
             "/add_panel - افزودن پنل جدید\n"
             "/panels - مشاهده لیست پنل‌ها\n"
+            "/migrate_panel - انتقال کاربران بین پنل‌ها\n"
             "/users - مشاهده لیست کاربران\n"
             "/search_user - جستجوی کاربر\n"
             "/add_user - افزودن کاربر جدید\n"
@@ -150,20 +195,22 @@ class AdminBot:
             api_key = parts[4]
 
             # بررسی اعتبار پنل
-            hiddify = HiddifyAPI(domain, proxy_path, api_key)
-            if not hiddify.check_panel_status():
+            hiddify = offload_panel(HiddifyAPI(domain, proxy_path, api_key))
+            if not await hiddify.check_panel_status():
                 await update.message.reply_text("❌ پنل نامعتبر است یا در دسترس نیست.")
                 return
 
             # ذخیره پنل در دیتابیس
             db = next(get_db())
-            panel = crud.create_panel(
+            panel = await acrud.create_panel(
                 db,
                 name=f"Panel {domain}",
                 domain=domain,
                 proxy_path=proxy_path,
                 api_key=api_key
             )
+            # پنل جدید بدون انتظار برای بارگذاری دوره‌ای در خریدها استفاده شود
+            await CATALOG.refresh()
 
             await update.message.reply_text(
                 f"✅ پنل با موفقیت افزوده شد.\n"
@@ -175,19 +222,57 @@ class AdminBot:
             logger.error(f"Error adding panel: {e}")
             await update.message.reply_text("❌ خطا در افزودن پنل. لطفاً دوباره تلاش کنید.")
 
+    async def migrate_panel_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """دستور انتقال کاربران از یک پنل به پنل دیگر"""
+        if not self.is_admin(update):
+            await update.message.reply_text(ACCESS_DENIED_MESSAGE)
+            return
+        try:
+            source_id, target_id = int(context.args[0]), int(context.args[1])
+            limit = int(context.args[2]) if len(context.args) > 2 else None
+        except (IndexError, ValueError):
+            await update.message.reply_text(
+                "❌ لطفاً شناسه پنل مبدأ و مقصد را وارد کنید.\n"
+                "مثال: /migrate_panel 1 2\n"
+                "برای انتقال فقط بخشی از کاربران: /migrate_panel 1 2 500"
+            )
+            return
+            
+        status_message = await update.message.reply_text("⏳ در حال آماده‌سازی انتقال کاربران...")
+        
+        async def show_progress(progress):
+            await status_message.edit_text(format_progress(progress), parse_mode='HTML')
+            
+        migration = PanelMigration(engine, SessionLocal, source_id, target_id, limit=limit, on_progress=show_progress)
+        # قفل انتقال پنل‌ها بین همه پروسه‌های ربات مشترک است؛ run همین قفل را تا پایان نگه می‌دارد
+        if not await run_blocking(DB_POOL, migration.try_lock):
+            await status_message.edit_text("⏳ یکی از این پنل‌ها در حال انتقال است.")
+            return
+        
+        async def run_migration():
+            try:
+                await migration.run()
+            except Exception as e:
+                logger.error(f"Panel migration {source_id} -> {target_id} failed: {e}")
+                if migration.progress is None:
+                    await status_message.edit_text(f"❌ خطا در شروع انتقال: {e}")
+                
+        # انتقال طولانی است و نباید پردازش آپدیت‌های بعدی ربات را متوقف کند
+        context.application.create_task(run_migration(), update=update)
+
     async def list_panels_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """دستور نمایش لیست پنل‌ها"""
         db = next(get_db())
-        panels = crud.get_active_panels(db)
+        panels = await acrud.get_active_panels(db)
 
         if not panels:
-            await update.message.reply_text("❌ هیچ پنل فعالی یافت نشد.")
+            await update.effective_message.reply_text("❌ هیچ پنل فعالی یافت نشد.")
             return
 
         for panel in panels:
-            hiddify = HiddifyAPI(panel.domain, panel.proxy_path, panel.api_key)
+            hiddify = offload_panel(HiddifyAPI.for_panel(panel))
             try:
-                status = hiddify.get_server_status()
+                status = await hiddify.get_server_status()
                 message = (
                     f"🔷 <b>پنل {panel.id}: {panel.domain}</b>\n\n"
                     f"📡 وضعیت: <code>{panel.status.value}</code>\n"
@@ -199,17 +284,17 @@ class AdminBot:
                 # ایجاد دکمه‌های مدیریت پنل
                 keyboard = [
                     [
-                        InlineKeyboardButton("👥 کاربران", callback_data=f"panel_users_{panel.id}"),
-                        InlineKeyboardButton("🔄 بروزرسانی", callback_data=f"panel_refresh_{panel.id}")
+                        InlineKeyboardButton("👥 کاربران", callback_data=callback_data("panel_users", panel.id)),
+                        InlineKeyboardButton("🔄 بروزرسانی", callback_data=callback_data("panel_refresh", panel.id))
                     ],
                     [
-                        InlineKeyboardButton("⚙️ تنظیمات", callback_data=f"panel_settings_{panel.id}"),
-                        InlineKeyboardButton("❌ حذف", callback_data=f"panel_delete_{panel.id}")
+                        InlineKeyboardButton("⚙️ تنظیمات", callback_data=callback_data("panel_settings", panel.id)),
+                        InlineKeyboardButton("❌ حذف", callback_data=callback_data("panel_delete", panel.id))
                     ]
                 ]
                 reply_markup = InlineKeyboardMarkup(keyboard)
                 
-                await update.message.reply_text(message, reply_markup=reply_markup, parse_mode='HTML')
+                await update.effective_message.reply_text(message, reply_markup=reply_markup, parse_mode='HTML')
                 
             except Exception as e:
                 message = (
@@ -220,13 +305,13 @@ class AdminBot:
                 # ایجاد دکمه‌های مدیریت پنل
                 keyboard = [
                     [
-                        InlineKeyboardButton("🔄 بروزرسانی", callback_data=f"panel_refresh_{panel.id}"),
-                        InlineKeyboardButton("❌ حذف", callback_data=f"panel_delete_{panel.id}")
+                        InlineKeyboardButton("🔄 بروزرسانی", callback_data=callback_data("panel_refresh", panel.id)),
+                        InlineKeyboardButton("❌ حذف", callback_data=callback_data("panel_delete", panel.id))
                     ]
                 ]
                 reply_markup = InlineKeyboardMarkup(keyboard)
                 
-                await update.message.reply_text(message, reply_markup=reply_markup, parse_mode='HTML')
+                await update.effective_message.reply_text(message, reply_markup=reply_markup, parse_mode='HTML')
 
     async def search_user_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """جستجوی کاربر"""
@@ -242,17 +327,13 @@ class AdminBot:
         
         # جستجو بر اساس شناسه کاربر
         if search_term.isdigit():
-            user = crud.get_user(db, int(search_term))
+            user = await acrud.get_user(db, int(search_term))
             if user:
                 await self.display_user_info(update, user, db)
                 return
                 
         # جستجو بر اساس نام کاربری
-        users = db.query(models.User).filter(
-            models.User.username.ilike(f"%{search_term}%") | 
-            models.User.first_name.ilike(f"%{search_term}%") | 
-            models.User.last_name.ilike(f"%{search_term}%")
-        ).all()
+        users = await acrud.search_users(db, search_term)
         
         if not users:
             await update.message.reply_text("❌ هیچ کاربری یافت نشد.")
@@ -270,7 +351,7 @@ class AdminBot:
                 keyboard.append([
                     InlineKeyboardButton(
                         f"{user.first_name} {user.last_name}",
-                        callback_data=f"user_info_{user.id}"
+                        callback_data=callback_data("user_info", user.id)
                     )
                 ])
                 
@@ -297,7 +378,7 @@ class AdminBot:
         db = next(get_db())
         
         # بررسی وجود کاربر
-        user = crud.get_user(db, int(telegram_id))
+        user = await acrud.get_user(db, int(telegram_id))
         if user:
             await update.message.reply_text(
                 f"❌ کاربری با این شناسه از قبل وجود دارد.\n"
@@ -306,7 +387,7 @@ class AdminBot:
             return
             
         # ایجاد کاربر جدید
-        user = crud.create_user(
+        user = await acrud.create_user(
             db,
             telegram_id=int(telegram_id),
             username="",
@@ -321,7 +402,7 @@ class AdminBot:
 
     async def display_user_info(self, update: Update, user: models.User, db: Session):
         """نمایش اطلاعات کاربر"""
-        subscriptions = crud.get_user_subscriptions(db, user.id)
+        subscriptions = await acrud.get_user_subscriptions(db, user.id)
         active_subscriptions = [s for s in subscriptions if s.is_active]
         
         message = (
@@ -335,15 +416,15 @@ class AdminBot:
         # ایجاد دکمه‌های مدیریت کاربر
         keyboard = [
             [
-                InlineKeyboardButton("💰 افزایش موجودی", callback_data=f"user_add_balance_{user.id}"),
-                InlineKeyboardButton("📦 اشتراک‌ها", callback_data=f"user_subscriptions_{user.id}")
+                InlineKeyboardButton("💰 افزایش موجودی", callback_data=callback_data("user_add_balance", user.id)),
+                InlineKeyboardButton("📦 اشتراک‌ها", callback_data=callback_data("user_subscriptions", user.id))
             ],
             [
-                InlineKeyboardButton("📊 گزارش تراکنش‌ها", callback_data=f"user_transactions_{user.id}"),
-                InlineKeyboardButton("🔄 بروزرسانی", callback_data=f"user_refresh_{user.id}")
+                InlineKeyboardButton("📊 گزارش تراکنش‌ها", callback_data=callback_data("user_transactions", user.id)),
+                InlineKeyboardButton("🔄 بروزرسانی", callback_data=callback_data("user_refresh", user.id))
             ],
             [
-                InlineKeyboardButton("⚙️ تنظیمات", callback_data=f"user_settings_{user.id}")
+                InlineKeyboardButton("⚙️ تنظیمات", callback_data=callback_data("user_settings", user.id))
             ]
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
@@ -353,7 +434,8 @@ class AdminBot:
     async def list_users_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """دستور نمایش لیست کاربران"""
         db = next(get_db())
-        users = db.query(models.User).all()
+        # یک کاربر بیشتر برای تشخیص وجود صفحه بعد
+        users = await acrud.get_users(db, 11)
 
         if not users:
             await update.message.reply_text("❌ هیچ کاربری یافت نشد.")
@@ -367,7 +449,7 @@ class AdminBot:
             keyboard.append([
                 InlineKeyboardButton(
                     f"{user.first_name} {user.last_name}",
-                    callback_data=f"user_info_{user.id}"
+                    callback_data=callback_data("user_info", user.id)
                 )
             ])
             
@@ -385,10 +467,10 @@ class AdminBot:
     async def list_transactions_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """دستور نمایش لیست تراکنش‌ها"""
         db = next(get_db())
-        transactions = crud.get_pending_transactions(db)
+        transactions = await acrud.get_pending_transactions(db)
 
         if not transactions:
-            await update.message.reply_text("❌ هیچ تراکنش در انتظاری یافت نشد.")
+            await update.effective_message.reply_text("❌ هیچ تراکنش در انتظاری یافت نشد.")
             return
 
         for transaction in transactions:
@@ -404,235 +486,341 @@ class AdminBot:
             # ایجاد دکمه‌های مدیریت تراکنش
             keyboard = [
                 [
-                    InlineKeyboardButton("✅ تأیید", callback_data=f"admin_confirm_{transaction.id}"),
-                    InlineKeyboardButton("❌ رد", callback_data=f"admin_reject_{transaction.id}")
+                    InlineKeyboardButton("✅ تأیید", callback_data=callback_data("admin_confirm", transaction.id)),
+                    InlineKeyboardButton("❌ رد", callback_data=callback_data("admin_reject", transaction.id))
                 ]
             ]
             reply_markup = InlineKeyboardMarkup(keyboard)
             
-            await update.message.reply_text(message, reply_markup=reply_markup, parse_mode='HTML')
+            await update.effective_message.reply_text(message, reply_markup=reply_markup, parse_mode='HTML')
+
+    def setup_callbacks(self):
+        """ثبت مسیرهای کالبک (پیشوند callback_data -> هندلر)"""
+        self.callbacks = CallbackRouter("admin")
+        self.callbacks.add("admin_search_user", self.search_user_callback)
+        self.callbacks.add("admin_add_user", self.add_user_callback)
+        self.callbacks.add("admin_manage_user_bot", self.manage_user_bot_callback)
+        self.callbacks.add("user_bot_throttled", self.throttled_users_callback, allowed=self.is_admin)
+        self.callbacks.add("admin_server_status", self.server_status_callback)
+        # بکاپ پنل شامل uuid همه کاربران (اعتبار اشتراک‌ها) است و فقط برای ادمین ارسال می‌شود
+        self.callbacks.add("admin_panel_backup", self.panel_backup_callback, allowed=self.is_admin)
+        self.callbacks.add("backup_panel", self.backup_panel_callback, int, allowed=self.is_admin)
+        self.callbacks.add("admin_help", self.admin_help_callback)
+        self.callbacks.add("admin_settings", self.settings_callback)
+        self.callbacks.add("admin_transactions", self.list_transactions_command)
+        self.callbacks.add("admin_panels", self.list_panels_command)
+        self.callbacks.add("back_to_main_menu", self.admin_menu_command)
+        # کالبک‌های مربوط به پرداخت
+        self.callbacks.add("payment_confirm", self.payment_confirm_callback, int)
+        self.callbacks.add("payment_cancel", self.payment_cancel_callback, int)
+        self.callbacks.add("admin_confirm", self.confirm_payment_callback, int)
+        self.callbacks.add("admin_reject", self.reject_payment_callback, int)
 
     async def handle_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """پردازش کالبک‌ها"""
+        await self.callbacks.dispatch(update, context)
+
+    async def search_user_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """درخواست شناسه یا نام کاربری برای جستجو"""
+        query = update.callback_query
+        await query.message.reply_text(
+            "🔍 لطفاً شناسه کاربر یا نام کاربری را وارد کنید:\n"
+            "مثال: 123456789 یا username"
+        )
+        context.user_data['waiting_for'] = 'search_user'
+
+    async def add_user_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """درخواست اطلاعات کاربر جدید"""
+        query = update.callback_query
+        await query.message.reply_text(
+            "➕ لطفاً اطلاعات کاربر جدید را وارد کنید:\n"
+            "مثال: 123456789 علی رضایی"
+        )
+        context.user_data['waiting_for'] = 'add_user'
+
+    async def manage_user_bot_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """منوی مدیریت ربات کاربران"""
         query = update.callback_query
-        await query.answer()
+        keyboard = [
+            [
+                InlineKeyboardButton("📊 آمار کاربران", callback_data="user_bot_stats"),
+                InlineKeyboardButton("📝 پیام همگانی", callback_data="user_bot_broadcast")
+            ],
+            [
+                InlineKeyboardButton("⚙️ تنظیمات ربات", callback_data="user_bot_settings"),
+                InlineKeyboardButton("🚫 کاربران محدودشده", callback_data="user_bot_throttled")
+            ],
+            [
+                InlineKeyboardButton("🔙 بازگشت", callback_data="back_to_main_menu")
+            ]
+        ]
+        reply_markup = InlineKeyboardMarkup(keyboard)
         
-        # بررسی نوع کالبک
-        data = query.data
+        await query.message.edit_text(
+            "🤖 مدیریت ربات کاربران",
+            reply_markup=reply_markup
+        )
+
+    async def throttled_users_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """نمایش کاربرانی که بیشترین کلیک محدودشده را در ربات کاربران داشته‌اند"""
+        query = update.callback_query
+        offenders = USER_THROTTLE.offenders()
         
-        # کالبک‌های مربوط به منوی اصلی
-        if data == "admin_search_user":
-            await query.message.reply_text(
-                "🔍 لطفاً شناسه کاربر یا نام کاربری را وارد کنید:\n"
-                "مثال: 123456789 یا username"
-            )
-            context.user_data['waiting_for'] = 'search_user'
+        message = "🚫 <b>کاربران محدودشده</b>\n\n"
+        if not USER_THROTTLE.enabled:
+            message += "⚠️ محدودیت کلیک کاربران غیرفعال است (USER_THROTTLE_RATE=0).\n"
+        elif not offenders:
+            message += "✅ از زمان شروع ربات هیچ کلیکی محدود نشده است.\n"
+        else:
+            db = next(get_db())
+            users = {
+                user.telegram_id: user
+                for user in await acrud.get_users_by_telegram_ids(db, [telegram_id for telegram_id, _ in offenders])
+            }
+            now = datetime.now().timestamp()
+            for telegram_id, offender in offenders:
+                user = users.get(telegram_id)
+                name = f"{user.first_name} {user.last_name or ''}".strip() if user else "-"
+                message += (
+                    f"👤 <code>{telegram_id}</code> {name}\n"
+                    f"🔁 کلیک رد شده: <code>{offender.count}</code> | آخرین مسیر: <code>{offender.route}</code>\n"
+                    f"🕒 آخرین بار: <code>{int(now - offender.last_seen)}</code> ثانیه پیش\n\n"
+                )
+        started = datetime.fromtimestamp(USER_THROTTLE.started_at).strftime('%Y-%m-%d %H:%M')
+        message += f"\n📅 از زمان: <code>{started}</code> | کاربران در حال شمارش: <code>{USER_THROTTLE.tracked_users()}</code>"
         
-        elif data == "admin_add_user":
-            await query.message.reply_text(
-                "➕ لطفاً اطلاعات کاربر جدید را وارد کنید:\n"
-                "مثال: 123456789 علی رضایی"
-            )
-            context.user_data['waiting_for'] = 'add_user'
-            
-        elif data == "admin_manage_user_bot":
-            # منوی مدیریت ربات کاربران
-            keyboard = [
-                [
-                    InlineKeyboardButton("📊 آمار کاربران", callback_data="user_bot_stats"),
-                    InlineKeyboardButton("📝 پیام همگانی", callback_data="user_bot_broadcast")
-                ],
-                [
-                    InlineKeyboardButton("⚙️ تنظیمات ربات", callback_data="user_bot_settings"),
-                    InlineKeyboardButton("🔙 بازگشت", callback_data="back_to_main_menu")
-                ]
+        keyboard = [
+            [
+                InlineKeyboardButton("🔄 بروزرسانی", callback_data="user_bot_throttled"),
+                InlineKeyboardButton("🔙 بازگشت", callback_data="admin_manage_user_bot")
             ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await query.message.edit_text(
-                "🤖 مدیریت ربات کاربران",
-                reply_markup=reply_markup
-            )
-            
-        elif data == "admin_server_status":
-            # نمایش وضعیت سرورها
-            db = next(get_db())
-            panels = crud.get_active_panels(db)
-            
-            if not panels:
-                await query.message.reply_text("❌ هیچ پنل فعالی یافت نشد.")
-                return
-                
-            message = "📊 <b>وضعیت سرورها</b>\n\n"
-            
-            for panel in panels:
-                hiddify = HiddifyAPI(panel.domain, panel.proxy_path, panel.api_key)
-                try:
-                    status = hiddify.get_server_status()
-                    message += (
-                        f"🔷 <b>{panel.domain}</b>\n"
-                        f"💻 CPU: <code>{status['stats']['cpu']}%</code>\n"
-                        f"💾 RAM: <code>{status['stats']['ram']}%</code>\n"
-                        f"📦 دیسک: <code>{status['stats']['disk']}%</code>\n\n"
-                    )
-                except:
-                    message += (
-                        f"🔷 <b>{panel.domain}</b>\n"
-                        f"❌ خطا در دریافت وضعیت\n\n"
-                    )
+        ]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        
+        await query.message.edit_text(message, reply_markup=reply_markup, parse_mode='HTML')
+
+    async def server_status_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """نمایش وضعیت سرورها"""
+        query = update.callback_query
+        db = next(get_db())
+        panels = await acrud.get_active_panels(db)
+        
+        if not panels:
+            await query.message.reply_text("❌ هیچ پنل فعالی یافت نشد.")
+            return
             
-            keyboard = [
-                [
-                    InlineKeyboardButton("🔄 بروزرسانی", callback_data="refresh_server_status"),
-                    InlineKeyboardButton("🔙 بازگشت", callback_data="back_to_main_menu")
-                ]
+        message = "📊 <b>وضعیت سرورها</b>\n\n"
+        
+        # دریافت همزمان وضعیت همه پنل‌ها
+        statuses = await asyncio.gather(
+            *[
+                offload_panel(HiddifyAPI.for_panel(panel)).get_server_status()
+                for panel in panels
+            ],
+            return_exceptions=True
+        )
+        
+        for panel, status in zip(panels, statuses):
+            try:
+                if isinstance(status, Exception):
+                    raise status
+                message += (
+                    f"🔷 <b>{panel.domain}</b>\n"
+                    f"💻 CPU: <code>{status['stats']['cpu']}%</code>\n"
+                    f"💾 RAM: <code>{status['stats']['ram']}%</code>\n"
+                    f"📦 دیسک: <code>{status['stats']['disk']}%</code>\n\n"
+                )
+            except:
+                message += (
+                    f"🔷 <b>{panel.domain}</b>\n"
+                    f"❌ خطا در دریافت وضعیت\n\n"
+                )
+        
+        keyboard = [
+            [
+                InlineKeyboardButton("🔄 بروزرسانی", callback_data="refresh_server_status"),
+                InlineKeyboardButton("🔙 بازگشت", callback_data="back_to_main_menu")
             ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await query.message.edit_text(message, reply_markup=reply_markup, parse_mode='HTML')
-            
-        elif data == "admin_panel_backup":
-            # منوی بکاپ‌گیری از پنل‌ها
-            db = next(get_db())
-            panels = crud.get_active_panels(db)
+        ]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        
+        await query.message.edit_text(message, reply_markup=reply_markup, parse_mode='HTML')
+
+    async def panel_backup_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """منوی بکاپ‌گیری از پنل‌ها"""
+        query = update.callback_query
+        db = next(get_db())
+        panels = await acrud.get_active_panels(db)
+        
+        if not panels:
+            await query.message.reply_text("❌ هیچ پنل فعالی یافت نشد.")
+            return
             
-            if not panels:
-                await query.message.reply_text("❌ هیچ پنل فعالی یافت نشد.")
-                return
-                
-            keyboard = []
-            for panel in panels:
-                keyboard.append([
-                    InlineKeyboardButton(
-                        f"💾 بکاپ از {panel.domain}",
-                        callback_data=f"backup_panel_{panel.id}"
-                    )
-                ])
-                
+        keyboard = []
+        for panel in panels:
             keyboard.append([
-                InlineKeyboardButton("🔙 بازگشت", callback_data="back_to_main_menu")
+                InlineKeyboardButton(
+                    f"💾 بکاپ از {panel.domain}",
+                    callback_data=callback_data("backup_panel", panel.id)
+                )
             ])
             
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await query.message.edit_text(
-                "💾 <b>بکاپ‌گیری از پنل‌ها</b>\n\n"
-                "لطفاً پنل مورد نظر را انتخاب کنید:",
-                reply_markup=reply_markup,
-                parse_mode='HTML'
-            )
+        keyboard.append([
+            InlineKeyboardButton("🔙 بازگشت", callback_data="back_to_main_menu")
+        ])
+        
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        
+        await query.message.edit_text(
+            "💾 <b>بکاپ‌گیری از پنل‌ها</b>\n\n"
+            "لطفاً پنل مورد نظر را انتخاب کنید:",
+            reply_markup=reply_markup,
+            parse_mode='HTML'
+        )
+
+    async def backup_panel_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE, panel_id: int):
+        """بکاپ کاربران یک پنل و ارسال فایل آن به ادمین"""
+        query = update.callback_query
+        db = next(get_db())
+        panel = await acrud.get_panel(db, panel_id)
+        
+        if not panel:
+            await query.message.reply_text("❌ پنل مورد نظر یافت نشد.")
+            return
             
-        elif data == "admin_help":
-            # راهنمای ربات
-            help_message = (
-                "📚 <b>راهنمای ربات مدیریت</b>\n\n"
-                "🔹 <b>مدیریت کاربران:</b>\n"
-                "- جستجو، افزودن و مدیریت کاربران\n\n"
-                "🔹 <b>مدیریت ربات کاربران:</b>\n"
-                "- ارسال پیام همگانی و مشاهده آمار\n\n"
-                "🔹 <b>وضعیت سرور:</b>\n"
-                "- مشاهده آمار سرورها\n\n"
-                "🔹 <b>بکاپ پنل:</b>\n"
-                "- تهیه نسخه پشتیبان از پنل‌ها\n\n"
-                "🔹 <b>تنظیمات:</b>\n"
-                "- پیکربندی ربات و پنل‌ها\n\n"
-                "🔹 <b>تراکنش‌ها:</b>\n"
-                "- مدیریت پرداخت‌ها و تراکنش‌ها\n\n"
-                "🔹 <b>پنل‌ها:</b>\n"
-                "- مدیریت پنل‌های هیدیفای\n\n"
-            )
+        if panel_id in self.panel_backups_running:
+            await query.message.reply_text(f"⏳ بکاپ پنل {panel.domain} در حال انجام است.")
+            return
             
-            keyboard = [
-                [
-                    InlineKeyboardButton("🔙 بازگشت", callback_data="back_to_main_menu")
-                ]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+        self.panel_backups_running.add(panel_id)
+        status_message = await query.message.reply_text(f"⏳ در حال بکاپ‌گیری از پنل {panel.domain}...")
+        try:
+            api = HiddifyAPI.for_panel(panel, BACKGROUND)
+            result = await run_panel(api, backup_panel, panel.id, api)
+        except Exception as e:
+            logger.error(f"Error backing up panel {panel.domain}: {e}")
+            await status_message.edit_text(f"❌ خطا در بکاپ‌گیری از پنل {panel.domain}.")
+            return
+        finally:
+            self.panel_backups_running.discard(panel_id)
             
-            await query.message.edit_text(
-                help_message,
-                reply_markup=reply_markup,
+        summary = format_panel_summary(result, panel.domain)
+        if result.size > MAX_DOCUMENT_SIZE:
+            await status_message.edit_text(
+                f"{summary}\n\n⚠️ حجم فایل بیشتر از حد مجاز تلگرام است و فقط روی سرور ذخیره شد:\n"
+                f"<code>{result.path}</code>",
                 parse_mode='HTML'
             )
+            return
             
-        elif data == "admin_settings":
-            # منوی تنظیمات
-            keyboard = [
-                [
-                    InlineKeyboardButton("⚙️ تنظیمات عمومی", callback_data="general_settings"),
-                    InlineKeyboardButton("💰 تنظیمات پرداخت", callback_data="payment_settings")
-                ],
-                [
-                    InlineKeyboardButton("👥 تنظیمات کاربران", callback_data="user_settings"),
-                    InlineKeyboardButton("📊 تنظیمات ترافیک", callback_data="traffic_settings")
-                ],
-                [
-                    InlineKeyboardButton("🔙 بازگشت", callback_data="back_to_main_menu")
-                ]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await query.message.edit_text(
-                "⚙️ <b>تنظیمات</b>\n\n"
-                "لطفاً بخش مورد نظر را انتخاب کنید:",
-                reply_markup=reply_markup,
+        with open(result.path, "rb") as document:
+            await context.bot.send_document(
+                chat_id=query.message.chat_id,
+                document=document,
+                filename=os.path.basename(result.path),
+                caption=summary,
                 parse_mode='HTML'
             )
-            
-        elif data == "admin_transactions":
-            # لیست تراکنش‌ها
-            await self.list_transactions_command(update, context)
-            
-        elif data == "admin_panels":
-            # لیست پنل‌ها
-            await self.list_panels_command(update, context)
-            
-        elif data == "back_to_main_menu":
-            # بازگشت به منوی اصلی
-            await self.admin_menu_command(update, context)
+        await status_message.delete()
+
+    async def admin_help_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """راهنمای ربات مدیریت"""
+        query = update.callback_query
+        help_message = (
+            "📚 <b>راهنمای ربات مدیریت</b>\n\n"
+            "🔹 <b>مدیریت کاربران:</b>\n"
+            "- جستجو، افزودن و مدیریت کاربران\n\n"
+            "🔹 <b>مدیریت ربات کاربران:</b>\n"
+            "- ارسال پیام همگانی و مشاهده آمار\n\n"
+            "🔹 <b>وضعیت سرور:</b>\n"
+            "- مشاهده آمار سرورها\n\n"
+            "🔹 <b>بکاپ پنل:</b>\n"
+            "- تهیه نسخه پشتیبان از پنل‌ها\n\n"
+            "🔹 <b>تنظیمات:</b>\n"
+            "- پیکربندی ربات و پنل‌ها\n\n"
+            "🔹 <b>تراکنش‌ها:</b>\n"
+            "- مدیریت پرداخت‌ها و تراکنش‌ها\n\n"
+            "🔹 <b>پنل‌ها:</b>\n"
+            "- مدیریت پنل‌های هیدیفای\n\n"
+        )
         
-        # کالبک‌های مربوط به پرداخت
-        elif data.startswith("payment_"):
-            action, transaction_id = data.split("_")[1:]
-            db = next(get_db())
-            payment_manager = PaymentManager(db, self.application.bot)
+        keyboard = [
+            [
+                InlineKeyboardButton("🔙 بازگشت", callback_data="back_to_main_menu")
+            ]
+        ]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        
+        await query.message.edit_text(
+            help_message,
+            reply_markup=reply_markup,
+            parse_mode='HTML'
+        )
 
-            if action == "confirm":
-                # ایجاد دکمه‌های تأیید/رد برای ادمین
-                keyboard = [
-                    [
-                        InlineKeyboardButton(
-                            "✅ تأیید",
-                            callback_data=f"admin_confirm_{transaction_id}"
-                        ),
-                        InlineKeyboardButton(
-                            "❌ رد",
-                            callback_data=f"admin_reject_{transaction_id}"
-                        )
-                    ]
-                ]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                await query.message.reply_text(
-                    "لطفاً تراکنش را تأیید یا رد کنید:",
-                    reply_markup=reply_markup
+    async def settings_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """منوی تنظیمات"""
+        query = update.callback_query
+        keyboard = [
+            [
+                InlineKeyboardButton("⚙️ تنظیمات عمومی", callback_data="general_settings"),
+                InlineKeyboardButton("💰 تنظیمات پرداخت", callback_data="payment_settings")
+            ],
+            [
+                InlineKeyboardButton("👥 تنظیمات کاربران", callback_data="user_settings"),
+                InlineKeyboardButton("📊 تنظیمات ترافیک", callback_data="traffic_settings")
+            ],
+            [
+                InlineKeyboardButton("🔙 بازگشت", callback_data="back_to_main_menu")
+            ]
+        ]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        
+        await query.message.edit_text(
+            "⚙️ <b>تنظیمات</b>\n\n"
+            "لطفاً بخش مورد نظر را انتخاب کنید:",
+            reply_markup=reply_markup,
+            parse_mode='HTML'
+        )
+
+    async def payment_confirm_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE, transaction_id: int):
+        """نمایش دکمه‌های تأیید/رد یک تراکنش"""
+        query = update.callback_query
+        keyboard = [
+            [
+                InlineKeyboardButton(
+                    "✅ تأیید",
+                    callback_data=callback_data("admin_confirm", transaction_id)
+                ),
+                InlineKeyboardButton(
+                    "❌ رد",
+                    callback_data=callback_data("admin_reject", transaction_id)
                 )
+            ]
+        ]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        await query.message.reply_text(
+            "لطفاً تراکنش را تأیید یا رد کنید:",
+            reply_markup=reply_markup
+        )
 
-            elif action == "cancel":
-                await payment_manager.cancel_payment(query.from_user.id, int(transaction_id))
+    async def payment_cancel_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE, transaction_id: int):
+        """لغو یک تراکنش"""
+        db = next(get_db())
+        payment_manager = PaymentManager(db, self.application.bot)
+        await payment_manager.cancel_payment(update.callback_query.from_user.id, transaction_id)
 
-        elif data.startswith("admin_"):
-            action, transaction_id = data.split("_")[1:]
-            db = next(get_db())
-            payment_manager = PaymentManager(db, self.application.bot)
+    async def confirm_payment_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE, transaction_id: int):
+        """تأیید پرداخت و شارژ کیف پول کاربر"""
+        db = next(get_db())
+        payment_manager = PaymentManager(db, self.application.bot)
+        await payment_manager.confirm_payment(update.callback_query.from_user.id, transaction_id)
 
-            if action == "confirm":
-                await payment_manager.confirm_payment(query.from_user.id, int(transaction_id))
-            elif action == "reject":
-                # درخواست دلیل رد
-                context.user_data['rejecting_transaction'] = int(transaction_id)
-                await query.message.reply_text(
-                    "لطفاً دلیل رد تراکنش را وارد کنید:"
-                )
+    async def reject_payment_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE, transaction_id: int):
+        """درخواست دلیل رد تراکنش"""
+        context.user_data['rejecting_transaction'] = transaction_id
+        await update.callback_query.message.reply_text(
+            "لطفاً دلیل رد تراکنش را وارد کنید:"
+        )
 
     async def handle_receipt(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """پردازش رسید پرداخت"""
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+راه‌اندازی مجدد ربات بدون قطعی
+
+پروسه جدید ربات (bot/main.py --handoff-from) در کنار پروسه در حال اجرا بالا می‌آید و همه
+مراحل راه‌اندازی را انجام می‌دهد، سپس به پروسه قبلی SIGTERM می‌دهد و بعد از توقف پولینگ
+آن، پولینگ را شروع می‌کند. پروسه قبلی آپدیت‌های صف و هندلرهای در حال اجرا را تمام
+می‌کند و خارج می‌شود. این اسکریپت تا سالم گزارش شدن پروسه جدید در /healthz صبر می‌کند.
+
+در سرویس systemd به صورت ExecReload اجرا می‌شود (systemctl reload foxybot.service) تا
+پروسه جدید داخل همان سرویس بماند و با sd_notify پروسه اصلی سرویس شود.
+
+مثال:
+    python bot/handoff.py --check
+    python bot/handoff.py --timeout 60
+
+کد خروج: ۰ موفق، ۱ ناموفق، ۲ ربات در حال اجرا از جابه‌جایی پشتیبانی نمی‌کند (راه‌اندازی مجدد معمولی لازم است)
+"""
+
+import os
+import sys
+import time
+import signal
+import argparse
+import logging
+import subprocess
+from typing import Dict, Optional
+
+import requests
+
+# اضافه کردن مسیر پروژه به سیستم
+PROJECT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, PROJECT_DIR)
+
+from config import METRICS_HOST, METRICS_PORT, HANDOFF_TIMEOUT
+
+# تنظیمات لاگینگ
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger("handoff")
+
+
+def health_url() -> str:
+    host = "127.0.0.1" if METRICS_HOST in ("", "0.0.0.0", "::") else METRICS_HOST
+    if ":" in host:
+        host = f"[{host}]"
+    return f"http://{host}:{METRICS_PORT}/healthz"
+
+
+def read_health() -> Optional[Dict]:
+    """وضعیت پروسه‌ای که اکنون پورت متریک‌ها را دارد (None اگر در دسترس نباشد)"""
+    try:
+        response = requests.get(health_url(), timeout=2)
+    except requests.RequestException:
+        return None
+    if response.status_code not in (200, 503):
+        return None
+    try:
+        return response.json()
+    except ValueError:
+        return None
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Replace the running bot process without downtime")
+    parser.add_argument("--check", action="store_true", help="Only check that the running bot supports a handoff")
+    parser.add_argument("--timeout", type=float, default=HANDOFF_TIMEOUT, help="Seconds to wait for the new process")
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_args()
+    if not METRICS_PORT:
+        logger.error("A handoff needs the /healthz endpoint; METRICS_PORT is 0")
+        return 2
+
+    current = read_health()
+    if not current or current.get("status") != "ready":
+        logger.error(f"No ready bot process answers {health_url()}: {current}")
+        return 2
+    old_pid = current["pid"]
+    if args.check:
+        logger.info(f"Bot process {old_pid} supports a handoff")
+        return 0
+
+    logger.info(f"Starting a new bot process to replace process {old_pid}...")
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(PROJECT_DIR, "bot", "main.py"), "--handoff-from", str(old_pid)],
+        cwd=PROJECT_DIR,
+        stdin=subprocess.DEVNULL,
+        start_new_session=True
+    )
+
+    deadline = time.monotonic() + args.timeout
+    while time.monotonic() < deadline:
+        time.sleep(0.5)
+        if process.poll() is not None:
+            logger.error(f"New bot process exited with code {process.returncode}")
+            return 1
+        health = read_health()
+        if health and health.get("pid") == process.pid and health.get("status") == "ready":
+            logger.info(f"Bot process {process.pid} took over from process {old_pid}")
+            return 0
+
+    health = read_health()
+    if health and health.get("pid") == old_pid and health.get("status") == "ready":
+        # پروسه جدید هنوز سراغ پروسه قبلی نرفته؛ ربات قبلی بدون تغییر به کار ادامه می‌دهد
+        logger.error(f"New bot process was not ready within {args.timeout:.0f}s, stopping it")
+        process.send_signal(signal.SIGTERM)
+        return 1
+    logger.error(f"New bot process {process.pid} did not report ready within {args.timeout:.0f}s: {health}")
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,9 +2,24 @@ import logging
 import os
 import sys
 import asyncio
+import argparse
 import signal
+from typing import Optional
+from db.session import SessionLocal, engine
 from bot.admin_bot import AdminBot
 from bot.user_bot import UserBot
+from bot.utils.provisioning import ProvisioningWorker
+from bot.utils.expiry import ExpiryWorker
+from bot.utils.backup import BackupWorker
+from bot.utils.reconcile import Reconciler
+from bot.utils.leader import run_exclusive
+from bot.utils import executor, resolver
+from bot.utils.bootstrap import StartupTimer, prepare_database, load_catalog, initialize_bots
+from bot.utils.catalog import CATALOG
+from bot.utils.callbacks import CALLBACK_STORE
+from bot.utils.migration import recover_interrupted_migrations
+from bot.utils.lifecycle import LIFECYCLE, READY, DRAINING, notify_systemd, take_over, stop_polling, drain
+from bot.utils.metrics import start_metrics_server, set_health_check
 from config import ADMIN_BOT_TOKEN, USER_BOT_TOKEN
 
 # تنظیمات لاگینگ
@@ -23,8 +38,16 @@ def signal_handler():
     logger.info("Received stop signal! Shutting down...")
     stop_event.set()
 
-async def main():
-    """تابع اصلی برای اجرای ربات‌ها"""
+async def main(handoff_from: Optional[int] = None):
+    """تابع اصلی برای اجرای ربات‌ها
+
+    با handoff_from (شناسه پروسه ربات در حال اجرا، توسط bot/handoff.py) همه مراحل
+    راه‌اندازی در کنار پروسه قبلی انجام می‌شود و پولینگ فقط پس از توقف پولینگ آن شروع می‌شود.
+    """
+    background_tasks = []
+    metrics_server = None
+    admin_app = user_app = None
+    timer = StartupTimer()
     try:
         logger.info("Starting FoxyVPN Telegram Bots...")
         
@@ -40,12 +63,28 @@ async def main():
         logger.info(f"Admin Bot Token: {ADMIN_BOT_TOKEN[:6]}...{ADMIN_BOT_TOKEN[-6:]}")
         logger.info(f"User Bot Token: {USER_BOT_TOKEN[:6]}...{USER_BOT_TOKEN[-6:]}")
         
-        # ایجاد نمونه‌های ربات
-        logger.info("Initializing Admin Bot...")
-        admin_bot = AdminBot()
+        # کش DNS مشترک برای اتصال به پنل‌ها و تلگرام
+        resolver.install()
+        
+        # راه‌اندازی endpoint متریک‌ها و /healthz روی پورت محلی (در حالت جابه‌جایی، پورت هنوز دست پروسه قبلی است)
+        set_health_check(LIFECYCLE.health)
+        if not handoff_from:
+            metrics_server = await start_metrics_server()
         
-        logger.info("Initializing User Bot...")
-        user_bot = UserBot()
+        # باز کردن اتصال‌های استخر مشترک دیتابیس، بررسی ساختار آن و بارگذاری پلن‌ها و پنل‌ها
+        await prepare_database(engine, timer)
+        await load_catalog(SessionLocal, timer)
+        if not handoff_from:
+            # انتقال کاربرانی که با کرش پروسه قبلی نیمه‌کاره مانده، پنل مبدأ را در MAINTENANCE و صف آن را متوقف نگه ندارد
+            await executor.run_blocking(executor.DB_POOL, recover_interrupted_migrations, engine, SessionLocal)
+        
+        # ایجاد نمونه‌های ربات
+        with timer.phase("handlers"):
+            logger.info("Initializing Admin Bot...")
+            admin_bot = AdminBot()
+            
+            logger.info("Initializing User Bot...")
+            user_bot = UserBot()
         
         # تنظیم مدیریت سیگنال‌ها برای توقف نرم ربات‌ها
         for sig in (signal.SIGINT, signal.SIGTERM):
@@ -57,24 +96,68 @@ async def main():
         admin_app = admin_bot.application
         user_app = user_bot.application
         
-        # اینیشیالایز کردن ربات‌ها
-        await admin_app.initialize()
-        await user_app.initialize()
+        # اینیشیالایز کردن ربات‌ها همزمان با باز کردن اتصال به پنل‌ها پیش از دریافت اولین آپدیت
+        await initialize_bots(timer, admin_app, user_app)
+        LIFECYCLE.watch(admin_app, user_app)
         
-        # شروع ربات‌ها
-        await admin_app.start()
-        await user_app.start()
+        if handoff_from:
+            with timer.phase("handoff"):
+                metrics_server = await take_over(handoff_from)
         
-        # شروع پولینگ برای هر دو ربات
-        await admin_app.updater.start_polling(
-            allowed_updates=["message", "callback_query", "my_chat_member", "chat_member"]
-        )
-        logger.info("Admin bot polling started successfully")
+        with timer.phase("polling"):
+            # شروع ربات‌ها
+            await admin_app.start()
+            await user_app.start()
+            
+            # شروع پولینگ برای هر دو ربات
+            await admin_app.updater.start_polling(
+                allowed_updates=["message", "callback_query", "my_chat_member", "chat_member"]
+            )
+            logger.info("Admin bot polling started successfully")
+            
+            await user_app.updater.start_polling(
+                allowed_updates=["message", "callback_query", "my_chat_member", "chat_member"]
+            )
+            logger.info("User bot polling started successfully")
+        logger.info(timer.summary())
+        LIFECYCLE.set_state(READY)
+        notify_systemd(READY=1)
         
-        await user_app.updater.start_polling(
-            allowed_updates=["message", "callback_query", "my_chat_member", "chat_member"]
-        )
-        logger.info("User bot polling started successfully")
+        # راه‌اندازی کارهای پس‌زمینه؛ هر کار فقط در یک نسخه از ربات اجرا می‌شود
+        provisioning_worker = ProvisioningWorker(SessionLocal, user_app.bot)
+        background_tasks.append(asyncio.create_task(
+            run_exclusive(engine, "provisioning", provisioning_worker.run)
+        ))
+        
+        expiry_worker = ExpiryWorker(SessionLocal)
+        background_tasks.append(asyncio.create_task(
+            run_exclusive(engine, "expiry", expiry_worker.run)
+        ))
+        
+        # بکاپ جریانی دیتابیس طبق CRON_BACKUP_INTERVAL و ارسال گزارش به ادمین
+        backup_worker = BackupWorker(engine, admin_app.bot)
+        background_tasks.append(asyncio.create_task(
+            run_exclusive(engine, "database_backup", backup_worker.run)
+        ))
+        
+        # مغایرت‌گیری دوره‌ای اشتراک‌ها با کاربران پنل‌ها
+        reconciler = Reconciler(SessionLocal, admin_app.bot)
+        background_tasks.append(asyncio.create_task(
+            run_exclusive(engine, "reconcile", reconciler.run)
+        ))
+        
+        # بارگذاری دوره‌ای پلن‌ها و پنل‌ها برای دیدن تغییرات نسخه‌های دیگر ربات
+        background_tasks.append(asyncio.create_task(CATALOG.run()))
+        
+        # حذف وضعیت‌های گفتگوی بلااستفاده از حافظه هر ربات (در همه نسخه‌ها اجرا می‌شود)
+        for bot in (admin_bot, user_bot):
+            background_tasks.append(asyncio.create_task(bot.state_sweeper.run()))
+        # نوشتن توکن‌های کالبک در دیتابیس و حذف توکن‌های منقضی (در همه نسخه‌ها اجرا می‌شود)
+        background_tasks.append(asyncio.create_task(CALLBACK_STORE.run()))
+        # حذف ردیف‌های وضعیت گفتگوی منقضی از دیتابیس
+        background_tasks.append(asyncio.create_task(
+            run_exclusive(engine, "conversation_state_purge", user_app.persistence.run)
+        ))
         
         # انتظار برای سیگنال توقف
         logger.info("Both bots are running. Press Ctrl+C to stop.")
@@ -88,16 +171,26 @@ async def main():
     finally:
         # متوقف کردن ربات‌ها در صورت وجود
         logger.info("Stopping bots...")
+        LIFECYCLE.set_state(DRAINING)
+        notify_systemd(STOPPING=1)
         try:
-            # توقف و شات‌داون ربات‌ها
-            if admin_app.is_initialized():
-                await admin_app.stop()
-                await admin_app.shutdown()
-                
-            if user_app.is_initialized():
-                await user_app.stop()
-                await user_app.shutdown()
+            # توقف دریافت آپدیت‌های جدید؛ آزاد شدن پورت متریک‌ها به پروسه جایگزین (در صورت وجود) اعلام می‌کند که پولینگ را شروع کند
+            await stop_polling(admin_app, user_app)
+            if metrics_server:
+                metrics_server.close()
+            
+            # توقف کارهای پس‌زمینه تا قفل‌های آن‌ها زودتر به پروسه جایگزین برسد
+            for task in background_tasks:
+                task.cancel()
+            await asyncio.gather(*background_tasks, return_exceptions=True)
+            
+            # پردازش آپدیت‌های صف و پایان هندلرهای در حال اجرا تا DRAIN_TIMEOUT، سپس شات‌داون ربات‌ها
+            await drain(admin_app, user_app)
+            for app in (admin_app, user_app):
+                if app is not None:
+                    await app.shutdown()
                 
+            executor.shutdown(wait=False)
             logger.info("Both bots have been shut down gracefully.")
         except Exception as e:
             logger.error(f"Error shutting down bots: {e}")
@@ -106,9 +199,16 @@ if __name__ == "__main__":
     # تنظیم مسیر Python برای import کردن ماژول‌ها
     sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
     
+    parser = argparse.ArgumentParser(description="Run the FoxyVPN admin and user bots")
+    parser.add_argument(
+        "--handoff-from", type=int, metavar="PID",
+        help="Start next to the running bot process PID and take over once ready (used by bot/handoff.py)"
+    )
+    args = parser.parse_args()
+    
     # اجرای برنامه اصلی
     try:
-        asyncio.run(main())
+        asyncio.run(main(args.handoff_from))
     except KeyboardInterrupt:
         logger.info("Bot stopped by user!")
     except Exception as e:
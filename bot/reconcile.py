@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import asyncio
+import argparse
+import logging
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+# اضافه کردن مسیر پروژه به سیستم
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from config import DATABASE_URL, RECONCILE_REPORT_DIR
+from bot.utils import executor
+from bot.utils.reconcile import Reconciler
+
+# تنظیمات لاگینگ
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Compare the subscriptions table with Hiddify panel users")
+    parser.add_argument("--panel", type=int, help="Only reconcile this panel id (default: all active panels)")
+    parser.add_argument("--apply", action="store_true", help="Repair the differences instead of only reporting them")
+    parser.add_argument("--report-dir", default=RECONCILE_REPORT_DIR, help="Directory for the JSONL reports")
+    return parser.parse_args()
+
+
+async def main() -> int:
+    """اجرای یک دور مغایرت‌گیری از خط فرمان"""
+    args = parse_args()
+    engine = create_engine(DATABASE_URL)
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    try:
+        reconciler = Reconciler(SessionLocal, apply=args.apply, report_dir=args.report_dir)
+        results = await reconciler.run_once(args.panel)
+        for result in results:
+            logger.info(
+                f"{result.domain}: {result.subscriptions} subscriptions, {result.panel_users} panel users, "
+                f"differences {result.counts or 'none'}, fixed {result.fixed}, failed {result.failed} "
+                f"({result.duration:.1f}s) -> {result.report_path}"
+            )
+        return 0 if results else 1
+    finally:
+        executor.shutdown(wait=False)
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -1,7 +1,9 @@
 import logging
+import functools
 from typing import Dict, List, Optional
-from datetime import datetime, timedelta
+from datetime import datetime
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -11,14 +13,24 @@ from telegram.ext import (
     ContextTypes
 )
 from sqlalchemy.orm import Session
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
 import asyncio
+from uuid import uuid4
 
-from config import USER_BOT_TOKEN, DATABASE_URL, DEFAULT_PLANS, PAYMENT_CARD_NUMBER
+from config import USER_BOT_TOKEN, PAYMENT_CARD_NUMBER
 from db import models, crud
+from db.session import engine, SessionLocal
 from bot.utils.hiddify import HiddifyAPI
+from bot.utils.ratelimit import PanelBusyError, offload_panel
+from bot.utils.catalog import CATALOG
 from bot.utils.payment import PaymentManager
+from bot.utils.instrumentation import InstrumentedRequest, call_after_update, instrument_application, instrument_engine
+from bot.utils.callbacks import CallbackRouter, callback_data
+from bot.utils.persistence import DatabasePersistence
+from bot.utils.state_sweeper import StateSweeper
+from bot.utils.scheduler import PriorityUpdateProcessor, classify_update
+from bot.utils.throttle import MENU, DATABASE, PANEL, USER_THROTTLE, ViewCache
+from bot.utils.executor import DB_POOL, offload_module, run_blocking
+from bot.utils.provisioning import build_user_payload, enqueue_panel_job, wake_worker
 
 # تنظیمات لاگینگ
 logging.basicConfig(
@@ -27,21 +39,47 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# تنظیمات دیتابیس
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# نسخه غیرمسدودکننده توابع crud که در استخر نخ‌های دیتابیس اجرا می‌شوند
+acrud = offload_module(crud, DB_POOL)
+
+# کالبک‌های پرداخت که مثل رسیدها فقط پس از آپدیت‌های ادمین اجرا می‌شوند و هرگز حذف نمی‌شوند
+PAYMENT_ROUTES = ("confirm_buy", "send_receipt")
+
+# engine مشترک بین هر دو ربات و کارهای پس‌زمینه
+instrument_engine(engine, "main")
 
 def get_db():
     db = SessionLocal()
+    # هندلرها نشست را با next(get_db()) می‌گیرند؛ اتصال آن پس از پایان آپدیت آزاد می‌شود
+    call_after_update(db.close)
     try:
         yield db
     finally:
         db.close()
 
 class UserBot:
-    def __init__(self):
-        self.application = Application.builder().token(USER_BOT_TOKEN).build()
+    def __init__(self, base_url: Optional[str] = None):
+        builder = (
+            Application.builder()
+            .token(USER_BOT_TOKEN)
+            .request(InstrumentedRequest("user"))
+            # وضعیت گفتگو (user_data) در دیتابیس نگه داشته می‌شود تا ری‌استارت آن را پاک نکند
+            .persistence(DatabasePersistence(SessionLocal, "user"))
+            # آپدیت‌ها به ترتیب اولویت در صف مشترک اجرا می‌شوند و در شلوغی پیام‌های کم‌اهمیت حذف می‌شوند
+            .concurrent_updates(PriorityUpdateProcessor(
+                "user", functools.partial(classify_update, payment_routes=PAYMENT_ROUTES)
+            ))
+        )
+        if base_url:
+            # آدرس جایگزین Bot API (برای سرور محلی یا ابزار بنچمارک)
+            builder = builder.base_url(base_url)
+        self.application = builder.build()
+        # آخرین اطلاعات اشتراک هر کاربر برای کلیک‌های مکرر «دریافت کانفیگ»
+        self.config_views = ViewCache()
         self.setup_handlers()
+        instrument_application(self.application, "user")
+        # پس از instrument_application ثبت می‌شود تا هندلر ردیابی استفاده اندازه‌گیری نشود
+        self.state_sweeper = StateSweeper(self.application, "user")
 
     def setup_handlers(self):
         """تنظیم هندلرهای ربات"""
@@ -58,6 +96,7 @@ class UserBot:
         self.application.add_handler(CommandHandler("wallet", self.wallet_command))
         
         # هندلرهای کالبک
+        self.setup_callbacks()
         self.application.add_handler(CallbackQueryHandler(self.handle_callback))
         
         # هندلرهای پیام
@@ -69,10 +108,10 @@ class UserBot:
         db = next(get_db())
         
         # بررسی وجود کاربر در دیتابیس
-        db_user = crud.get_user(db, user.id)
+        db_user = await acrud.get_user(db, user.id)
         if not db_user:
             # ایجاد کاربر جدید
-            db_user = crud.create_user(
+            db_user = await acrud.create_user(
                 db,
                 telegram_id=user.id,
                 username=user.username,
@@ -108,7 +147,7 @@ class UserBot:
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        await update.message.reply_text(welcome_message, reply_markup=reply_markup, parse_mode='HTML')
+        await update.effective_message.reply_text(welcome_message, reply_markup=reply_markup, parse_mode='HTML')
 
     async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """دستور راهنما"""
@@ -137,18 +176,18 @@ class UserBot:
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        await update.message.reply_text(help_message, reply_markup=reply_markup, parse_mode='HTML')
+        await update.effective_message.reply_text(help_message, reply_markup=reply_markup, parse_mode='HTML')
 
     async def profile_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """دستور نمایش پروفایل"""
         db = next(get_db())
-        user = crud.get_user(db, update.effective_user.id)
+        user = await acrud.get_user(db, update.effective_user.id)
         
         if not user:
-            await update.message.reply_text("❌ خطا در دریافت اطلاعات کاربر.")
+            await update.effective_message.reply_text("❌ خطا در دریافت اطلاعات کاربر.")
             return
         
-        subscriptions = crud.get_user_subscriptions(db, user.id)
+        subscriptions = await acrud.get_user_subscriptions(db, user.id)
         active_subscriptions = [s for s in subscriptions if s.is_active]
         
         message = (
@@ -177,18 +216,12 @@ class UserBot:
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        await update.message.reply_text(message, reply_markup=reply_markup, parse_mode='HTML')
+        await update.effective_message.reply_text(message, reply_markup=reply_markup, parse_mode='HTML')
 
     async def list_plans_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """دستور نمایش لیست پلن‌ها"""
-        db = next(get_db())
-        plans = crud.get_active_plans(db)
-        
-        if not plans:
-            # ایجاد پلن‌های پیش‌فرض
-            for plan_data in DEFAULT_PLANS:
-                crud.create_plan(db, **plan_data)
-            plans = crud.get_active_plans(db)
+        # پلن‌ها (و پلن‌های پیش‌فرض) هنگام شروع ربات در حافظه بارگذاری شده‌اند
+        plans = (await CATALOG.ensure_loaded(SessionLocal)).plans
         
         message = "🛍️ <b>فروشگاه اشتراک‌ها</b>\n\n"
         
@@ -208,7 +241,7 @@ class UserBot:
             keyboard.append([
                 InlineKeyboardButton(
                     f"✨ خرید پلن {plan.name} ✨",
-                    callback_data=f"buy_plan_{plan.id}"
+                    callback_data=callback_data("buy_plan", plan.id)
                 )
             ])
         
@@ -217,12 +250,14 @@ class UserBot:
         ])
         
         reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.message.reply_text(message, reply_markup=reply_markup, parse_mode='HTML')
+        await update.effective_message.reply_text(message, reply_markup=reply_markup, parse_mode='HTML')
 
     async def list_subscriptions_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """دستور نمایش لیست اشتراک‌ها"""
         db = next(get_db())
-        subscriptions = crud.get_user_subscriptions(db, update.effective_user.id)
+        user = await acrud.get_user(db, update.effective_user.id)
+        # اشتراک‌ها با شناسه کاربر در دیتابیس ثبت شده‌اند، نه شناسه تلگرام
+        subscriptions = await acrud.get_user_subscriptions(db, user.id) if user else []
         
         if not subscriptions:
             # دکمه‌های خرید اشتراک
@@ -232,7 +267,7 @@ class UserBot:
             ]
             reply_markup = InlineKeyboardMarkup(keyboard)
             
-            await update.message.reply_text(
+            await update.effective_message.reply_text(
                 "❌ شما هیچ اشتراکی ندارید.\n\n"
                 "برای خرید اشتراک، از دکمه زیر استفاده کنید:",
                 reply_markup=reply_markup
@@ -265,17 +300,17 @@ class UserBot:
                     [
                         InlineKeyboardButton(
                             "📥 دریافت کانفیگ",
-                            callback_data=f"get_config_{sub.id}"
+                            callback_data=callback_data("get_config", sub.id)
                         ),
                         InlineKeyboardButton(
                             "🔄 تمدید",
-                            callback_data=f"renew_sub_{sub.id}"
+                            callback_data=callback_data("renew_sub", sub.id)
                         )
                     ]
                 ]
                 reply_markup = InlineKeyboardMarkup(keyboard)
                 
-                await update.message.reply_text(message, reply_markup=reply_markup, parse_mode='HTML')
+                await update.effective_message.reply_text(message, reply_markup=reply_markup, parse_mode='HTML')
                 message = ""  # پاک کردن پیام برای اشتراک بعدی
         
         if inactive_subs and not active_subs:
@@ -296,7 +331,7 @@ class UserBot:
             ]
             reply_markup = InlineKeyboardMarkup(keyboard)
             
-            await update.message.reply_text(message, reply_markup=reply_markup, parse_mode='HTML')
+            await update.effective_message.reply_text(message, reply_markup=reply_markup, parse_mode='HTML')
         elif not active_subs:
             # دکمه‌های خرید اشتراک
             keyboard = [
@@ -305,7 +340,7 @@ class UserBot:
             ]
             reply_markup = InlineKeyboardMarkup(keyboard)
             
-            await update.message.reply_text(
+            await update.effective_message.reply_text(
                 "📊 <b>اشتراک‌های شما</b>\n\n"
                 "❌ شما هیچ اشتراک فعالی ندارید.\n\n"
                 "برای خرید اشتراک، از دکمه زیر استفاده کنید:",
@@ -316,10 +351,10 @@ class UserBot:
     async def wallet_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """دستور نمایش موجودی و تراکنش‌ها"""
         db = next(get_db())
-        user = crud.get_user(db, update.effective_user.id)
+        user = await acrud.get_user(db, update.effective_user.id)
         
         if not user:
-            await update.message.reply_text("❌ خطا در دریافت اطلاعات کاربر.")
+            await update.effective_message.reply_text("❌ خطا در دریافت اطلاعات کاربر.")
             return
         
         message = (
@@ -351,332 +386,316 @@ class UserBot:
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        await update.message.reply_text(message, reply_markup=reply_markup, parse_mode='HTML')
+        await update.effective_message.reply_text(message, reply_markup=reply_markup, parse_mode='HTML')
+
+    def setup_callbacks(self):
+        """ثبت مسیرهای کالبک (پیشوند callback_data -> هندلر)"""
+        # هزینه هر مسیر از سطل توکن کاربر: منوها ارزان، کوئری‌های دیتابیس متوسط و دریافت از پنل گران
+        self.callbacks = CallbackRouter("user", throttle=USER_THROTTLE)
+        self.callbacks.add("back_to_main", self.start_command, cost=DATABASE)
+        self.callbacks.add("view_plans", self.list_plans_command, cost=MENU)
+        self.callbacks.add("view_profile", self.profile_command, cost=DATABASE)
+        self.callbacks.add("refresh_profile", self.profile_command, cost=DATABASE)
+        self.callbacks.add("wallet_charge", self.wallet_command, cost=DATABASE)
+        self.callbacks.add("refresh_wallet", self.wallet_command, cost=DATABASE)
+        self.callbacks.add("view_subscriptions", self.list_subscriptions_command, cost=DATABASE)
+        self.callbacks.add("help", self.help_command, cost=MENU)
+        self.callbacks.add("support", self.support_callback, cost=MENU)
+        self.callbacks.add("buy_plan", self.buy_plan_callback, int, cost=DATABASE)
+        self.callbacks.add("confirm_buy", self.confirm_buy_callback, int, cost=DATABASE)
+        self.callbacks.add("get_config", self.get_config_callback, int, cost=PANEL, on_throttled=self.cached_config_callback)
+        self.callbacks.add("send_receipt", self.send_receipt_callback, cost=MENU)
+        self.callbacks.add("transaction_history", self.transaction_history_callback, cost=DATABASE)
 
     async def handle_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """پردازش کالبک‌ها"""
+        await self.callbacks.dispatch(update, context)
+
+    async def support_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """نمایش راه‌های ارتباط با پشتیبانی"""
+        query = update.callback_query
+        message = (
+            "📞 <b>پشتیبانی</b>\n\n"
+            "برای ارتباط با پشتیبانی، می‌توانید از روش‌های زیر استفاده کنید:\n\n"
+            "1️⃣ ارسال پیام به ادمین: @admin_username\n"
+            "2️⃣ ایمیل: support@example.com\n"
+            "3️⃣ کانال اطلاع‌رسانی: @channel_username\n\n"
+            "⏱ زمان پاسخگویی: 9 صبح تا 9 شب"
+        )
+        
+        keyboard = [
+            [InlineKeyboardButton("🔙 بازگشت", callback_data="back_to_main")]
+        ]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        
+        await query.message.edit_text(message, reply_markup=reply_markup, parse_mode='HTML')
+
+    async def buy_plan_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE, plan_id: int):
+        """نمایش تأیید خرید یک پلن"""
         query = update.callback_query
-        await query.answer()
+        db = next(get_db())
         
-        # بررسی نوع کالبک
-        data = query.data
+        # دریافت اطلاعات پلن و کاربر
+        plan = await acrud.get_plan(db, plan_id)
+        user = await acrud.get_user(db, query.from_user.id)
         
-        if data == "back_to_main":
-            # بازگشت به منوی اصلی
-            await self.start_command(update, context)
-            
-        elif data == "view_plans":
-            # نمایش لیست پلن‌ها
-            await self.list_plans_command(update, context)
-            
-        elif data == "view_profile":
-            # نمایش پروفایل
-            await self.profile_command(update, context)
-            
-        elif data == "wallet_charge":
-            # شارژ کیف پول
-            await self.wallet_command(update, context)
-            
-        elif data == "view_subscriptions":
-            # نمایش اشتراک‌ها
-            await self.list_subscriptions_command(update, context)
-            
-        elif data == "help":
-            # نمایش راهنما
-            await self.help_command(update, context)
-            
-        elif data == "support":
-            # ارتباط با پشتیبانی
+        if not plan or not user:
+            await query.message.reply_text("❌ خطا در دریافت اطلاعات.")
+            return
+        
+        # بررسی موجودی
+        if user.wallet_balance < plan.price:
             message = (
-                "📞 <b>پشتیبانی</b>\n\n"
-                "برای ارتباط با پشتیبانی، می‌توانید از روش‌های زیر استفاده کنید:\n\n"
-                "1️⃣ ارسال پیام به ادمین: @admin_username\n"
-                "2️⃣ ایمیل: support@example.com\n"
-                "3️⃣ کانال اطلاع‌رسانی: @channel_username\n\n"
-                "⏱ زمان پاسخگویی: 9 صبح تا 9 شب"
+                f"❌ <b>موجودی ناکافی</b>\n\n"
+                f"💰 موجودی شما: <code>{user.wallet_balance:,}</code> تومان\n"
+                f"💰 قیمت پلن: <code>{plan.price:,}</code> تومان\n"
+                f"💰 کسری موجودی: <code>{plan.price - user.wallet_balance:,}</code> تومان\n\n"
+                "لطفاً ابتدا کیف پول خود را شارژ کنید."
             )
             
             keyboard = [
-                [InlineKeyboardButton("🔙 بازگشت", callback_data="back_to_main")]
+                [InlineKeyboardButton("💰 شارژ کیف پول", callback_data="wallet_charge")],
+                [InlineKeyboardButton("🔙 بازگشت", callback_data="view_plans")]
             ]
             reply_markup = InlineKeyboardMarkup(keyboard)
             
             await query.message.edit_text(message, reply_markup=reply_markup, parse_mode='HTML')
-            
-        elif data.startswith("buy_plan_"):
-            plan_id = int(data.split("_")[2])
-            db = next(get_db())
-            
-            # دریافت اطلاعات پلن و کاربر
-            plan = db.query(models.Plan).get(plan_id)
-            user = crud.get_user(db, query.from_user.id)
-            
-            if not plan or not user:
-                await query.message.reply_text("❌ خطا در دریافت اطلاعات.")
-                return
-            
-            # بررسی موجودی
-            if user.wallet_balance < plan.price:
-                message = (
-                    f"❌ <b>موجودی ناکافی</b>\n\n"
-                    f"💰 موجودی شما: <code>{user.wallet_balance:,}</code> تومان\n"
-                    f"💰 قیمت پلن: <code>{plan.price:,}</code> تومان\n"
-                    f"💰 کسری موجودی: <code>{plan.price - user.wallet_balance:,}</code> تومان\n\n"
-                    "لطفاً ابتدا کیف پول خود را شارژ کنید."
-                )
-                
-                keyboard = [
-                    [InlineKeyboardButton("💰 شارژ کیف پول", callback_data="wallet_charge")],
-                    [InlineKeyboardButton("🔙 بازگشت", callback_data="view_plans")]
-                ]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                
-                await query.message.edit_text(message, reply_markup=reply_markup, parse_mode='HTML')
-                return
-            
-            # نمایش تأیید خرید
-            message = (
-                f"🛒 <b>تأیید خرید</b>\n\n"
-                f"📦 پلن: <b>{plan.name}</b>\n"
-                f"⏱ مدت زمان: <code>{plan.duration_days}</code> روز\n"
-                f"📊 ترافیک: <code>{plan.traffic_gb}</code> گیگابایت\n"
-                f"💰 قیمت: <code>{plan.price:,}</code> تومان\n\n"
-                f"💰 موجودی فعلی: <code>{user.wallet_balance:,}</code> تومان\n"
-                f"💰 موجودی پس از خرید: <code>{user.wallet_balance - plan.price:,}</code> تومان\n\n"
-                "آیا از خرید این پلن اطمینان دارید؟"
+            return
+        
+        # نمایش تأیید خرید
+        message = (
+            f"🛒 <b>تأیید خرید</b>\n\n"
+            f"📦 پلن: <b>{plan.name}</b>\n"
+            f"⏱ مدت زمان: <code>{plan.duration_days}</code> روز\n"
+            f"📊 ترافیک: <code>{plan.traffic_gb}</code> گیگابایت\n"
+            f"💰 قیمت: <code>{plan.price:,}</code> تومان\n\n"
+            f"💰 موجودی فعلی: <code>{user.wallet_balance:,}</code> تومان\n"
+            f"💰 موجودی پس از خرید: <code>{user.wallet_balance - plan.price:,}</code> تومان\n\n"
+            "آیا از خرید این پلن اطمینان دارید؟"
+        )
+        
+        keyboard = [
+            [
+                InlineKeyboardButton("✅ تأیید و خرید", callback_data=callback_data("confirm_buy", plan_id)),
+                InlineKeyboardButton("❌ انصراف", callback_data="view_plans")
+            ]
+        ]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        
+        await query.message.edit_text(message, reply_markup=reply_markup, parse_mode='HTML')
+
+    async def confirm_buy_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE, plan_id: int):
+        """خرید پلن از موجودی کیف پول"""
+        query = update.callback_query
+        db = next(get_db())
+        
+        # دریافت اطلاعات پلن و کاربر
+        plan = await acrud.get_plan(db, plan_id)
+        user = await acrud.get_user(db, query.from_user.id)
+        
+        if not plan or not user:
+            await query.message.reply_text("❌ خطا در دریافت اطلاعات.")
+            return
+        
+        panels = (await CATALOG.ensure_loaded(SessionLocal)).panels
+        if not panels:
+            await query.message.reply_text("❌ خطا در دریافت پنل.")
+            return
+        
+        panel = panels[0]  # انتخاب اولین پنل فعال
+        
+        # کسر موجودی (فقط اگر کافی باشد)، ثبت تراکنش، ساخت اشتراک و سپردن ساخت حساب پنل به صف در یک تراکنش؛
+        # دو کلیک همزمان نمی‌توانند دو بار از موجودی کم کنند
+        subscription = await acrud.purchase_plan(
+            db,
+            user_id=user.id,
+            plan=plan,
+            panel_id=panel.id,
+            uuid=str(uuid4()),
+            start_date=datetime.now(),
+            build_payload=lambda subscription: build_user_payload(subscription, plan, query.from_user),
+            notify_chat_id=query.from_user.id
+        )
+        if subscription is None:
+            await query.message.edit_text(
+                "❌ موجودی شما کافی نیست.\n"
+                "لطفاً ابتدا موجودی خود را افزایش دهید."
             )
-            
-            keyboard = [
-                [
-                    InlineKeyboardButton("✅ تأیید و خرید", callback_data=f"confirm_buy_{plan_id}"),
-                    InlineKeyboardButton("❌ انصراف", callback_data="view_plans")
-                ]
+            return
+        # ساخت حساب در پنل را ورکر صف انجام می‌دهد تا کندی پنل خرید را متوقف نکند
+        wake_worker()
+        
+        # ارسال پیام موفقیت
+        message = (
+            f"✅ <b>خرید موفقیت‌آمیز</b>\n\n"
+            f"📦 پلن: <b>{plan.name}</b>\n"
+            f"⏱ مدت زمان: <code>{plan.duration_days}</code> روز\n"
+            f"📊 ترافیک: <code>{plan.traffic_gb}</code> گیگابایت\n"
+            f"📅 تاریخ انقضا: <code>{subscription.end_date.strftime('%Y-%m-%d')}</code>\n\n"
+            f"💰 موجودی فعلی: <code>{subscription.user.wallet_balance:,}</code> تومان\n\n"
+            "⏳ حساب شما در حال ایجاد روی سرور است و پس از آماده شدن به شما اطلاع داده می‌شود."
+        )
+        
+        keyboard = [
+            [
+                InlineKeyboardButton("📥 دریافت کانفیگ", callback_data=callback_data("get_config", subscription.id)),
+                InlineKeyboardButton("📊 اشتراک‌های من", callback_data="view_subscriptions")
+            ],
+            [
+                InlineKeyboardButton("🔙 بازگشت به منوی اصلی", callback_data="back_to_main")
             ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await query.message.edit_text(message, reply_markup=reply_markup, parse_mode='HTML')
-            
-        elif data.startswith("confirm_buy_"):
-            plan_id = int(data.split("_")[2])
-            db = next(get_db())
-            
-            # دریافت اطلاعات پلن و کاربر
-            plan = db.query(models.Plan).get(plan_id)
-            user = crud.get_user(db, query.from_user.id)
-            
-            if not plan or not user:
-                await query.message.reply_text("❌ خطا در دریافت اطلاعات.")
-                return
-            
-            # بررسی مجدد موجودی
-            if user.wallet_balance < plan.price:
-                await query.message.edit_text(
-                    "❌ موجودی شما کافی نیست.\n"
-                    "لطفاً ابتدا موجودی خود را افزایش دهید."
-                )
+        ]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        
+        await query.message.edit_text(message, reply_markup=reply_markup, parse_mode='HTML')
+
+    async def get_config_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE, subscription_id: int):
+        """نمایش لینک و اپلیکیشن‌های یک اشتراک"""
+        query = update.callback_query
+        db = next(get_db())
+        
+        # دریافت اطلاعات اشتراک
+        subscription = await acrud.get_subscription(db, subscription_id)
+        
+        if not subscription or subscription.user.telegram_id != query.from_user.id:
+            await query.message.reply_text("❌ خطا در دریافت اطلاعات اشتراک.")
+            return
+        
+        # اگر ساخت حساب در پنل هنوز در صف است منتظر می‌مانیم
+        if await acrud.get_open_panel_job(db, subscription.id, models.PanelJobType.CREATE):
+            await query.message.edit_text(
+                "⏳ حساب شما در حال آماده‌سازی روی سرور است.\n"
+                "پس از آماده شدن به شما اطلاع داده می‌شود.",
+                reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 بازگشت", callback_data="view_subscriptions")]])
+            )
+            return
+        
+        panel = subscription.panel
+        if not panel:
+            panels = (await CATALOG.ensure_loaded(SessionLocal)).panels
+            if not panels:
+                await query.message.reply_text("❌ خطا در دریافت پنل.")
                 return
-            
-            # ایجاد تراکنش و کم کردن از موجودی کاربر
-            transaction = crud.create_transaction(
+            panel = panels[0]  # انتخاب اولین پنل فعال
+        
+        create_job = await acrud.get_last_panel_job(db, subscription.id, models.PanelJobType.CREATE)
+        if not create_job or create_job.status == models.PanelJobStatus.FAILED:
+            # حسابی در پنل برای این اشتراک ثبت نشده؛ ساخت آن به صف سپرده می‌شود
+            await run_blocking(
+                DB_POOL,
+                enqueue_panel_job,
                 db,
-                user_id=user.id,
-                amount=-plan.price,
-                description=f"خرید پلن {plan.name}",
-                status=models.TransactionStatus.COMPLETED
+                models.PanelJobType.CREATE,
+                panel_id=panel.id,
+                uuid=subscription.uuid,
+                payload=build_user_payload(subscription, subscription.plan, query.from_user),
+                subscription_id=subscription.id,
+                notify_chat_id=query.from_user.id
             )
-            
-            # کم کردن از موجودی کاربر
-            crud.update_user_wallet(db, user.id, -plan.price)
-            
-            # ایجاد اشتراک جدید
-            subscription = crud.create_subscription(
-                db,
-                user_id=user.id,
-                plan_id=plan.id,
-                start_date=datetime.now(),
-                end_date=datetime.now() + timedelta(days=plan.duration_days),
-                is_active=True
+            await query.message.edit_text(
+                "⏳ درخواست ساخت حساب شما روی سرور ثبت شد.\n"
+                "پس از آماده شدن به شما اطلاع داده می‌شود.",
+                reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 بازگشت", callback_data="view_subscriptions")]])
+            )
+            return
+        
+        hiddify = offload_panel(HiddifyAPI.for_panel(panel))
+        hiddify_user_uuid = subscription.uuid
+        
+        try:
+            # دریافت همزمان پروفایل کاربر، آدرس کوتاه و اپلیکیشن‌ها
+            user_profile, short_url, user_apps = await asyncio.gather(
+                hiddify.get_user_profile(hiddify_user_uuid),
+                hiddify.get_user_short_url(hiddify_user_uuid),
+                hiddify.get_user_apps(hiddify_user_uuid)
             )
             
-            # ارسال پیام موفقیت
+            # ارسال لینک کوتاه
             message = (
-                f"✅ <b>خرید موفقیت‌آمیز</b>\n\n"
-                f"📦 پلن: <b>{plan.name}</b>\n"
-                f"⏱ مدت زمان: <code>{plan.duration_days}</code> روز\n"
-                f"📊 ترافیک: <code>{plan.traffic_gb}</code> گیگابایت\n"
+                f"📥 <b>اطلاعات اشتراک شما</b>\n\n"
+                f"📦 پلن: <b>{subscription.plan.name}</b>\n"
+                f"⏱ مدت زمان: <code>{subscription.plan.duration_days}</code> روز\n"
+                f"📊 ترافیک: <code>{user_profile.get('usage_current_GB', 0):.2f}</code> از <code>{subscription.plan.traffic_gb}</code> گیگابایت\n"
                 f"📅 تاریخ انقضا: <code>{subscription.end_date.strftime('%Y-%m-%d')}</code>\n\n"
-                f"💰 موجودی فعلی: <code>{user.wallet_balance:,}</code> تومان\n\n"
-                "برای دریافت کانفیگ، از منوی 'اشتراک‌های من' اقدام کنید."
+                f"🔗 <b>لینک اشتراک:</b>\n<code>{short_url.get('short_url')}</code>\n\n"
+                "📱 <b>اپلیکیشن‌های پیشنهادی:</b>\n"
             )
             
+            if user_apps:
+                for app in user_apps[:3]:  # ارسال 3 اپلیکیشن اول
+                    message += f"- <a href='{app.get('link')}'>{app.get('name')}</a>\n"
+            
             keyboard = [
                 [
-                    InlineKeyboardButton("📥 دریافت کانفیگ", callback_data=f"get_config_{subscription.id}"),
-                    InlineKeyboardButton("📊 اشتراک‌های من", callback_data="view_subscriptions")
+                    InlineKeyboardButton("📱 دریافت اپلیکیشن‌ها", callback_data=callback_data("get_apps", subscription_id)),
+                    InlineKeyboardButton("📋 همه کانفیگ‌ها", callback_data=callback_data("all_configs", subscription_id))
                 ],
                 [
-                    InlineKeyboardButton("🔙 بازگشت به منوی اصلی", callback_data="back_to_main")
+                    InlineKeyboardButton("🔙 بازگشت", callback_data="view_subscriptions")
                 ]
             ]
             reply_markup = InlineKeyboardMarkup(keyboard)
             
-            await query.message.edit_text(message, reply_markup=reply_markup, parse_mode='HTML')
-            
-        elif data.startswith("get_config_"):
-            subscription_id = int(data.split("_")[2])
-            db = next(get_db())
-            
-            # دریافت اطلاعات اشتراک
-            subscription = db.query(models.Subscription).get(subscription_id)
-            
-            if not subscription or subscription.user.telegram_id != query.from_user.id:
-                await query.message.reply_text("❌ خطا در دریافت اطلاعات اشتراک.")
-                return
-            
-            # دریافت پنل
-            panels = crud.get_active_panels(db)
-            if not panels:
-                await query.message.reply_text("❌ خطا در دریافت پنل.")
-                return
-            
-            panel = panels[0]  # انتخاب اولین پنل فعال
-            hiddify = HiddifyAPI(panel.domain, panel.proxy_path, panel.api_key)
+            await query.message.edit_text(message, reply_markup=reply_markup, parse_mode='HTML', disable_web_page_preview=True)
+            self.config_views.put((query.from_user.id, subscription_id), (message, reply_markup))
             
-            # ایجاد کاربر در هیدیفای یا بروزرسانی آن
-            user_data = {
-                "name": f"t{query.from_user.id}",
-                "usage_limit_GB": subscription.plan.traffic_gb,
-                "package_days": subscription.plan.duration_days,
-                "comment": f"Telegram User: {query.from_user.first_name} {query.from_user.last_name}",
-                "enable": True
-            }
-            
-            try:
-                # چک کردن وجود کاربر در هیدیفای
-                hiddify_users = hiddify.get_all_users()
-                hiddify_user = None
-                
-                for h_user in hiddify_users:
-                    if h_user.get("name") == f"t{query.from_user.id}":
-                        hiddify_user = h_user
-                        break
-                
-                if hiddify_user:
-                    # بروزرسانی کاربر
-                    hiddify_user_uuid = hiddify_user.get("uuid")
-                    hiddify.update_user(hiddify_user_uuid, user_data)
-                else:
-                    # ایجاد کاربر جدید
-                    hiddify_user = hiddify.create_user(user_data)
-                    hiddify_user_uuid = hiddify_user.get("uuid")
-                
-                # دریافت پروفایل کاربر
-                user_profile = hiddify.get_user_profile(hiddify_user_uuid)
-                
-                # دریافت لینک‌های کانفیگ
-                user_configs = hiddify.get_user_configs(hiddify_user_uuid)
-                
-                # دریافت آدرس کوتاه
-                short_url = hiddify.get_user_short_url(hiddify_user_uuid)
-                
-                # دریافت اپلیکیشن‌ها
-                user_apps = hiddify.get_user_apps(hiddify_user_uuid)
-                
-                # ارسال لینک کوتاه
-                message = (
-                    f"📥 <b>اطلاعات اشتراک شما</b>\n\n"
-                    f"📦 پلن: <b>{subscription.plan.name}</b>\n"
-                    f"⏱ مدت زمان: <code>{subscription.plan.duration_days}</code> روز\n"
-                    f"📊 ترافیک: <code>{user_profile.get('usage_current_GB', 0):.2f}</code> از <code>{subscription.plan.traffic_gb}</code> گیگابایت\n"
-                    f"📅 تاریخ انقضا: <code>{subscription.end_date.strftime('%Y-%m-%d')}</code>\n\n"
-                    f"🔗 <b>لینک اشتراک:</b>\n<code>{short_url.get('short_url')}</code>\n\n"
-                    "📱 <b>اپلیکیشن‌های پیشنهادی:</b>\n"
-                )
-                
-                if user_apps:
-                    for app in user_apps[:3]:  # ارسال 3 اپلیکیشن اول
-                        message += f"- <a href='{app.get('link')}'>{app.get('name')}</a>\n"
-                
-                keyboard = [
-                    [
-                        InlineKeyboardButton("📱 دریافت اپلیکیشن‌ها", callback_data=f"get_apps_{subscription_id}"),
-                        InlineKeyboardButton("📋 همه کانفیگ‌ها", callback_data=f"all_configs_{subscription_id}")
-                    ],
-                    [
-                        InlineKeyboardButton("🔙 بازگشت", callback_data="view_subscriptions")
-                    ]
-                ]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                
-                await query.message.edit_text(message, reply_markup=reply_markup, parse_mode='HTML', disable_web_page_preview=True)
-                
-            except Exception as e:
-                logger.error(f"Error getting configs: {e}")
-                await query.message.edit_text(
-                    f"❌ خطا در دریافت کانفیگ: {str(e)}",
-                    reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 بازگشت", callback_data="view_subscriptions")]])
-                )
-                
-        elif data == "send_receipt":
-            # آماده‌سازی برای دریافت رسید
+        except PanelBusyError:
             await query.message.edit_text(
-                "📸 <b>ارسال رسید پرداخت</b>\n\n"
-                "لطفاً تصویر رسید پرداخت خود را ارسال کنید.\n"
-                "پس از بررسی توسط ادمین، مبلغ به کیف پول شما اضافه خواهد شد.",
-                parse_mode='HTML'
+                "⏳ سرور در حال حاضر شلوغ است، لطفاً چند لحظه دیگر دوباره تلاش کنید.",
+                reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔄 تلاش مجدد", callback_data=query.data)]])
+            )
+        except Exception as e:
+            logger.error(f"Error getting configs: {e}")
+            await query.message.edit_text(
+                f"❌ خطا در دریافت کانفیگ: {str(e)}",
+                reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 بازگشت", callback_data="view_subscriptions")]])
+            )
+
+    async def cached_config_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE, subscription_id: int) -> bool:
+        """نمایش آخرین اطلاعات دریافت‌شده اشتراک برای کلیک‌های محدودشده بدون رفتن سراغ پنل"""
+        query = update.callback_query
+        view = self.config_views.get((query.from_user.id, subscription_id))
+        if view is None:
+            return False
+        message, reply_markup = view
+        try:
+            await query.message.edit_text(message, reply_markup=reply_markup, parse_mode='HTML', disable_web_page_preview=True)
+        except BadRequest as e:
+            # همین اطلاعات از قبل روی پیام نمایش داده شده است
+            if "not modified" not in str(e).lower():
+                logger.warning(f"Could not show cached config: {e}")
+                return False
+        return True
+
+    async def send_receipt_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """آماده‌سازی برای دریافت رسید پرداخت"""
+        query = update.callback_query
+        await query.message.edit_text(
+            "📸 <b>ارسال رسید پرداخت</b>\n\n"
+            "لطفاً تصویر رسید پرداخت خود را ارسال کنید.\n"
+            "پس از بررسی توسط ادمین، مبلغ به کیف پول شما اضافه خواهد شد.",
+            parse_mode='HTML'
+        )
+        context.user_data['waiting_for_receipt'] = True
+
+    async def transaction_history_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """نمایش ده تراکنش آخر کاربر"""
+        query = update.callback_query
+        db = next(get_db())
+        user = await acrud.get_user(db, query.from_user.id)
+        
+        if not user:
+            await query.message.edit_text("❌ خطا در دریافت اطلاعات کاربر.")
+            return
+        
+        # دریافت تراکنش‌های کاربر
+        transactions = await acrud.get_user_transactions(db, user.id, 10)
+        
+        if not transactions:
+            message = (
+                "📊 <b>تاریخچه تراکنش‌ها</b>\n\n"
+                "شما هیچ تراکنشی ندارید."
             )
-            context.user_data['waiting_for_receipt'] = True
-            
-        elif data == "refresh_profile":
-            # بروزرسانی پروفایل
-            await self.profile_command(update, context)
-            
-        elif data.startswith("transaction_history"):
-            # نمایش تاریخچه تراکنش‌ها
-            db = next(get_db())
-            user = db.query(models.User).filter(models.User.telegram_id == query.from_user.id).first()
-            
-            if not user:
-                await query.message.edit_text("❌ خطا در دریافت اطلاعات کاربر.")
-                return
-            
-            # دریافت تراکنش‌های کاربر
-            transactions = db.query(models.Transaction).filter(
-                models.Transaction.user_id == user.id
-            ).order_by(models.Transaction.created_at.desc()).limit(10).all()
-            
-            if not transactions:
-                message = (
-                    "📊 <b>تاریخچه تراکنش‌ها</b>\n\n"
-                    "شما هیچ تراکنشی ندارید."
-                )
-                
-                keyboard = [
-                    [InlineKeyboardButton("🔙 بازگشت", callback_data="wallet_charge")]
-                ]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                
-                await query.message.edit_text(message, reply_markup=reply_markup, parse_mode='HTML')
-                return
-            
-            message = "📊 <b>تاریخچه تراکنش‌ها</b>\n\n"
-            
-            for transaction in transactions:
-                status_emoji = {
-                    models.TransactionStatus.PENDING: "⏳",
-                    models.TransactionStatus.COMPLETED: "✅",
-                    models.TransactionStatus.REJECTED: "❌",
-                    models.TransactionStatus.CANCELLED: "🚫"
-                }.get(transaction.status, "❓")
-                
-                transaction_type = "واریز" if transaction.amount > 0 else "برداشت"
-                
-                message += (
-                    f"{status_emoji} <b>{transaction_type}</b>: <code>{abs(transaction.amount):,}</code> تومان\n"
-                    f"📝 توضیحات: {transaction.description}\n"
-                    f"⏰ تاریخ: {transaction.created_at.strftime('%Y-%m-%d %H:%M')}\n"
-                    f"📊 وضعیت: {transaction.status.value}\n\n"
-                )
             
             keyboard = [
                 [InlineKeyboardButton("🔙 بازگشت", callback_data="wallet_charge")]
@@ -684,6 +703,33 @@ class UserBot:
             reply_markup = InlineKeyboardMarkup(keyboard)
             
             await query.message.edit_text(message, reply_markup=reply_markup, parse_mode='HTML')
+            return
+        
+        message = "📊 <b>تاریخچه تراکنش‌ها</b>\n\n"
+        
+        for transaction in transactions:
+            status_emoji = {
+                models.TransactionStatus.PENDING: "⏳",
+                models.TransactionStatus.COMPLETED: "✅",
+                models.TransactionStatus.REJECTED: "❌",
+                models.TransactionStatus.CANCELLED: "🚫"
+            }.get(transaction.status, "❓")
+            
+            transaction_type = "واریز" if transaction.amount > 0 else "برداشت"
+            
+            message += (
+                f"{status_emoji} <b>{transaction_type}</b>: <code>{abs(transaction.amount):,}</code> تومان\n"
+                f"📝 توضیحات: {transaction.description}\n"
+                f"⏰ تاریخ: {transaction.created_at.strftime('%Y-%m-%d %H:%M')}\n"
+                f"📊 وضعیت: {transaction.status.value}\n\n"
+            )
+        
+        keyboard = [
+            [InlineKeyboardButton("🔙 بازگشت", callback_data="wallet_charge")]
+        ]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        
+        await query.message.edit_text(message, reply_markup=reply_markup, parse_mode='HTML')
 
     async def handle_receipt(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """پردازش رسید پرداخت"""
@@ -0,0 +1,306 @@
+import asyncio
+import gzip
+import io
+import logging
+import os
+import re
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import BinaryIO, Dict, List, Optional
+
+from sqlalchemy.engine import Engine
+from telegram import Bot
+
+from config import ADMIN_TELEGRAM_ID, CRON_BACKUP_INTERVAL, BACKUP_DIR, BACKUP_KEEP, BACKUP_COMPRESSION
+from db import models
+from bot.utils.cron import CronSchedule
+from bot.utils.executor import BACKUP_POOL, run_blocking
+
+try:
+    import zstandard
+except ImportError:  # zstd اختیاری است؛ در نبود آن از gzip استفاده می‌شود
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+EXTENSIONS = {"gzip": "gz", "zstd": "zst"}
+BACKUP_NAME = re.compile(r"^foxybot-\d{8}-\d{6}\.sql\.(gz|zst)$")
+END_OF_DATA = b"\\.\n"
+
+
+@dataclass
+class BackupResult:
+    path: str
+    size: int
+    duration: float
+    compression: str
+    rows: Dict[str, int] = field(default_factory=dict)
+    removed: List[str] = field(default_factory=list)
+
+
+def resolve_compression(compression: str) -> str:
+    compression = compression.lower()
+    if compression not in EXTENSIONS:
+        raise ValueError(f"Unknown backup compression: {compression}")
+    if compression == "zstd" and zstandard is None:
+        logger.warning("zstandard is not installed, falling back to gzip backups")
+        return "gzip"
+    return compression
+
+
+def compressed_writer(raw: BinaryIO, compression: str) -> BinaryIO:
+    if compression == "zstd":
+        return zstandard.ZstdCompressor(level=3).stream_writer(raw, closefd=False)
+    return gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=6)
+
+
+def open_backup(path: str) -> BinaryIO:
+    """باز کردن فایل بکاپ به صورت جریان خط‌به‌خط از حالت فشرده"""
+    raw = open(path, "rb")
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read .zst backups")
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(raw, closefd=True))
+    return gzip.GzipFile(fileobj=raw, mode="rb")
+
+
+class _RowCounter:
+    """مقصد COPY TO؛ داده را بدون نگهداری به کمپرسور می‌دهد و ردیف‌ها را می‌شمارد"""
+
+    def __init__(self, out: BinaryIO):
+        self.out = out
+        self.rows = 0
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        # در قالب متنی COPY هر ردیف دقیقاً یک خط است (خط‌های داخل داده escape می‌شوند)
+        self.rows += data.count(b"\n")
+        self.out.write(data)
+
+
+class _CopySection:
+    """منبع COPY FROM؛ خط‌ها را تا نشانگر پایان داده از جریان بکاپ می‌خواند"""
+
+    def __init__(self, stream: BinaryIO):
+        self.stream = stream
+        self.rows = 0
+        self.done = False
+
+    def read(self, size: int = 8192) -> bytes:
+        chunks = []
+        total = 0
+        while not self.done and (size < 0 or total < size):
+            line = self.stream.readline()
+            if not line:
+                raise ValueError("Backup ended inside COPY data")
+            if line == END_OF_DATA:
+                self.done = True
+                break
+            chunks.append(line)
+            total += len(line)
+            self.rows += 1
+        return b"".join(chunks)
+
+
+def _copy_columns(engine: Engine, table) -> str:
+    quote = engine.dialect.identifier_preparer.quote
+    return f"{quote(table.name)} ({', '.join(quote(column.name) for column in table.columns)})"
+
+
+def _fsync_directory(directory: str):
+    try:
+        descriptor = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+
+def dump_database(
+    engine: Engine,
+    directory: str = BACKUP_DIR,
+    compression: str = BACKUP_COMPRESSION,
+    keep: int = BACKUP_KEEP
+) -> BackupResult:
+    """بکاپ جریانی همه جداول با COPY ... TO STDOUT در یک snapshot سازگار
+
+    خروجی یک اسکریپت psql (بخش‌های COPY ... FROM stdin) فشرده است که ابتدا در
+    فایل موقت نوشته و سپس به صورت اتمیک جایگزین می‌شود.
+    """
+    if engine.dialect.name != "postgresql":
+        raise RuntimeError("Streaming database backups require PostgreSQL")
+    compression = resolve_compression(compression)
+    os.makedirs(directory, exist_ok=True)
+    name = f"foxybot-{datetime.now():%Y%m%d-%H%M%S}.sql.{EXTENSIONS[compression]}"
+    final_path = os.path.join(directory, name)
+    temp_path = os.path.join(directory, f".{name}.tmp")
+    tables = models.Base.metadata.sorted_tables
+    rows: Dict[str, int] = {}
+
+    start = time.perf_counter()
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+        with open(temp_path, "wb") as raw:
+            out = compressed_writer(raw, compression)
+            out.write(
+                f"-- FoxyBot database backup {datetime.now().isoformat(timespec='seconds')}\n"
+                f"-- tables: {','.join(table.name for table in tables)}\n\n".encode()
+            )
+            for table in tables:
+                columns = _copy_columns(engine, table)
+                out.write(f"COPY {columns} FROM stdin;\n".encode())
+                counter = _RowCounter(out)
+                cursor.copy_expert(f"COPY {columns} TO STDOUT", counter)
+                out.write(END_OF_DATA + b"\n")
+                rows[table.name] = counter.rows
+            out.close()
+            raw.flush()
+            os.fsync(raw.fileno())
+        connection.rollback()
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    finally:
+        connection.close()
+
+    os.replace(temp_path, final_path)
+    _fsync_directory(directory)
+    return BackupResult(
+        path=final_path,
+        size=os.path.getsize(final_path),
+        duration=time.perf_counter() - start,
+        compression=compression,
+        rows=rows,
+        removed=rotate_backups(directory, keep)
+    )
+
+
+def list_backups(directory: str = BACKUP_DIR) -> List[str]:
+    """فایل‌های بکاپ از قدیمی به جدید"""
+    if not os.path.isdir(directory):
+        return []
+    return [os.path.join(directory, name) for name in sorted(os.listdir(directory)) if BACKUP_NAME.match(name)]
+
+
+def rotate_backups(directory: str = BACKUP_DIR, keep: int = BACKUP_KEEP) -> List[str]:
+    """حذف بکاپ‌های قدیمی و نگه داشتن keep فایل آخر"""
+    backups = list_backups(directory)
+    removed = backups[:-keep] if keep > 0 else []
+    for path in removed:
+        os.remove(path)
+    return removed
+
+
+def restore_database(engine: Engine, path: str) -> Dict[str, int]:
+    """بازگردانی جریانی بکاپ در یک تراکنش (داده فعلی جداول بکاپ جایگزین می‌شود)"""
+    if engine.dialect.name != "postgresql":
+        raise RuntimeError("Streaming database restore requires PostgreSQL")
+    quote = engine.dialect.identifier_preparer.quote
+    rows: Dict[str, int] = {}
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        with open_backup(path) as stream:
+            tables = []
+            for line in stream:
+                text = line.decode().rstrip("\n")
+                if text.startswith("-- tables:"):
+                    tables = [name for name in text[len("-- tables:"):].strip().split(",") if name]
+                    cursor.execute(f"TRUNCATE {', '.join(quote(name) for name in tables)}")
+                elif text.startswith("COPY "):
+                    if not tables:
+                        raise ValueError("Backup header with table list is missing")
+                    target = text[len("COPY "):-len(" FROM stdin;")]
+                    section = _CopySection(stream)
+                    cursor.copy_expert(f"COPY {target} FROM STDIN", section)
+                    rows[target.split(" ", 1)[0].strip('"')] = section.rows
+
+        # همگام کردن sequence شناسه‌ها با داده بازگردانده شده
+        for table in models.Base.metadata.sorted_tables:
+            if table.name in rows and "id" in table.columns:
+                name = quote(table.name)
+                cursor.execute(
+                    f"SELECT setval(pg_get_serial_sequence(%s, 'id'), "
+                    f"COALESCE((SELECT MAX(id) FROM {name}), 1), "
+                    f"(SELECT MAX(id) FROM {name}) IS NOT NULL)",
+                    (table.name,)
+                )
+        connection.commit()
+    except BaseException:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+    return rows
+
+
+def format_size(size: float) -> str:
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+def format_summary(result: BackupResult) -> str:
+    """متن گزارش بکاپ برای ادمین"""
+    message = (
+        f"💾 <b>بکاپ دیتابیس انجام شد</b>\n\n"
+        f"📁 فایل: <code>{os.path.basename(result.path)}</code>\n"
+        f"📦 حجم: <code>{format_size(result.size)}</code> ({result.compression})\n"
+        f"⏱ مدت: <code>{result.duration:.1f}</code> ثانیه\n\n"
+        f"📊 <b>تعداد ردیف‌ها:</b>\n"
+    )
+    for table, count in result.rows.items():
+        message += f"- {table}: <code>{count:,}</code>\n"
+    if result.removed:
+        message += f"\n🗑 {len(result.removed)} بکاپ قدیمی حذف شد."
+    return message
+
+
+class BackupWorker:
+    """اجرای بکاپ دیتابیس طبق CRON_BACKUP_INTERVAL و ارسال گزارش به ادمین"""
+
+    def __init__(self, engine: Engine, bot: Bot, schedule: str = CRON_BACKUP_INTERVAL):
+        """مقداردهی اولیه"""
+        self.engine = engine
+        self.bot = bot
+        self.schedule = CronSchedule(schedule)
+
+    async def run(self):
+        """اجرای زمان‌بندی‌شده تا زمان لغو"""
+        if self.engine.dialect.name != "postgresql":
+            logger.warning("Database backups require PostgreSQL; backup job disabled")
+            return
+        logger.info(f"Backup worker started ({self.schedule.expression})")
+        while True:
+            now = datetime.now()
+            next_run = self.schedule.next_after(now)
+            await asyncio.sleep((next_run - now).total_seconds())
+            await self.run_once()
+
+    async def run_once(self) -> Optional[BackupResult]:
+        try:
+            result = await run_blocking(BACKUP_POOL, dump_database, self.engine)
+        except Exception as e:
+            logger.error(f"Database backup failed: {e}")
+            await self._notify(f"❌ <b>بکاپ دیتابیس ناموفق بود</b>\n\n<code>{e}</code>")
+            return None
+        logger.info(f"Database backup written to {result.path} ({result.size} bytes, {result.duration:.1f}s)")
+        await self._notify(format_summary(result))
+        return result
+
+    async def _notify(self, message: str):
+        if not ADMIN_TELEGRAM_ID:
+            return
+        try:
+            await self.bot.send_message(chat_id=ADMIN_TELEGRAM_ID, text=message, parse_mode='HTML')
+        except Exception as e:
+            logger.error(f"Error sending backup summary to admin: {e}")
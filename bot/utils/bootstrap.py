@@ -0,0 +1,105 @@
+import asyncio
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from telegram.ext import Application
+
+from config import DB_POOL_SIZE, EXECUTOR_DB_WORKERS
+from db.schema import schema_differences
+from bot.utils import resolver
+from bot.utils.catalog import CATALOG
+from bot.utils.executor import DB_POOL, run_blocking
+from bot.utils.metrics import Gauge
+
+logger = logging.getLogger(__name__)
+
+STARTUP_PHASE = Gauge(
+    "foxybot_startup_phase_seconds",
+    "Duration of each startup phase of the last start",
+    ("phase",)
+)
+
+
+class SchemaError(Exception):
+    """ساختار دیتابیس با مدل‌های این نسخه از کد همخوانی ندارد"""
+
+
+class StartupTimer:
+    """زمان‌سنجی مراحل راه‌اندازی و لاگ آن‌ها"""
+
+    def __init__(self):
+        """مقداردهی اولیه"""
+        self.started = time.perf_counter()
+        self.timings: Dict[str, float] = {}
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.timings[name] = elapsed
+            STARTUP_PHASE.set(elapsed, phase=name)
+            logger.info(f"Startup phase '{name}' took {elapsed:.2f}s")
+
+    def summary(self) -> str:
+        total = time.perf_counter() - self.started
+        STARTUP_PHASE.set(total, phase="total")
+        phases = ", ".join(f"{name} {elapsed:.2f}s" for name, elapsed in self.timings.items())
+        return f"Started in {total:.2f}s ({phases})"
+
+
+def _check_schema(engine: Engine):
+    missing_tables, missing_columns, missing_indexes = schema_differences(engine)
+    if missing_tables or missing_columns or missing_indexes:
+        missing = ", ".join(missing_tables + missing_columns + missing_indexes)
+        raise SchemaError(f"Database schema is out of date (missing: {missing}); run python db/create_tables.py")
+
+
+def _open_connection(engine: Engine, barrier: threading.Barrier):
+    try:
+        connection = engine.connect()
+        connection.execute(text("SELECT 1"))
+    except Exception:
+        # بقیه نخ‌ها منتظر این اتصال نمانند
+        barrier.abort()
+        raise
+    try:
+        # اتصال تا باز شدن بقیه نگه داشته می‌شود تا هر نخ اتصال جدیدی بسازد
+        barrier.wait()
+    except threading.BrokenBarrierError:
+        pass
+    finally:
+        connection.close()
+
+
+async def prepare_database(engine: Engine, timer: StartupTimer):
+    """باز کردن همزمان اتصال‌های استخر و بررسی ساختار دیتابیس"""
+    with timer.phase("database"):
+        count = max(1, min(DB_POOL_SIZE, EXECUTOR_DB_WORKERS))
+        barrier = threading.Barrier(count, timeout=10)
+        await asyncio.gather(*[run_blocking(DB_POOL, _open_connection, engine, barrier) for _ in range(count)])
+    with timer.phase("schema"):
+        await run_blocking(DB_POOL, _check_schema, engine)
+
+
+async def load_catalog(session_factory: Callable[[], Session], timer: StartupTimer):
+    with timer.phase("catalog"):
+        await run_blocking(DB_POOL, CATALOG.load, session_factory)
+    logger.info(f"Loaded {len(CATALOG.plans)} plans and {len(CATALOG.panels)} active panels")
+
+
+async def initialize_bots(timer: StartupTimer, *applications: Application):
+    """اینیشیالایز ربات‌ها (getMe) همزمان با باز کردن اتصال پنل‌ها"""
+    with timer.phase("connections"):
+        await asyncio.gather(
+            *[application.initialize() for application in applications],
+            resolver.warm_up(CATALOG.panels)
+        )
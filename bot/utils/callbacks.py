@@ -0,0 +1,351 @@
+import asyncio
+import json
+import logging
+import math
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from sqlalchemy.orm import Session
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from config import CALLBACK_STATE_TTL, CALLBACK_STATE_MAX_ENTRIES, PERSISTENCE_FLUSH_INTERVAL, PERSISTENCE_PURGE_INTERVAL
+from db import crud
+from db.session import SessionLocal
+from bot.utils.executor import DB_POOL, run_blocking
+from bot.utils.instrumentation import register_routes
+from bot.utils.metrics import Counter, Histogram
+from bot.utils.throttle import MENU, COOLDOWN_MESSAGE, UserThrottle
+
+logger = logging.getLogger(__name__)
+
+CALLBACK_ROUTE_LATENCY = Histogram(
+    "foxybot_callback_route_duration_seconds",
+    "Time spent in a callback route handler",
+    ("bot", "route")
+)
+CALLBACK_ROUTE_RESULTS = Counter(
+    "foxybot_callback_route_total",
+    "Dispatched callback queries by route and outcome",
+    ("bot", "route", "result")
+)
+CALLBACK_STATE_ENTRIES = Counter(
+    "foxybot_callback_state_stored_total",
+    "Callback payloads stored server-side instead of in callback_data",
+    ("route",)
+)
+CALLBACK_STATE_LOADS = Counter(
+    "foxybot_callback_state_loads_total",
+    "Callback tokens looked up in the database after a miss in process memory",
+    ("result",)
+)
+
+# محدودیت تلگرام برای callback_data بر حسب بایت
+MAX_CALLBACK_DATA = 64
+SEPARATOR = ":"
+TOKEN_MARKER = "~"
+
+EXPIRED_MESSAGE = "⌛ این دکمه منقضی شده است؛ لطفاً دوباره از منو اقدام کنید."
+ACCESS_DENIED_MESSAGE = "⛔ شما به این بخش دسترسی ندارید."
+
+
+class CallbackStateStore:
+    """نگهداری آرگومان‌های کالبک در سمت سرور با توکن کوتاه (با TTL و سقف LRU)
+
+    با session_factory توکن‌ها در جدول callback_states هم نوشته می‌شوند (در یک تسک
+    پس‌زمینه و دسته‌ای، مثل DatabasePersistence) تا دکمه‌ها پس از ری‌استارت یا
+    تحویل به پروسه جدید هم کار کنند؛ توکنی که در حافظه نیست با load از دیتابیس خوانده
+    می‌شود. آرگومان‌هایی که در JSON جا نمی‌شوند فقط در حافظه می‌مانند.
+    """
+
+    def __init__(
+        self,
+        session_factory: Optional[Callable[[], Session]] = None,
+        ttl: float = CALLBACK_STATE_TTL,
+        max_entries: int = CALLBACK_STATE_MAX_ENTRIES
+    ):
+        """مقداردهی اولیه"""
+        self.session_factory = session_factory
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # توکن‌های در انتظار نوشتن: token -> (داده JSON، زمان انقضا)
+        self._pending: Dict[str, Tuple[dict, datetime]] = {}
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def put(self, value: Any) -> str:
+        token = secrets.token_urlsafe(9)
+        with self._lock:
+            self._remember(token, value)
+            if self.session_factory is not None:
+                self._queue(token, value)
+        self._schedule_flush()
+        return token
+
+    def get(self, token: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[token]
+                return None
+            return value
+
+    def load(self, token: str) -> Optional[Any]:
+        """خواندن توکنی که در حافظه این پروسه نیست از دیتابیس (بلاک‌کننده)"""
+        value = self.get(token)
+        if value is not None or self.session_factory is None:
+            return value
+        db = self.session_factory()
+        try:
+            data = crud.get_callback_state(db, token, datetime.utcnow())
+        finally:
+            db.close()
+        CALLBACK_STATE_LOADS.inc(result="hit" if data is not None else "miss")
+        if data is None:
+            return None
+        value = (tuple(data["args"]), data["payload"])
+        with self._lock:
+            self._remember(token, value)
+        return value
+
+    def _remember(self, token: str, value: Any):
+        self._entries[token] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(token)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _queue(self, token: str, value: Any):
+        args, payload = value
+        data = {"args": list(args), "payload": payload}
+        try:
+            json.dumps(data)
+        except (TypeError, ValueError):
+            logger.warning(f"Callback payload for token {token} is not JSON serializable; kept in memory only")
+            return
+        self._pending[token] = (data, datetime.utcnow() + timedelta(seconds=self.ttl))
+
+    def _schedule_flush(self):
+        # callback_data ممکن است خارج از حلقه رویداد صدا زده شود؛ آن توکن‌ها در دور بعدی run نوشته می‌شوند
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        if self._pending and (self._flush_task is None or self._flush_task.done()):
+            self._flush_task = asyncio.create_task(self.flush())
+
+    async def flush(self) -> None:
+        """نوشتن توکن‌های در انتظار در یک تراکنش"""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return
+                batch, self._pending = self._pending, {}
+            try:
+                await run_blocking(DB_POOL, self._write, batch)
+            except Exception as e:
+                logger.error(f"Error writing {len(batch)} callback tokens: {e}")
+                with self._lock:
+                    for token, entry in batch.items():
+                        self._pending.setdefault(token, entry)
+
+    def _write(self, batch: Dict[str, Tuple[dict, datetime]]):
+        db = self.session_factory()
+        try:
+            crud.add_callback_states(db, batch)
+        finally:
+            db.close()
+
+    def purge(self) -> int:
+        """حذف توکن‌های منقضی از دیتابیس"""
+        db = self.session_factory()
+        try:
+            return crud.purge_callback_states(db, datetime.utcnow())
+        finally:
+            db.close()
+
+    async def run(self):
+        """نوشتن توکن‌های جامانده و حذف دوره‌ای ردیف‌های منقضی تا زمان لغو"""
+        if self.session_factory is None:
+            return
+        last_purge = time.monotonic()
+        while True:
+            try:
+                await asyncio.sleep(PERSISTENCE_FLUSH_INTERVAL)
+            finally:
+                # پیش از خروج توکن‌های باقی‌مانده نوشته می‌شوند تا پروسه جایگزین آن‌ها را ببیند
+                await asyncio.shield(self.flush())
+            if time.monotonic() - last_purge < PERSISTENCE_PURGE_INTERVAL:
+                continue
+            last_purge = time.monotonic()
+            try:
+                purged = await run_blocking(DB_POOL, self.purge)
+                if purged:
+                    logger.info(f"Purged {purged} expired callback tokens")
+            except Exception as e:
+                logger.error(f"Error purging callback tokens: {e}")
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+# هر دو ربات در یک پروسه اجرا می‌شوند؛ دکمه‌ای که یک ربات می‌سازد ممکن است در دیگری پردازش شود
+CALLBACK_STORE = CallbackStateStore(SessionLocal)
+
+
+def callback_data(route: str, *args: Any, payload: Any = None) -> str:
+    """ساخت callback_data به شکل route:arg1:arg2
+
+    اگر payload داده شود یا طول داده از ۶۴ بایت بیشتر شود، آرگومان‌ها در سمت سرور
+    ذخیره شده و فقط route:~token ارسال می‌شود.
+    """
+    if SEPARATOR in route:
+        raise ValueError(f"Callback route may not contain '{SEPARATOR}': {route}")
+    data = SEPARATOR.join([route] + [str(arg) for arg in args])
+    if payload is None and len(data.encode()) <= MAX_CALLBACK_DATA and all(
+        SEPARATOR not in str(arg) and not str(arg).startswith(TOKEN_MARKER) for arg in args
+    ):
+        return data
+    token = CALLBACK_STORE.put((args, payload))
+    CALLBACK_STATE_ENTRIES.inc(route=route)
+    return f"{route}{SEPARATOR}{TOKEN_MARKER}{token}"
+
+
+RouteHandler = Callable[..., Awaitable[Any]]
+
+
+class CallbackRouter:
+    """ارسال کالبک‌ها به هندلر مسیر با جستجوی مستقیم در دیکشنری
+
+    هندلر با (update, context, *args) فراخوانی می‌شود؛ آرگومان‌های متنی با
+    converters مسیر تبدیل می‌شوند و اگر داده در سمت سرور ذخیره شده باشد
+    payload به صورت آرگومان کلیدی داده می‌شود. callback_data قدیمی به شکل
+    route_id (دکمه‌های پیام‌های قبلی) هم پشتیبانی می‌شود.
+
+    با throttle هر کلیک به اندازه cost مسیر از سطل توکن کاربر کم می‌شود؛ کلیک‌های اضافه
+    با on_throttled (مثلاً از کش) یا با پیام «کمی صبر کنید» جواب داده می‌شوند. مسیری
+    که allowed دارد فقط برای کاربرانی اجرا می‌شود که allowed(update) برایشان True باشد.
+    """
+
+    def __init__(self, bot_name: str, store: CallbackStateStore = CALLBACK_STORE, throttle: Optional[UserThrottle] = None):
+        """مقداردهی اولیه"""
+        self.bot_name = bot_name
+        self.store = store
+        self.throttle = throttle
+        self._routes: Dict[str, Tuple[RouteHandler, Tuple[Callable[[str], Any], ...], float, Optional[RouteHandler], Optional[Callable[[Update], bool]]]] = {}
+
+    def add(
+        self,
+        route: str,
+        handler: RouteHandler,
+        *converters: Callable[[str], Any],
+        cost: float = MENU,
+        on_throttled: Optional[RouteHandler] = None,
+        allowed: Optional[Callable[[Update], bool]] = None
+    ):
+        """ثبت هندلر یک مسیر؛ converters نوع آرگومان‌های متنی را تعیین می‌کنند
+
+        on_throttled با همان آرگومان‌های هندلر صدا زده می‌شود و اگر توانست بدون کار
+        سنگین جواب دهد True برمی‌گرداند.
+        """
+        if route in self._routes:
+            raise ValueError(f"Callback route already registered: {route}")
+        self._routes[route] = (handler, converters, cost, on_throttled, allowed)
+        register_routes([route])
+
+    def resolve(self, data: str) -> Tuple[Optional[str], Optional[tuple], Any]:
+        """تبدیل callback_data به (route, args, payload)؛ args برای توکن منقضی None است"""
+        route, separator, rest = data.partition(SEPARATOR)
+        if separator:
+            if rest.startswith(TOKEN_MARKER):
+                stored = self.store.get(rest[len(TOKEN_MARKER):])
+                if stored is None:
+                    return route, None, None
+                return route, tuple(stored[0]), stored[1]
+            return route, self._convert(route, rest.split(SEPARATOR)), None
+
+        if data in self._routes:
+            return data, (), None
+        # قالب قدیمی route_id؛ با rsplit پیشوندهای چندبخشی مثل user_add_balance هم درست جدا می‌شوند
+        route, _, arg = data.rpartition("_")
+        if route in self._routes and arg:
+            return route, self._convert(route, [arg]), None
+        return None, (), None
+
+    def _convert(self, route: str, args: list) -> tuple:
+        entry = self._routes.get(route)
+        if entry is None:
+            return tuple(args)
+        converters = entry[1]
+        return tuple(
+            converters[i](arg) if i < len(converters) else arg
+            for i, arg in enumerate(args)
+        )
+
+    async def dispatch(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """پاسخ به کالبک و اجرای هندلر مسیر آن"""
+        query = update.callback_query
+        data = query.data or ""
+        _, separator, rest = data.partition(SEPARATOR)
+        if separator and rest.startswith(TOKEN_MARKER) and self.store.get(rest[len(TOKEN_MARKER):]) is None:
+            # توکن در پروسه دیگری (قبل از ری‌استارت یا تحویل) ساخته شده
+            try:
+                await run_blocking(DB_POOL, self.store.load, rest[len(TOKEN_MARKER):])
+            except Exception as e:
+                logger.error(f"Error loading callback token on {self.bot_name} bot: {e}")
+        try:
+            route, args, payload = self.resolve(data)
+        except (TypeError, ValueError):
+            route, args, payload = None, (), None
+
+        entry = self._routes.get(route) if route else None
+        if entry is None:
+            CALLBACK_ROUTE_RESULTS.inc(bot=self.bot_name, route="unknown", result="unknown")
+            logger.warning(f"Unhandled callback data on {self.bot_name} bot: {query.data!r}")
+            await query.answer()
+            return
+        if args is None:
+            CALLBACK_ROUTE_RESULTS.inc(bot=self.bot_name, route=route, result="expired")
+            await query.answer(EXPIRED_MESSAGE, show_alert=True)
+            return
+
+        handler, _, cost, on_throttled, allowed = entry
+        if allowed is not None and not allowed(update):
+            CALLBACK_ROUTE_RESULTS.inc(bot=self.bot_name, route=route, result="denied")
+            logger.warning(f"Denied {route} callback on {self.bot_name} bot for user {query.from_user.id}")
+            await query.answer(ACCESS_DENIED_MESSAGE, show_alert=True)
+            return
+
+        kwargs = {"payload": payload} if payload is not None else {}
+        if self.throttle is not None:
+            retry_after = self.throttle.consume(query.from_user.id, route, cost)
+            if retry_after is not None:
+                if on_throttled is not None and await on_throttled(update, context, *args, **kwargs):
+                    CALLBACK_ROUTE_RESULTS.inc(bot=self.bot_name, route=route, result="cached")
+                    await query.answer()
+                else:
+                    CALLBACK_ROUTE_RESULTS.inc(bot=self.bot_name, route=route, result="throttled")
+                    await query.answer(COOLDOWN_MESSAGE.format(seconds=math.ceil(retry_after)))
+                return
+
+        await query.answer()
+        start = time.perf_counter()
+        try:
+            result = await handler(update, context, *args, **kwargs)
+        except Exception:
+            CALLBACK_ROUTE_RESULTS.inc(bot=self.bot_name, route=route, result="error")
+            raise
+        finally:
+            CALLBACK_ROUTE_LATENCY.observe(time.perf_counter() - start, bot=self.bot_name, route=route)
+        CALLBACK_ROUTE_RESULTS.inc(bot=self.bot_name, route=route, result="ok")
+        return result
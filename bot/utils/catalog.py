@@ -0,0 +1,107 @@
+import asyncio
+import logging
+import time
+from typing import Callable, List, NamedTuple, Optional
+
+from sqlalchemy.orm import Session
+
+from config import DEFAULT_PLANS, CATALOG_REFRESH_INTERVAL
+from db import models, crud
+from bot.utils.executor import DB_POOL, run_blocking
+
+logger = logging.getLogger(__name__)
+
+
+class PlanInfo(NamedTuple):
+    id: int
+    name: str
+    description: Optional[str]
+    duration_days: int
+    traffic_gb: float
+    price: float
+
+
+class PanelInfo(NamedTuple):
+    # همان فیلدهایی که HiddifyAPI.for_panel لازم دارد
+    id: int
+    name: str
+    domain: str
+    proxy_path: str
+    api_key: str
+    status: models.PanelStatus
+    rate_limit: Optional[float]
+    max_concurrency: Optional[int]
+
+
+class Catalog:
+    """نسخه درون‌حافظه پلن‌ها و پنل‌های فعال
+
+    هنگام شروع ربات بارگذاری می‌شود تا نمایش پلن‌ها و انتخاب پنل برای خرید بدون
+    کوئری انجام شود. پس از تغییر پلن یا پنل در همین پروسه reload صدا زده می‌شود و
+    تغییرات نسخه‌های دیگر ربات هر CATALOG_REFRESH_INTERVAL ثانیه خوانده می‌شوند.
+    """
+
+    def __init__(self):
+        """مقداردهی اولیه"""
+        self.plans: List[PlanInfo] = []
+        self.panels: List[PanelInfo] = []
+        self.loaded_at: Optional[float] = None
+        self._session_factory: Optional[Callable[[], Session]] = None
+
+    def load(self, session_factory: Callable[[], Session]) -> "Catalog":
+        """خواندن پلن‌ها و پنل‌های فعال (پلن‌های پیش‌فرض در صورت نبود هیچ پلنی ساخته می‌شوند)"""
+        db = session_factory()
+        try:
+            plans = crud.get_active_plans(db)
+            if not plans:
+                for plan_data in DEFAULT_PLANS:
+                    crud.create_plan(db, **plan_data)
+                plans = crud.get_active_plans(db)
+            panels = crud.get_active_panels(db)
+            self.plans = [
+                PlanInfo(plan.id, plan.name, plan.description, plan.duration_days, plan.traffic_gb, plan.price)
+                for plan in plans
+            ]
+            self.panels = [
+                PanelInfo(
+                    panel.id, panel.name, panel.domain, panel.proxy_path, panel.api_key,
+                    panel.status, panel.rate_limit, panel.max_concurrency
+                )
+                for panel in panels
+            ]
+        finally:
+            db.close()
+        self._session_factory = session_factory
+        self.loaded_at = time.monotonic()
+        return self
+
+    def reload(self):
+        """بارگذاری دوباره با همان session_factory (از نخ‌های استخر دیتابیس)"""
+        if self._session_factory is not None:
+            self.load(self._session_factory)
+
+    async def ensure_loaded(self, session_factory: Callable[[], Session]) -> "Catalog":
+        """بارگذاری در اولین استفاده اگر ربات بدون bootstrap اجرا شده باشد"""
+        if self.loaded_at is None:
+            await run_blocking(DB_POOL, self.load, session_factory)
+        return self
+
+    async def refresh(self):
+        if self._session_factory is not None:
+            await run_blocking(DB_POOL, self.load, self._session_factory)
+
+    def get_plan(self, plan_id: int) -> Optional[PlanInfo]:
+        return next((plan for plan in self.plans if plan.id == plan_id), None)
+
+    async def run(self):
+        """بارگذاری دوره‌ای تا زمان لغو"""
+        while True:
+            await asyncio.sleep(CATALOG_REFRESH_INTERVAL)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Error refreshing plans and panels: {e}")
+
+
+# مشترک بین هر دو ربات
+CATALOG = Catalog()
@@ -0,0 +1,161 @@
+import asyncio
+import contextvars
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+from config import EXECUTOR_DB_WORKERS, EXECUTOR_PANEL_WORKERS, EXECUTOR_PANEL_BACKGROUND_WORKERS, EXECUTOR_HTTP_WORKERS
+from bot.utils.metrics import Gauge, Histogram, REGISTRY
+
+# نام استخرهای اجرای کارهای بلاک‌کننده
+DB_POOL = "db"
+PANEL_POOL = "panel"
+# کارهای پس‌زمینه پنل استخر جدا دارند تا نخ‌های درخواست‌های کاربران را اشغال نکنند
+PANEL_BACKGROUND_POOL = "panel_background"
+HTTP_POOL = "http"
+# بکاپ دیتابیس چند دقیقه طول می‌کشد و نباید یکی از نخ‌های استخر دیتابیس را نگه دارد
+BACKUP_POOL = "backup"
+
+_POOL_SIZES = {
+    DB_POOL: EXECUTOR_DB_WORKERS,
+    PANEL_POOL: EXECUTOR_PANEL_WORKERS,
+    PANEL_BACKGROUND_POOL: EXECUTOR_PANEL_BACKGROUND_WORKERS,
+    HTTP_POOL: EXECUTOR_HTTP_WORKERS,
+    BACKUP_POOL: 1
+}
+
+QUEUE_WAIT = Histogram(
+    "foxybot_executor_queue_wait_seconds",
+    "Time a blocking call waited for a free worker thread",
+    ("pool",)
+)
+PENDING = Gauge(
+    "foxybot_executor_pending",
+    "Blocking calls queued or running per pool",
+    ("pool",)
+)
+
+_pools: Dict[str, ThreadPoolExecutor] = {}
+_pools_lock = threading.Lock()
+
+# آمار زمان انتظار در صف هر استخر
+_stats_lock = threading.Lock()
+_stats = {
+    name: {"submitted": 0, "completed": 0, "wait_total": 0.0, "wait_max": 0.0}
+    for name in _POOL_SIZES
+}
+
+
+def get_pool(name: str) -> ThreadPoolExecutor:
+    """دریافت (یا ساخت) استخر نخ‌های یک نوع کار"""
+    pool = _pools.get(name)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(name)
+            if pool is None:
+                pool = ThreadPoolExecutor(max_workers=_POOL_SIZES[name], thread_name_prefix=f"foxybot-{name}")
+                _pools[name] = pool
+    return pool
+
+
+def _record_wait(pool: str, wait: float):
+    QUEUE_WAIT.observe(wait, pool=pool)
+    with _stats_lock:
+        stats = _stats[pool]
+        stats["wait_total"] += wait
+        stats["wait_max"] = max(stats["wait_max"], wait)
+
+
+def _record_submit(pool: str):
+    with _stats_lock:
+        _stats[pool]["submitted"] += 1
+
+
+def _record_done(pool: str):
+    with _stats_lock:
+        _stats[pool]["completed"] += 1
+
+
+def executor_stats() -> Dict[str, Dict[str, Any]]:
+    """آمار هر استخر: تعداد کارها، کارهای در صف یا در حال اجرا و زمان انتظار در صف"""
+    with _stats_lock:
+        snapshot = {}
+        for name, stats in _stats.items():
+            completed = stats["completed"]
+            snapshot[name] = {
+                "workers": _POOL_SIZES[name],
+                "submitted": stats["submitted"],
+                "completed": completed,
+                "pending": stats["submitted"] - completed,
+                "wait_avg": stats["wait_total"] / completed if completed else 0.0,
+                "wait_max": stats["wait_max"]
+            }
+        return snapshot
+
+
+def _collect_pending():
+    for name, stats in executor_stats().items():
+        PENDING.set(stats["pending"], pool=name)
+
+
+REGISTRY.register_collector(_collect_pending)
+
+
+async def run_blocking(pool: str, func: Callable, *args, **kwargs):
+    """اجرای یک تابع بلاک‌کننده در استخر مشخص بدون مسدود کردن حلقه رویداد"""
+    loop = asyncio.get_running_loop()
+    # contextvars باید به نخ منتقل شوند (run_in_executor این کار را انجام نمی‌دهد)
+    context = contextvars.copy_context()
+    submitted_at = time.perf_counter()
+
+    def call():
+        _record_wait(pool, time.perf_counter() - submitted_at)
+        try:
+            return context.run(func, *args, **kwargs)
+        finally:
+            _record_done(pool)
+
+    _record_submit(pool)
+    return await loop.run_in_executor(get_pool(pool), call)
+
+
+def offload(pool: str):
+    """دکوراتور تبدیل تابع همگام به awaitable که در استخر مشخص اجرا می‌شود"""
+    def decorator(func: Callable):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            return await run_blocking(pool, func, *args, **kwargs)
+        wrapper.sync = func
+        return wrapper
+    return decorator
+
+
+class OffloadedNamespace:
+    """نسخه awaitable از همه توابع یک ماژول یا شیء (مثلاً crud یا HiddifyAPI)"""
+
+    def __init__(self, target: Any, pool: str):
+        self._target = target
+        self._pool = pool
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._target, name)
+        if not callable(attr):
+            return attr
+        wrapped = offload(self._pool)(attr)
+        self.__dict__[name] = wrapped
+        return wrapped
+
+
+def offload_module(target: Any, pool: str) -> OffloadedNamespace:
+    """مثال: ``acrud = offload_module(crud, DB_POOL)`` و سپس ``await acrud.get_user(db, telegram_id)``"""
+    return OffloadedNamespace(target, pool)
+
+
+def shutdown(wait: bool = True):
+    """بستن همه استخرها هنگام خروج"""
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.shutdown(wait=wait)
+        _pools.clear()
@@ -0,0 +1,54 @@
+import asyncio
+import logging
+from typing import Callable, List
+
+from sqlalchemy.orm import Session
+
+from config import EXPIRY_CHECK_INTERVAL, EXPIRY_BATCH_SIZE
+from db import crud
+from bot.utils.provisioning import wake_worker
+from bot.utils.executor import DB_POOL, run_blocking
+
+logger = logging.getLogger(__name__)
+
+
+class ExpiryWorker:
+    """ورکر دوره‌ای برای غیرفعال کردن اشتراک‌های منقضی یا با ترافیک تمام‌شده
+
+    غیرفعال شدن اشتراک و ثبت کار DISABLE آن در صف پنل در یک تراکنش انجام می‌شود؛
+    غیرفعال‌سازی روی پنل (با تلاش مجدد و محدودیت همزمانی هر پنل) را ورکر صف انجام می‌دهد.
+    """
+
+    def __init__(self, session_factory: Callable[[], Session]):
+        """مقداردهی اولیه"""
+        self.session_factory = session_factory
+
+    async def run(self):
+        """اجرای دوره‌ای تا زمان لغو"""
+        logger.info("Expiry worker started")
+        while True:
+            try:
+                disabled = await self.run_once()
+                if disabled:
+                    logger.info(f"Expiry sweep disabled {disabled} subscriptions")
+            except Exception as e:
+                logger.error(f"Error enforcing subscription expiry: {e}")
+            await asyncio.sleep(EXPIRY_CHECK_INTERVAL)
+
+    async def run_once(self) -> int:
+        """پردازش همه اشتراک‌های منقضی به صورت دسته‌ای"""
+        total = 0
+        while True:
+            rows = await run_blocking(DB_POOL, self._deactivate_batch)
+            total += len(rows)
+            if rows:
+                wake_worker()
+            if len(rows) < EXPIRY_BATCH_SIZE:
+                return total
+
+    def _deactivate_batch(self) -> List[tuple]:
+        db = self.session_factory()
+        try:
+            return crud.deactivate_lapsed_subscriptions(db, EXPIRY_BATCH_SIZE)
+        finally:
+            db.close()
@@ -1,10 +1,137 @@
+import codecs
+import json
+import re
+import threading
+import time
 import requests
-from typing import Dict, List, Optional
+from http.cookiejar import DefaultCookiePolicy
+from requests.adapters import HTTPAdapter
+from typing import Dict, Iterable, Iterator, List, Optional
 from datetime import datetime, timedelta
-from config import HIDDIFY_API_VERSION, HIDDIFY_API_BASE_URL, HIDDIFY_USER_PROXY_PATH
+from config import (
+    HIDDIFY_API_VERSION,
+    HIDDIFY_API_BASE_URL,
+    HIDDIFY_USER_PROXY_PATH,
+    HIDDIFY_CONNECT_TIMEOUT,
+    HIDDIFY_TIMEOUT,
+    PANEL_COALESCE_GETS,
+    EXECUTOR_PANEL_WORKERS,
+    EXECUTOR_PANEL_BACKGROUND_WORKERS
+)
+from bot.utils.metrics import Counter, Histogram
+from bot.utils.singleflight import SingleFlight
+from bot.utils.ratelimit import INTERACTIVE, get_panel_limiter
+from bot.utils import tracing
+
+try:
+    import orjson
+except ImportError:  # orjson اختیاری است؛ در نبود آن از json استاندارد استفاده می‌شود
+    orjson = None
+
+PANEL_LATENCY = Histogram(
+    "foxybot_panel_request_duration_seconds",
+    "Hiddify panel API latency",
+    ("panel", "endpoint")
+)
+PANEL_ERRORS = Counter(
+    "foxybot_panel_errors_total",
+    "Failed Hiddify panel API calls",
+    ("panel", "endpoint", "kind")
+)
+PANEL_COALESCED = Counter(
+    "foxybot_panel_coalesced_requests_total",
+    "Panel GETs that joined an identical in-flight request instead of calling the panel",
+    ("panel", "endpoint")
+)
+
+# مشترک بین همه نمونه‌های HiddifyAPI (برای هر درخواست یک نمونه جدید ساخته می‌شود)
+_GET_FLIGHTS = SingleFlight()
+_sessions: Dict[str, requests.Session] = {}
+_sessions_lock = threading.Lock()
+
+_UUID = re.compile(r"[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}")
+_WHITESPACE = " \t\r\n"
+
+def get_session(domain: str) -> requests.Session:
+    """Shared keep-alive session per panel, so requests reuse open TCP/TLS connections"""
+    session = _sessions.get(domain)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(domain)
+            if session is None:
+                session = requests.Session()
+                # one connection per thread that can call the panel at the same time
+                adapter = HTTPAdapter(
+                    pool_connections=1,
+                    pool_maxsize=EXECUTOR_PANEL_WORKERS + EXECUTOR_PANEL_BACKGROUND_WORKERS
+                )
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                # the session is shared by all admins and users, so panel cookies must not be kept
+                session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+                _sessions[domain] = session
+    return session
+
+def loads(data: bytes):
+    """Decode a JSON body with orjson when it is installed"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def iter_json_array(chunks: Iterable[bytes]) -> Iterator:
+    """Yield the items of a top-level JSON array as its bytes arrive"""
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder("utf-8")()
+    chunks = iter(chunks)
+    buffer = ""
+    position = 0
+    started = False
+
+    def more() -> bool:
+        nonlocal buffer, position
+        chunk = next(chunks, None)
+        if chunk is None:
+            return False
+        buffer = buffer[position:] + text.decode(chunk)
+        position = 0
+        return True
+
+    while True:
+        while position < len(buffer) and buffer[position] in _WHITESPACE + ("," if started else ""):
+            position += 1
+        if position == len(buffer):
+            if not more():
+                raise ValueError("Unexpected end of JSON array")
+            continue
+        if not started:
+            if buffer[position] != "[":
+                raise ValueError("Expected a JSON array")
+            started = True
+            position += 1
+            continue
+        if buffer[position] == "]":
+            return
+        try:
+            item, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            # the item is split across chunks
+            if not more():
+                raise
+            continue
+        position = end
+        yield item
 
 class HiddifyAPI:
-    def __init__(self, domain: str, proxy_path: str, api_key: str, user_proxy_path: Optional[str] = None):
+    def __init__(
+        self,
+        domain: str,
+        proxy_path: str,
+        api_key: str,
+        user_proxy_path: Optional[str] = None,
+        lane: str = INTERACTIVE,
+        rate_limit: Optional[float] = None,
+        max_concurrency: Optional[int] = None
+    ):
         """
         Initialize the Hiddify API client.
         
@@ -13,8 +140,14 @@ class HiddifyAPI:
             proxy_path: Admin proxy path for the API
             api_key: API key for authentication
             user_proxy_path: User proxy path for accessing user configurations
+            lane: Traffic class (interactive or background) whose share of the panel's limits is used
+            rate_limit: Requests per second for this panel (None uses PANEL_RATE_LIMIT)
+            max_concurrency: In-flight requests for this panel (None uses PANEL_MAX_CONCURRENCY)
         """
         self.domain = domain
+        self.lane = lane
+        self.limiter = get_panel_limiter(domain, rate_limit, max_concurrency)
+        self.session = get_session(domain)
         self.proxy_path = proxy_path  # Admin proxy path
         self.user_proxy_path = user_proxy_path or HIDDIFY_USER_PROXY_PATH  # User proxy path
         self.api_key = api_key
@@ -27,12 +160,64 @@ class HiddifyAPI:
             
         self.headers = {"Hiddify-API-Key": api_key}
 
+    @classmethod
+    def for_panel(cls, panel, lane: str = INTERACTIVE) -> "HiddifyAPI":
+        """Create a client for a Panel row using its configured limits"""
+        return cls(
+            panel.domain,
+            panel.proxy_path,
+            panel.api_key,
+            lane=lane,
+            rate_limit=panel.rate_limit,
+            max_concurrency=panel.max_concurrency
+        )
+
+    def _request(self, method: str, url: str, endpoint: str, **kwargs) -> requests.Response:
+        """Send a request within the panel's limits and record latency and errors per panel and endpoint"""
+        with self.limiter.slot(self.lane):
+            start = time.perf_counter()
+            try:
+                kwargs.setdefault("timeout", (HIDDIFY_CONNECT_TIMEOUT, HIDDIFY_TIMEOUT))
+                with tracing.span("panel.request", panel=self.domain, endpoint=endpoint, method=method):
+                    response = self.session.request(method, url, **kwargs)
+                    response.raise_for_status()
+                return response
+            except requests.HTTPError as e:
+                PANEL_ERRORS.inc(panel=self.domain, endpoint=endpoint, kind=str(e.response.status_code))
+                raise
+            except Exception as e:
+                PANEL_ERRORS.inc(panel=self.domain, endpoint=endpoint, kind=type(e).__name__)
+                raise
+            finally:
+                PANEL_LATENCY.observe(time.perf_counter() - start, panel=self.domain, endpoint=endpoint)
+
+    def _coalesced_get(self, url: str, endpoint: str, **kwargs):
+        """GET whose concurrent identical calls share one request; the result must be treated as read-only"""
+        def fetch():
+            return loads(self._request("GET", url, endpoint, **kwargs).content)
+
+        if not PANEL_COALESCE_GETS:
+            return fetch()
+        params = kwargs.get("params")
+        key = (url, self.api_key, tuple(sorted(params.items())) if params else ())
+        result, joined = _GET_FLIGHTS.do(key, fetch)
+        if joined:
+            PANEL_COALESCED.inc(panel=self.domain, endpoint=endpoint)
+        return result
+
     def _make_request(self, method: str, endpoint: str, **kwargs) -> Dict:
         """Make an API request to the Hiddify panel"""
         url = f"{self.base_url}/{endpoint}"
-        response = requests.request(method, url, headers=self.headers, **kwargs)
-        response.raise_for_status()
-        return response.json()
+        label = _UUID.sub("{uuid}", endpoint)
+        if method == "GET":
+            return self._coalesced_get(url, label, headers=self.headers, **kwargs)
+        response = self._request(method, url, label, headers=self.headers, **kwargs)
+        return loads(response.content)
+
+    def _make_user_request(self, uuid: str, endpoint: str, **kwargs):
+        """Make a GET request to a user proxy endpoint"""
+        url = f"{self._get_user_url(uuid)}/{endpoint}"
+        return self._coalesced_get(url, f"user/{endpoint}", **kwargs)
         
     def _get_user_url(self, uuid: str = None) -> str:
         """
@@ -61,6 +246,13 @@ class HiddifyAPI:
         """Get all users"""
         return self._make_request("GET", "admin/user/")
 
+    def iter_users(self, chunk_size: int = 64 * 1024) -> Iterator[Dict]:
+        """Stream all users, parsing the response incrementally instead of loading it at once"""
+        url = f"{self.base_url}/admin/user/"
+        response = self._request("GET", url, "admin/user/", headers=self.headers, stream=True)
+        with response:
+            yield from iter_json_array(response.iter_content(chunk_size=chunk_size))
+
     def create_user(self, user_data: Dict) -> Dict:
         """Create a new user"""
         return self._make_request("POST", "admin/user/", json=user_data)
@@ -87,11 +279,7 @@ class HiddifyAPI:
         Returns:
             List of configurations for the user
         """
-        # Using custom request to user proxy path
-        user_url = f"{self._get_user_url(uuid)}/all-configs/"
-        response = requests.get(user_url)
-        response.raise_for_status()
-        return response.json()
+        return self._make_user_request(uuid, "all-configs/")
 
     def get_user_profile(self, uuid: str) -> Dict:
         """
@@ -103,10 +291,7 @@ class HiddifyAPI:
         Returns:
             User profile information
         """
-        user_url = f"{self._get_user_url(uuid)}/me/"
-        response = requests.get(user_url)
-        response.raise_for_status()
-        return response.json()
+        return self._make_user_request(uuid, "me/")
 
     def get_user_apps(self, uuid: str, platform: str = "auto") -> List[Dict]:
         """
@@ -119,10 +304,7 @@ class HiddifyAPI:
         Returns:
             List of applications for the user
         """
-        user_url = f"{self._get_user_url(uuid)}/apps/"
-        response = requests.get(user_url, params={"platform": platform})
-        response.raise_for_status()
-        return response.json()
+        return self._make_user_request(uuid, "apps/", params={"platform": platform})
 
     def get_user_mtproxies(self, uuid: str) -> List[Dict]:
         """
@@ -134,10 +316,7 @@ class HiddifyAPI:
         Returns:
             List of MTProto proxies for the user
         """
-        user_url = f"{self._get_user_url(uuid)}/mtproxies/"
-        response = requests.get(user_url)
-        response.raise_for_status()
-        return response.json()
+        return self._make_user_request(uuid, "mtproxies/")
 
     def get_user_short_url(self, uuid: str) -> Dict:
         """
@@ -149,10 +328,7 @@ class HiddifyAPI:
         Returns:
             Short URL information for the user
         """
-        user_url = f"{self._get_user_url(uuid)}/short/"
-        response = requests.get(user_url)
-        response.raise_for_status()
-        return response.json()
+        return self._make_user_request(uuid, "short/")
 
     def create_subscription(self, user_data: Dict) -> Dict:
         """Create a new subscription"""
@@ -185,6 +361,10 @@ class HiddifyAPI:
             "reset_days": profile.get("profile_reset_days", 0)
         }
 
+    def warm_up(self, timeout: float):
+        """Resolve the panel and open a pooled connection to it ahead of the first real request"""
+        self._request("GET", f"{self.base_url}/panel/ping/", "panel/ping/", headers=self.headers, timeout=timeout).close()
+
     def check_panel_status(self) -> bool:
         """Check panel status"""
         try:
@@ -0,0 +1,333 @@
+import functools
+import logging
+import re
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Iterable, List, Optional, Set
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from telegram import Update
+from telegram.ext import Application, CommandHandler
+from telegram.request import HTTPXRequest
+
+from config import DB_SLOW_QUERY_THRESHOLD, DB_QUERY_BUDGET, DB_ROUTE_QUERY_BUDGETS
+from bot.utils.metrics import Counter, Gauge, Histogram, REGISTRY
+from bot.utils import tracing
+
+logger = logging.getLogger(__name__)
+slow_query_logger = logging.getLogger("foxybot.slow_queries")
+
+HANDLER_LATENCY = Histogram(
+    "foxybot_handler_duration_seconds",
+    "Time spent in a bot handler per update",
+    ("bot", "handler", "route")
+)
+HANDLER_ERRORS = Counter(
+    "foxybot_handler_errors_total",
+    "Handler invocations that raised an exception",
+    ("bot", "handler", "route")
+)
+DB_QUERIES = Counter(
+    "foxybot_db_queries_total",
+    "SQL statements executed",
+    ("engine", "statement")
+)
+DB_QUERY_LATENCY = Histogram(
+    "foxybot_db_query_duration_seconds",
+    "SQL statement execution time",
+    ("engine", "statement")
+)
+DB_POOL_WAIT = Histogram(
+    "foxybot_db_pool_checkout_wait_seconds",
+    "Time spent waiting for a connection from the SQLAlchemy pool",
+    ("engine",)
+)
+DB_POOL_CHECKED_OUT = Gauge(
+    "foxybot_db_pool_checked_out",
+    "Connections currently checked out of the SQLAlchemy pool",
+    ("engine",)
+)
+DB_SLOW_QUERIES = Counter(
+    "foxybot_db_slow_queries_total",
+    "SQL statements slower than DB_SLOW_QUERY_THRESHOLD",
+    ("engine", "handler")
+)
+DB_QUERIES_PER_UPDATE = Histogram(
+    "foxybot_db_queries_per_update",
+    "SQL statements issued while handling a single update",
+    ("bot", "route"),
+    buckets=(1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+)
+DB_QUERY_BUDGET_EXCEEDED = Counter(
+    "foxybot_db_query_budget_exceeded_total",
+    "Updates that issued more queries than their budget",
+    ("bot", "route")
+)
+TELEGRAM_REQUESTS = Counter(
+    "foxybot_telegram_requests_total",
+    "Outbound Bot API calls by method and HTTP status",
+    ("bot", "method", "status")
+)
+TELEGRAM_RATE_LIMITED = Counter(
+    "foxybot_telegram_rate_limited_total",
+    "Bot API calls rejected with HTTP 429",
+    ("bot", "method")
+)
+TELEGRAM_LATENCY = Histogram(
+    "foxybot_telegram_request_duration_seconds",
+    "Outbound Bot API call latency",
+    ("bot", "method")
+)
+
+_ID_SUFFIX = re.compile(r"_\d+$")
+
+# برچسب‌های مجاز route (دستورهای ثبت‌شده و مسیرهای CallbackRouter)؛ بقیه "other" شمرده
+# می‌شوند تا callback_data یا دستور دلخواه کاربران سری جدید در متریک‌ها نسازد
+_KNOWN_ROUTES: Set[str] = set()
+
+
+class QueryScope:
+    """شمارنده کوئری‌های اجرا شده در یک آپدیت یا بلاک"""
+
+    def __init__(self, handler: str, parent: Optional["QueryScope"] = None):
+        self.handler = handler
+        self.parent = parent
+        self.count = 0
+        self.statements: List[str] = []
+
+    def record(self, statement: str):
+        scope = self
+        while scope is not None:
+            scope.count += 1
+            scope.statements.append(statement)
+            scope = scope.parent
+
+
+# با کپی شدن context به تردهای executor، همان شیء در ترد کارگر هم شمرده می‌شود
+_query_scope: ContextVar[Optional[QueryScope]] = ContextVar("foxybot_query_scope", default=None)
+
+
+@contextmanager
+def track_queries(label: str = "block"):
+    """شمارش کوئری‌های اجرا شده داخل یک بلاک (شامل هندلرهای فراخوانی شده در آن)"""
+    scope = QueryScope(label, _query_scope.get())
+    token = _query_scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _query_scope.reset(token)
+
+
+@contextmanager
+def assert_max_queries(limit: int, label: str = "block"):
+    """بررسی اینکه یک بلاک یا هندلر بیش از limit کوئری اجرا نکند (برای تست‌ها)"""
+    with track_queries(label) as scope:
+        yield scope
+    if scope.count > limit:
+        listing = "\n".join(f"  {i + 1}. {statement}" for i, statement in enumerate(scope.statements))
+        raise AssertionError(f"{label} executed {scope.count} queries (limit {limit}):\n{listing}")
+
+
+_update_cleanups: ContextVar[Optional[List[Callable[[], None]]]] = ContextVar("foxybot_update_cleanups", default=None)
+
+
+def call_after_update(func: Callable[[], None]) -> bool:
+    """ثبت تابعی که پس از پایان هندلر آپدیت جاری اجرا شود (خارج از آپدیت False برمی‌گرداند)"""
+    cleanups = _update_cleanups.get()
+    if cleanups is None:
+        return False
+    cleanups.append(func)
+    return True
+
+
+def _run_cleanups(cleanups: List[Callable[[], None]]):
+    for func in reversed(cleanups):
+        try:
+            func()
+        except Exception as e:
+            logger.error(f"Error in update cleanup: {e}")
+
+
+def callback_route(data: str) -> str:
+    """پیشوند کالبک بدون آرگومان‌ها (مثلاً buy_plan:12 یا قالب قدیمی buy_plan_12 -> buy_plan)"""
+    if ":" in data:
+        return data.split(":", 1)[0]
+    return _ID_SUFFIX.sub("", data)
+
+
+def register_routes(routes: Iterable[str]):
+    """افزودن برچسب‌های مجاز update_route (دستورها با / و مسیرهای کالبک)"""
+    _KNOWN_ROUTES.update(routes)
+
+
+def update_route(update: object) -> str:
+    """برچسب کوتاه و کم‌تنوع برای یک آپدیت (دستور، پیشوند کالبک یا نوع پیام)"""
+    if not isinstance(update, Update):
+        return "other"
+    if update.callback_query and update.callback_query.data:
+        route = callback_route(update.callback_query.data)
+        return route if route in _KNOWN_ROUTES else "other"
+    message = update.effective_message
+    if message is None:
+        return "other"
+    if message.text and message.text.startswith("/"):
+        # CommandHandler دستورها را بدون حساسیت به حروف بزرگ و کوچک تطبیق می‌دهد
+        command = message.text.split()[0].split("@")[0].lower()
+        return command if command in _KNOWN_ROUTES else "other"
+    if message.photo:
+        return "photo"
+    if message.text:
+        return "text"
+    return "other"
+
+
+def _wrap_callback(callback: Callable, bot_name: str) -> Callable:
+    handler_name = getattr(callback, "__name__", "handler")
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        route = update_route(update)
+        scope = QueryScope(handler_name, _query_scope.get())
+        token = _query_scope.set(scope)
+        cleanups = []
+        cleanup_token = _update_cleanups.set(cleanups)
+        start = time.perf_counter()
+        try:
+            with tracing.start_trace("update", bot=bot_name, handler=handler_name, route=route):
+                return await callback(update, context)
+        except Exception:
+            HANDLER_ERRORS.inc(bot=bot_name, handler=handler_name, route=route)
+            raise
+        finally:
+            _update_cleanups.reset(cleanup_token)
+            _run_cleanups(cleanups)
+            HANDLER_LATENCY.observe(time.perf_counter() - start, bot=bot_name, handler=handler_name, route=route)
+            _query_scope.reset(token)
+            _check_query_budget(scope, bot_name, route)
+
+    return wrapper
+
+
+def query_budget(route: str) -> int:
+    """حداکثر کوئری مجاز یک آپدیت این مسیر (DB_ROUTE_QUERY_BUDGETS یا DB_QUERY_BUDGET)"""
+    return DB_ROUTE_QUERY_BUDGETS.get(route, DB_QUERY_BUDGET)
+
+
+def _check_query_budget(scope: QueryScope, bot_name: str, route: str):
+    # همه کالبک‌ها از handle_callback می‌گذرند؛ بودجه و متریک‌ها به تفکیک مسیر هستند
+    DB_QUERIES_PER_UPDATE.observe(scope.count, bot=bot_name, route=route)
+    budget = query_budget(route)
+    if scope.count > budget:
+        DB_QUERY_BUDGET_EXCEEDED.inc(bot=bot_name, route=route)
+        # بیشترین کوئری‌های تکراری معمولاً نشانه بارگذاری تنبل (N+1) هستند
+        repeated = {}
+        for statement in scope.statements:
+            repeated[statement] = repeated.get(statement, 0) + 1
+        top = sorted(repeated.items(), key=lambda item: item[1], reverse=True)[:3]
+        details = "; ".join(f"{count}x {statement[:120]}" for statement, count in top)
+        logger.warning(
+            f"Handler {scope.handler} ({bot_name}, {route}) executed {scope.count} queries "
+            f"(budget {budget}). Most repeated: {details}"
+        )
+
+
+def instrument_application(application: Application, bot_name: str):
+    """اندازه‌گیری زمان همه هندلرهای ثبت‌شده یک ربات (پس از setup_handlers فراخوانی شود)"""
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            if isinstance(handler, CommandHandler):
+                register_routes(f"/{command}" for command in handler.commands)
+            if not getattr(handler.callback, "_foxybot_instrumented", False):
+                handler.callback = _wrap_callback(handler.callback, bot_name)
+                handler.callback._foxybot_instrumented = True
+
+
+def instrument_engine(engine: Engine, name: str):
+    """شمارش کوئری‌ها، لاگ کوئری‌های کند و زمان انتظار برای اتصال از استخر SQLAlchemy"""
+    if getattr(engine, "_foxybot_instrumented", False):
+        return
+    engine._foxybot_instrumented = True
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        query_span = tracing.begin_span("db.query", engine=name, statement=statement[:200])
+        conn.info.setdefault("foxybot_query_start", []).append((time.perf_counter(), query_span))
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started, query_span = conn.info["foxybot_query_start"].pop()
+        elapsed = time.perf_counter() - started
+        kind = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+        DB_QUERIES.inc(engine=name, statement=kind)
+        DB_QUERY_LATENCY.observe(elapsed, engine=name, statement=kind)
+        if query_span is not None:
+            query_span.finish()
+
+        scope = _query_scope.get()
+        if scope is not None:
+            scope.record(statement)
+        if elapsed >= DB_SLOW_QUERY_THRESHOLD:
+            handler = scope.handler if scope is not None else "background"
+            DB_SLOW_QUERIES.inc(engine=name, handler=handler)
+            slow_query_logger.warning(
+                f"Slow query ({elapsed * 1000:.0f} ms, engine={name}, handler={handler}): "
+                f"{' '.join(statement.split())[:500]}"
+            )
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(exception_context):
+        connection = exception_context.connection
+        stack = connection.info.get("foxybot_query_start") if connection is not None else None
+        if stack:
+            _, query_span = stack.pop()
+            if query_span is not None:
+                query_span.finish(exception_context.original_exception)
+
+    pool = engine.pool
+    connect = pool.connect
+
+    def timed_connect():
+        start = time.perf_counter()
+        try:
+            with tracing.span("db.checkout", engine=name):
+                return connect()
+        finally:
+            DB_POOL_WAIT.observe(time.perf_counter() - start, engine=name)
+
+    pool.connect = timed_connect
+
+    def collect_pool():
+        checkedout = getattr(engine.pool, "checkedout", None)
+        if checkedout is not None:
+            DB_POOL_CHECKED_OUT.set(checkedout(), engine=name)
+
+    REGISTRY.register_collector(collect_pool)
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """لایه درخواست Bot API با شمارش فراخوانی‌ها، خطاهای ۴۲۹ و زمان پاسخ"""
+
+    def __init__(self, bot_name: str, **kwargs):
+        # همان اندازه استخر پیش‌فرض ApplicationBuilder
+        kwargs.setdefault("connection_pool_size", 256)
+        super().__init__(**kwargs)
+        self.bot_name = bot_name
+
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        api_method = url.rstrip("/").rsplit("/", 1)[-1]
+        start = time.perf_counter()
+        try:
+            with tracing.span(f"telegram.{api_method}", bot=self.bot_name):
+                status, payload = await super().do_request(url, method, *args, **kwargs)
+        except Exception:
+            TELEGRAM_REQUESTS.inc(bot=self.bot_name, method=api_method, status="error")
+            raise
+        finally:
+            TELEGRAM_LATENCY.observe(time.perf_counter() - start, bot=self.bot_name, method=api_method)
+
+        TELEGRAM_REQUESTS.inc(bot=self.bot_name, method=api_method, status=str(status))
+        if status == 429:
+            TELEGRAM_RATE_LIMITED.inc(bot=self.bot_name, method=api_method)
+        return status, payload
@@ -0,0 +1,129 @@
+import asyncio
+import hashlib
+import logging
+from typing import Awaitable, Callable, Optional
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.pool import NullPool
+
+from config import LEADER_RETRY_INTERVAL, LEADER_HEARTBEAT_INTERVAL
+from bot.utils.executor import DB_POOL, run_blocking
+
+logger = logging.getLogger(__name__)
+
+
+def lock_key(name: str) -> int:
+    """تبدیل نام کار به کلید ۶۴ بیتی قفل advisory"""
+    digest = hashlib.blake2b(f"foxybot:{name}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+class AdvisoryLock:
+    """قفل advisory در سطح نشست PostgreSQL روی یک اتصال اختصاصی
+
+    قفل تا زمانی که اتصال باز است نگه داشته می‌شود؛ اگر پروسه از بین برود
+    اتصال بسته شده و قفل فوراً برای پروسه دیگر آزاد می‌شود.
+    """
+
+    def __init__(self, engine: Engine, name: str):
+        """مقداردهی اولیه"""
+        self.name = name
+        self.key = lock_key(name)
+        self.enabled = engine.dialect.name == "postgresql"
+        # اتصال قفل نباید از استخر اصلی گرفته شود یا به آن برگردد
+        self._engine = create_engine(engine.url, poolclass=NullPool) if self.enabled else None
+        self._connection: Optional[Connection] = None
+
+    def try_acquire(self) -> bool:
+        """تلاش برای گرفتن قفل بدون انتظار"""
+        if not self.enabled:
+            # دیتابیس‌های غیر PostgreSQL فقط برای اجرای تک‌نسخه‌ای استفاده می‌شوند
+            return True
+        if self._connection is not None:
+            return True
+
+        connection = self._engine.connect()
+        try:
+            acquired = connection.execute(
+                text("SELECT pg_try_advisory_lock(:key)"), {"key": self.key}
+            ).scalar()
+            connection.commit()
+        except Exception:
+            connection.close()
+            raise
+
+        if acquired:
+            self._connection = connection
+        else:
+            connection.close()
+        return bool(acquired)
+
+    def is_held(self) -> bool:
+        """بررسی سالم بودن اتصال نگه‌دارنده قفل"""
+        if not self.enabled:
+            return True
+        if self._connection is None:
+            return False
+        try:
+            self._connection.execute(text("SELECT 1"))
+            self._connection.commit()
+            return True
+        except Exception as e:
+            logger.warning(f"Lost connection holding lock '{self.name}': {e}")
+            self._discard()
+            return False
+
+    def release(self):
+        """آزاد کردن قفل و بستن اتصال"""
+        if self._connection is None:
+            return
+        try:
+            self._connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": self.key})
+            self._connection.commit()
+        except Exception as e:
+            logger.warning(f"Error releasing lock '{self.name}': {e}")
+        finally:
+            self._discard()
+
+    def _discard(self):
+        try:
+            self._connection.close()
+        except Exception:
+            pass
+        self._connection = None
+
+
+async def run_exclusive(engine: Engine, name: str, job: Callable[[], Awaitable[None]]):
+    """اجرای یک کار پس‌زمینه فقط در یک پروسه؛ بقیه پروسه‌ها در حالت آماده‌باش منتظر می‌مانند"""
+    lock = AdvisoryLock(engine, name)
+
+    while True:
+        try:
+            acquired = await run_blocking(DB_POOL, lock.try_acquire)
+        except Exception as e:
+            logger.error(f"Error acquiring lock for job '{name}': {e}")
+            acquired = False
+
+        if not acquired:
+            await asyncio.sleep(LEADER_RETRY_INTERVAL)
+            continue
+
+        logger.info(f"This process now owns background job '{name}'")
+        task = asyncio.create_task(job())
+        try:
+            while not task.done():
+                await asyncio.wait({task}, timeout=LEADER_HEARTBEAT_INTERVAL)
+                if not task.done() and not await run_blocking(DB_POOL, lock.is_held):
+                    logger.warning(f"Ownership of job '{name}' lost, stopping it")
+                    break
+
+            if task.done() and not task.cancelled() and task.exception():
+                logger.error(f"Background job '{name}' crashed: {task.exception()}")
+        finally:
+            if not task.done():
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+            await run_blocking(DB_POOL, lock.release)
+
+        await asyncio.sleep(LEADER_RETRY_INTERVAL)
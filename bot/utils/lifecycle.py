@@ -0,0 +1,177 @@
+import asyncio
+import logging
+import os
+import signal
+import socket
+import time
+from typing import Dict, List, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import Application
+
+from config import METRICS_PORT, DRAIN_TIMEOUT
+from bot.utils.metrics import start_metrics_server
+
+logger = logging.getLogger(__name__)
+
+STARTING = "starting"
+READY = "ready"
+DRAINING = "draining"
+
+
+class Lifecycle:
+    """وضعیت پروسه ربات برای مسیر /healthz
+
+    فقط وقتی سالم گزارش می‌شود که راه‌اندازی تمام شده و پولینگ همه ربات‌ها در حال
+    اجرا باشد؛ bot/handoff.py با همین مسیر منتظر آماده شدن پروسه جدید می‌ماند.
+    """
+
+    def __init__(self):
+        """مقداردهی اولیه"""
+        self.state = STARTING
+        self.started_at = time.time()
+        self._apps: List[Application] = []
+
+    def watch(self, *apps: Application):
+        self._apps.extend(apps)
+
+    def set_state(self, state: str):
+        if state != self.state:
+            logger.info(f"Process state: {self.state} -> {state}")
+            self.state = state
+
+    def health(self) -> Tuple[bool, Dict]:
+        polling = bool(self._apps) and all(app.updater and app.updater.running for app in self._apps)
+        healthy = self.state == READY and polling
+        status = self.state if self.state != READY or healthy else "degraded"
+        return healthy, {"status": status, "pid": os.getpid(), "uptime": round(time.time() - self.started_at)}
+
+
+LIFECYCLE = Lifecycle()
+
+
+def notify_systemd(**fields) -> bool:
+    """ارسال پیام sd_notify (مثلاً READY=1) در صورت اجرا زیر سرویس systemd با Type=notify"""
+    address = os.environ.get("NOTIFY_SOCKET")
+    if not address:
+        return False
+    if address.startswith("@"):
+        address = "\0" + address[1:]
+    message = "\n".join(f"{key}={value}" for key, value in fields.items())
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.connect(address)
+            sock.sendall(message.encode())
+        return True
+    except OSError as e:
+        logger.warning(f"Could not notify systemd ({message!r}): {e}")
+        return False
+
+
+def _is_running(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+
+async def take_over(pid: int, timeout: float = DRAIN_TIMEOUT) -> Optional[asyncio.AbstractServer]:
+    """گرفتن جای پروسه قبلی ربات وقتی این پروسه آماده دریافت آپدیت است
+
+    systemd از این پس این پروسه را پروسه اصلی سرویس می‌داند و به پروسه قبلی SIGTERM
+    فرستاده می‌شود. پروسه قبلی بعد از توقف پولینگ پورت متریک‌ها را آزاد می‌کند؛ پس
+    گرفتن همین پورت یعنی می‌توان پولینگ را بدون خطای Conflict تلگرام شروع کرد (اگر
+    endpoint متریک‌ها غیرفعال باشد تا خروج پروسه قبلی صبر می‌شود). اگر پروسه قبلی تا
+    timeout ثانیه پولینگ را متوقف نکند kill می‌شود. خروجی سرور متریک‌های این پروسه است.
+    """
+    notify_systemd(MAINPID=os.getpid())
+    try:
+        os.kill(pid, signal.SIGTERM)
+    except ProcessLookupError:
+        logger.warning(f"Previous bot process {pid} is not running")
+
+    logger.info(f"Waiting for previous bot process {pid} to stop polling...")
+    start = time.monotonic()
+    killed = False
+    while True:
+        running = _is_running(pid)
+        if METRICS_PORT:
+            try:
+                server = await start_metrics_server()
+                logger.info(f"Took over from process {pid} in {time.monotonic() - start:.2f}s")
+                return server
+            except OSError as e:
+                if not running:
+                    logger.error(f"Metrics port is still in use after process {pid} exited: {e}")
+                    return None
+        elif not running:
+            logger.info(f"Took over from process {pid} in {time.monotonic() - start:.2f}s")
+            return None
+
+        if not killed and time.monotonic() - start > timeout:
+            logger.warning(f"Process {pid} did not stop polling within {timeout:.0f}s, killing it")
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            killed = True
+        await asyncio.sleep(0.2)
+
+
+async def stop_polling(*apps: Optional[Application]):
+    """توقف دریافت آپدیت‌های جدید؛ آپدیت‌های دریافت‌شده در تلگرام تأیید می‌شوند و در صف می‌مانند"""
+    for app in apps:
+        if app is None or app.updater is None or not app.updater.running:
+            continue
+        try:
+            await app.updater.stop()
+        except Exception as e:
+            logger.error(f"Error stopping polling: {e}")
+
+
+def _discard_queued(app: Application) -> int:
+    """حذف آپدیت‌های صف پس از پایان مهلت تا بعد از شات‌داون پردازش نشوند (سیگنال توقف Application می‌ماند)"""
+    kept, discarded = [], 0
+    while True:
+        try:
+            item = app.update_queue.get_nowait()
+        except asyncio.QueueEmpty:
+            break
+        app.update_queue.task_done()
+        if isinstance(item, Update):
+            discarded += 1
+        else:
+            kept.append(item)
+    for item in kept:
+        app.update_queue.put_nowait(item)
+    return discarded
+
+
+async def drain(*apps: Optional[Application], timeout: float = DRAIN_TIMEOUT) -> bool:
+    """پردازش آپدیت‌های باقی‌مانده در صف و پایان هندلرهای در حال اجرا تا حداکثر timeout ثانیه"""
+    apps = [app for app in apps if app is not None and app.running]
+    if not apps:
+        return True
+
+    queued = sum(app.update_queue.qsize() for app in apps)
+    logger.info(f"Draining {queued} queued updates and running handlers (up to {timeout:.0f}s)...")
+    start = time.monotonic()
+    tasks = [asyncio.create_task(app.stop()) for app in apps]
+    done, pending = await asyncio.wait(tasks, timeout=timeout)
+    for task in done:
+        if task.exception() is not None:
+            logger.error(f"Error stopping bot: {task.exception()}")
+
+    if pending:
+        discarded = sum(_discard_queued(app) for app in apps)
+        logger.warning(f"Drain deadline reached, discarding {discarded} queued updates")
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        return False
+
+    logger.info(f"Drained in {time.monotonic() - start:.2f}s")
+    return True
@@ -0,0 +1,392 @@
+import asyncio
+import html
+import json
+import logging
+import os
+import tempfile
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, Iterator, List, Optional
+
+import requests
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from config import MIGRATION_CONCURRENCY, MIGRATION_BATCH_SIZE, MIGRATION_PROGRESS_INTERVAL, PROVISIONING_LOCK_TIMEOUT
+from db import models, crud
+from bot.utils.hiddify import HiddifyAPI
+from bot.utils.ratelimit import BACKGROUND, run_panel
+from bot.utils.catalog import CATALOG
+from bot.utils.provisioning import execute_panel_job
+from bot.utils.executor import DB_POOL, run_blocking
+from bot.utils.leader import AdvisoryLock
+from bot.utils.metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+MIGRATION_USERS = Counter(
+    "foxybot_panel_migration_users_total",
+    "Users processed by panel migrations, by outcome",
+    ("source", "target", "result")
+)
+
+# فیلدهایی که به پنل مبدأ وابسته‌اند و کپی نمی‌شوند
+PANEL_LOCAL_FIELDS = {"id", "added_by_uuid"}
+# فیلدهایی که پس از کپی روی پنل مقصد بررسی می‌شوند (باقی‌مانده روزها از start_date و package_days به دست می‌آید)
+VERIFIED_FIELDS = ("usage_limit_GB", "package_days", "start_date", "enable")
+# فاصله بررسی پایان کارهای در حال اجرای صف پنل مبدأ
+JOB_POLL_INTERVAL = 1.0
+
+
+class PanelMigrationBusyError(Exception):
+    """یکی از پنل‌های انتقال در همین پروسه یا پروسه دیگری در حال انتقال است"""
+
+
+@dataclass
+class MigrationProgress:
+    source: str
+    target: str
+    total: int = 0
+    copied: int = 0
+    moved: int = 0
+    removed: int = 0
+    failed: int = 0
+    errors: List[str] = field(default_factory=list)
+    started_at: float = field(default_factory=time.monotonic)
+    finished: bool = False
+
+    def fail(self, uuid: str, reason: str):
+        self.failed += 1
+        # فقط چند خطای اول برای گزارش نگه داشته می‌شوند
+        if len(self.errors) < 5:
+            self.errors.append(f"{uuid}: {reason}")
+
+
+def migration_payload(user: Dict) -> Dict:
+    """اطلاعات کاربر برای ساخت روی پنل مقصد (uuid، حجم، روزها و مصرف حفظ می‌شوند)"""
+    return {key: value for key, value in user.items() if key not in PANEL_LOCAL_FIELDS and key != "uuid"}
+
+
+def verify_user(target: HiddifyAPI, user: Dict) -> Optional[str]:
+    """بررسی کاربر روی پنل مقصد؛ در صورت اختلاف دلیل آن برگردانده می‌شود"""
+    try:
+        copied = target.get_user(user["uuid"])
+    except requests.HTTPError as e:
+        return f"not found on target ({e.response.status_code})"
+    for key in VERIFIED_FIELDS:
+        if key in user and copied.get(key) != user[key]:
+            return f"{key} is {copied.get(key)!r}, expected {user[key]!r}"
+    # مصرف روی مقصد نباید کمتر از مبدأ باشد
+    if (copied.get("current_usage_GB") or 0) + 0.001 < (user.get("current_usage_GB") or 0):
+        return "usage was not copied"
+    return None
+
+
+def user_changed(before: Dict, after: Dict) -> bool:
+    """کاربر مبدأ پس از کپی تغییر کرده است (فیلدهای بررسی‌شده یا افزایش مصرف)"""
+    if any(after.get(key) != before.get(key) for key in VERIFIED_FIELDS):
+        return True
+    return (after.get("current_usage_GB") or 0) > (before.get("current_usage_GB") or 0) + 0.001
+
+
+def migration_lock(engine: Engine, panel_id: int) -> AdvisoryLock:
+    """قفل انتقال یک پنل که پروسه اجراکننده انتقال تا پایان آن نگه می‌دارد"""
+    return AdvisoryLock(engine, f"panel_migration:{panel_id}")
+
+
+def recover_interrupted_migrations(engine: Engine, session_factory: Callable[[], Session]) -> List[int]:
+    """بازگرداندن وضعیت پنل‌هایی که انتقالشان با کرش پروسه نیمه‌کاره مانده است
+
+    پنلی که قفل انتقالش دست پروسه دیگری است (انتقال آن هنوز در حال اجراست) دست نمی‌خورد.
+    """
+    restored = []
+    db = session_factory()
+    try:
+        for panel_id in crud.get_migrating_panel_ids(db):
+            lock = migration_lock(engine, panel_id)
+            if not lock.try_acquire():
+                logger.info(f"Panel {panel_id} is being migrated by another process")
+                continue
+            try:
+                crud.end_panel_migration(db, panel_id)
+            finally:
+                lock.release()
+            restored.append(panel_id)
+            logger.warning(f"Restored the status of panel {panel_id} after an interrupted migration")
+    finally:
+        db.close()
+    if restored:
+        CATALOG.reload()
+    return restored
+
+
+class PanelMigration:
+    """انتقال کاربران از یک پنل به پنل دیگر
+
+    مراحل برای هر دسته از کاربران: کپی روی مقصد و بررسی آن با همزمانی محدود،
+    تغییر panel_id اشتراک‌ها (و کارهای منتظر صف) با یک UPDATE، و در پایان حذف از
+    پنل مبدأ. کاربری که کپی یا بررسی آن ناموفق باشد روی مبدأ باقی می‌ماند.
+    پنل مبدأ در طول انتقال در حالت MAINTENANCE است تا خرید جدیدی روی آن ثبت نشود و
+    کارهای صف آن (تمدید، غیرفعال‌سازی و ...) پیش از گرفتن لیست کاربران متوقف می‌شوند
+    تا تغییری روی مبدأ جا نماند؛ کارهای منتظر همراه کاربران به مقصد منتقل می‌شوند.
+    وضعیت قبلی پنل در دیتابیس نگه داشته می‌شود تا پس از کرش هم قابل بازگرداندن باشد.
+    قفل advisory هر دو پنل در تمام مدت انتقال نگه داشته می‌شود تا پروسه دیگری همزمان
+    آن‌ها را منتقل یا وضعیتشان را بازگردانی نکند.
+    """
+
+    def __init__(
+        self,
+        engine: Engine,
+        session_factory: Callable[[], Session],
+        source_id: int,
+        target_id: int,
+        limit: Optional[int] = None,
+        on_progress: Optional[Callable[[MigrationProgress], Awaitable[None]]] = None
+    ):
+        """مقداردهی اولیه"""
+        self.session_factory = session_factory
+        self.source_id = source_id
+        self.target_id = target_id
+        self.limit = limit
+        self.on_progress = on_progress
+        self.progress: Optional[MigrationProgress] = None
+        self._limit = asyncio.Semaphore(MIGRATION_CONCURRENCY)
+        self._locks = [migration_lock(engine, panel_id) for panel_id in sorted({source_id, target_id})]
+
+    def try_lock(self) -> bool:
+        """گرفتن قفل انتقال هر دو پنل؛ اگر یکی از آن‌ها در حال انتقال باشد هیچ قفلی نگه داشته نمی‌شود"""
+        for lock in self._locks:
+            if not lock.try_acquire():
+                self.unlock()
+                return False
+        return True
+
+    def unlock(self):
+        for lock in self._locks:
+            lock.release()
+
+    def _check_lock(self):
+        if not all(lock.is_held() for lock in self._locks):
+            raise PanelMigrationBusyError("Lost the migration lock")
+
+    def _prepare(self) -> Dict[str, HiddifyAPI]:
+        db = self.session_factory()
+        try:
+            source = crud.get_panel(db, self.source_id)
+            target = crud.get_panel(db, self.target_id)
+            if source is None or target is None:
+                raise ValueError("Source or target panel not found")
+            if source.id == target.id:
+                raise ValueError("Source and target panels are the same")
+            return {
+                "source": HiddifyAPI.for_panel(source, BACKGROUND),
+                "target": HiddifyAPI.for_panel(target, BACKGROUND)
+            }
+        finally:
+            db.close()
+
+    def _enter_maintenance(self):
+        db = self.session_factory()
+        try:
+            crud.begin_panel_migration(db, self.source_id)
+        finally:
+            db.close()
+        # خریدهای جدید از همین حالا روی پنل مبدأ ثبت نشوند
+        CATALOG.reload()
+
+    def _restore_status(self):
+        db = self.session_factory()
+        try:
+            crud.end_panel_migration(db, self.source_id)
+        finally:
+            db.close()
+        CATALOG.reload()
+
+    def _running_jobs(self) -> int:
+        db = self.session_factory()
+        try:
+            return crud.count_running_panel_jobs(db, self.source_id, PROVISIONING_LOCK_TIMEOUT)
+        finally:
+            db.close()
+
+    def _requeue_abandoned_jobs(self) -> int:
+        db = self.session_factory()
+        try:
+            return crud.requeue_abandoned_panel_jobs(db, self.source_id, PROVISIONING_LOCK_TIMEOUT)
+        finally:
+            db.close()
+
+    async def _wait_for_jobs(self, source: HiddifyAPI):
+        """انتظار برای پایان کارهایی که ورکر صف پیش از توقف صف پنل مبدأ شروع کرده است"""
+        # ورکری که همین حالا کاری را برداشته فرصت ثبت آن را داشته باشد
+        await asyncio.sleep(JOB_POLL_INTERVAL)
+        while await run_blocking(DB_POOL, self._running_jobs):
+            logger.info(f"Waiting for running panel jobs on {source.domain} before migrating...")
+            await asyncio.sleep(JOB_POLL_INTERVAL)
+        # کار رهاشده ورکری که از کار افتاده، منتظر می‌ماند و همراه کاربرش منتقل می‌شود
+        requeued = await run_blocking(DB_POOL, self._requeue_abandoned_jobs)
+        if requeued:
+            logger.warning(f"Requeued {requeued} abandoned panel jobs on {source.domain}")
+
+    def _snapshot(self, source: HiddifyAPI, path: str) -> int:
+        """ذخیره جریانی لیست کاربران مبدأ در فایل موقت تا انتقال به اتصال باز پنل وابسته نباشد"""
+        count = 0
+        with open(path, "w", encoding="utf-8") as f:
+            for user in source.iter_users():
+                if self.limit is not None and count >= self.limit:
+                    break
+                f.write(json.dumps(user, ensure_ascii=False) + "\n")
+                count += 1
+        return count
+
+    def _move(self, uuids: List[str]) -> int:
+        db = self.session_factory()
+        try:
+            return crud.move_panel_users(db, uuids, self.source_id, self.target_id)
+        finally:
+            db.close()
+
+    async def run(self) -> MigrationProgress:
+        """اجرای کامل انتقال و برگرداندن نتیجه"""
+        if not await run_blocking(DB_POOL, self.try_lock):
+            raise PanelMigrationBusyError("One of the panels is already being migrated")
+        try:
+            return await self._run()
+        finally:
+            await run_blocking(DB_POOL, self.unlock)
+
+    async def _run(self) -> MigrationProgress:
+        panels = await run_blocking(DB_POOL, self._prepare)
+        source, target = panels["source"], panels["target"]
+        self.progress = progress = MigrationProgress(source=source.domain, target=target.domain)
+        reporter = asyncio.create_task(self._report_periodically())
+        path = None
+        try:
+            await run_blocking(DB_POOL, self._enter_maintenance)
+            await self._wait_for_jobs(source)
+            descriptor, path = tempfile.mkstemp(prefix="foxybot-migration-", suffix=".jsonl")
+            os.close(descriptor)
+            progress.total = await run_panel(source, self._snapshot, source, path)
+            for batch in _read_batches(path, MIGRATION_BATCH_SIZE):
+                # با از دست رفتن اتصال قفل، پروسه دیگری ممکن است وضعیت پنل مبدأ را بازگردانده باشد
+                await run_blocking(DB_POOL, self._check_lock)
+                await self._migrate_batch(source, target, batch)
+            logger.info(
+                f"Migrated {progress.removed}/{progress.total} users from {source.domain} "
+                f"to {target.domain} ({progress.failed} failed)"
+            )
+        finally:
+            try:
+                if path:
+                    os.remove(path)
+            finally:
+                try:
+                    await run_blocking(DB_POOL, self._restore_status)
+                finally:
+                    progress.finished = True
+                    reporter.cancel()
+                    await self._report()
+        return progress
+
+    async def _migrate_batch(self, source: HiddifyAPI, target: HiddifyAPI, users: List[Dict]):
+        progress = self.progress
+
+        async def copy(user: Dict) -> Optional[str]:
+            uuid = user.get("uuid")
+            async with self._limit:
+                try:
+                    # CREATE در صورت وجود کاربر روی مقصد آن را به‌روزرسانی می‌کند؛ اجرای دوباره انتقال بی‌خطر است
+                    await run_panel(target, execute_panel_job, target, models.PanelJobType.CREATE, uuid, migration_payload(user))
+                    problem = await run_panel(target, verify_user, target, user)
+                except Exception as e:
+                    problem = str(e)
+            if problem:
+                progress.fail(uuid, problem)
+                MIGRATION_USERS.inc(source=source.domain, target=target.domain, result="failed")
+                return None
+            progress.copied += 1
+            return uuid
+
+        copied = [uuid for uuid in await asyncio.gather(*[copy(user) for user in users]) if uuid]
+        if not copied:
+            return
+        # اشتراک‌ها قبل از حذف از مبدأ به مقصد اشاره می‌کنند تا کاربر هیچ‌وقت به پنلی بدون حساب ارجاع نشود
+        progress.moved += await run_blocking(DB_POOL, self._move, copied)
+
+        snapshots = {user.get("uuid"): user for user in users}
+
+        async def remove(uuid: str):
+            async with self._limit:
+                try:
+                    # تغییرات مبدأ پس از گرفتن لیست (مثلاً مصرف یا ویرایش دستی در پنل) پیش از حذف به مقصد برده می‌شوند
+                    current = await run_panel(source, source.get_user, uuid)
+                    if user_changed(snapshots[uuid], current):
+                        await run_panel(target, execute_panel_job, target, models.PanelJobType.CREATE, uuid, migration_payload(current))
+                        problem = await run_panel(target, verify_user, target, current)
+                        if problem:
+                            raise ValueError(f"changed on source and could not be re-synced: {problem}")
+                except Exception as e:
+                    logger.warning(f"Keeping migrated user {uuid} on {source.domain}: {e}")
+                    progress.fail(uuid, f"copied but not removed from source: {e}")
+                    MIGRATION_USERS.inc(source=source.domain, target=target.domain, result="not_removed")
+                    return
+                try:
+                    await run_panel(source, execute_panel_job, source, models.PanelJobType.DELETE, uuid, {})
+                except Exception as e:
+                    # کاربر روی مقصد فعال است؛ باقی ماندن نسخه مبدأ فقط فضای پنل را می‌گیرد
+                    logger.warning(f"Could not remove migrated user {uuid} from {source.domain}: {e}")
+                    progress.fail(uuid, f"copied but not removed from source: {e}")
+                    MIGRATION_USERS.inc(source=source.domain, target=target.domain, result="not_removed")
+                    return
+            progress.removed += 1
+            MIGRATION_USERS.inc(source=source.domain, target=target.domain, result="migrated")
+
+        await asyncio.gather(*[remove(uuid) for uuid in copied])
+
+    async def _report_periodically(self):
+        while True:
+            await asyncio.sleep(MIGRATION_PROGRESS_INTERVAL)
+            await self._report()
+
+    async def _report(self):
+        if self.on_progress is None or self.progress is None:
+            return
+        try:
+            await self.on_progress(self.progress)
+        except Exception as e:
+            logger.debug(f"Migration progress callback failed: {e}")
+
+
+def _read_batches(path: str, size: int) -> Iterator[List[Dict]]:
+    batch = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            batch.append(json.loads(line))
+            if len(batch) >= size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def format_progress(progress: MigrationProgress) -> str:
+    """متن پیام وضعیت انتقال که به صورت زنده ویرایش می‌شود"""
+    done = progress.removed + progress.failed
+    percent = done * 100 // progress.total if progress.total else (100 if progress.finished else 0)
+    bar = "▓" * (percent // 10) + "░" * (10 - percent // 10)
+    title = "✅ <b>انتقال کاربران پایان یافت</b>" if progress.finished else "🚚 <b>در حال انتقال کاربران</b>"
+    message = (
+        f"{title}\n\n"
+        f"📤 از: <code>{progress.source}</code>\n"
+        f"📥 به: <code>{progress.target}</code>\n\n"
+        f"{bar} {percent}%\n\n"
+        f"👥 کل کاربران: <code>{progress.total:,}</code>\n"
+        f"📋 کپی و بررسی‌شده: <code>{progress.copied:,}</code>\n"
+        f"🔗 اشتراک‌های منتقل‌شده: <code>{progress.moved:,}</code>\n"
+        f"🗑 حذف‌شده از مبدأ: <code>{progress.removed:,}</code>\n"
+        f"❌ ناموفق: <code>{progress.failed:,}</code>\n"
+        f"⏱ زمان: <code>{int(time.monotonic() - progress.started_at)}</code> ثانیه"
+    )
+    if progress.errors:
+        message += "\n\n⚠️ <b>خطاها:</b>\n" + "\n".join(f"<code>{html.escape(error[:120])}</code>" for error in progress.errors)
+    return message
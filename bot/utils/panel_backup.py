@@ -0,0 +1,265 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from config import PANEL_BACKUP_DIR, PANEL_BACKUP_FULL_EVERY, PANEL_BACKUP_KEEP_FULL, BACKUP_COMPRESSION
+from bot.utils.backup import EXTENSIONS, compressed_writer, format_size, open_backup, resolve_compression
+from bot.utils.hiddify import HiddifyAPI
+from bot.utils.metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+PANEL_BACKUP_USERS = Counter(
+    "foxybot_panel_backup_users_total",
+    "Panel users seen by backups, by whether they were written",
+    ("panel", "result")
+)
+PANEL_BACKUP_LATENCY = Histogram(
+    "foxybot_panel_backup_duration_seconds",
+    "Duration of panel backups",
+    ("panel", "kind")
+)
+
+PANEL_BACKUP_NAME = re.compile(r"^panel-(\d+)-(\d{8}-\d{6})\.(full|incr)\.jsonl\.(gz|zst)$")
+FORMAT_VERSION = 1
+
+
+@dataclass
+class PanelBackupResult:
+    path: str
+    kind: str
+    base: Optional[str]
+    users: int
+    changed: int
+    deleted: int
+    size: int
+    duration: float
+    removed: List[str] = field(default_factory=list)
+
+
+def _record_digest(record: Dict) -> bytes:
+    canonical = json.dumps(record, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.blake2b(canonical.encode(), digest_size=8).digest()
+
+
+def _uuid_key(value: str) -> bytes:
+    """کلید ۱۶ بایتی کاربر در ایندکس (حافظه کمتر از رشته uuid)"""
+    try:
+        return uuid.UUID(value).bytes
+    except (TypeError, ValueError):
+        # شناسه غیر استاندارد؛ هش آن کلید می‌شود و متن آن جداگانه نگه داشته می‌شود
+        return hashlib.blake2b(str(value).encode(), digest_size=16).digest()
+
+
+def _index_path(directory: str, panel_id: int) -> str:
+    return os.path.join(directory, f"panel-{panel_id}.index")
+
+
+class _Index:
+    """هش ۸ بایتی رکورد هر کاربر در آخرین بکاپ، برای تشخیص تغییرات"""
+
+    def __init__(self):
+        self.digests: Dict[bytes, bytes] = {}
+        self._irregular: Dict[bytes, str] = {}
+
+    def add(self, name: str, digest: bytes) -> bytes:
+        key = _uuid_key(name)
+        self.digests[key] = digest
+        if str(uuid.UUID(bytes=key)) != name:
+            self._irregular[key] = name
+        return key
+
+    def name(self, key: bytes) -> str:
+        return self._irregular.get(key) or str(uuid.UUID(bytes=key))
+
+    @classmethod
+    def load(cls, path: str) -> Tuple[Dict, "_Index"]:
+        index = cls()
+        if not os.path.exists(path):
+            return {}, index
+        with open(path, "r", encoding="utf-8") as f:
+            meta = json.loads(f.readline())
+            for line in f:
+                name, digest = line.rstrip("\n").rsplit(" ", 1)
+                index.add(name, bytes.fromhex(digest))
+        return meta, index
+
+    def save(self, path: str, meta: Dict):
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps(meta) + "\n")
+            for key, digest in self.digests.items():
+                f.write(f"{self.name(key)} {digest.hex()}\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+
+
+def list_panel_backups(panel_id: int, directory: str = PANEL_BACKUP_DIR) -> List[str]:
+    """فایل‌های بکاپ یک پنل از قدیمی به جدید"""
+    if not os.path.isdir(directory):
+        return []
+    names = [
+        name for name in os.listdir(directory)
+        if (match := PANEL_BACKUP_NAME.match(name)) and int(match.group(1)) == panel_id
+    ]
+    names.sort(key=lambda name: PANEL_BACKUP_NAME.match(name).group(2))
+    return [os.path.join(directory, name) for name in names]
+
+
+def rotate_panel_backups(panel_id: int, directory: str = PANEL_BACKUP_DIR, keep_full: int = PANEL_BACKUP_KEEP_FULL) -> List[str]:
+    """نگه داشتن keep_full بکاپ کامل آخر به همراه بکاپ‌های افزایشی وابسته به آن‌ها"""
+    backups = list_panel_backups(panel_id, directory)
+    full = [i for i, path in enumerate(backups) if ".full." in os.path.basename(path)]
+    if keep_full <= 0 or len(full) <= keep_full:
+        return []
+    removed = backups[:full[-keep_full]]
+    for path in removed:
+        os.remove(path)
+    return removed
+
+
+def backup_panel(
+    panel_id: int,
+    api: HiddifyAPI,
+    directory: str = PANEL_BACKUP_DIR,
+    compression: str = BACKUP_COMPRESSION,
+    full_every: int = PANEL_BACKUP_FULL_EVERY,
+    keep_full: int = PANEL_BACKUP_KEEP_FULL
+) -> PanelBackupResult:
+    """بکاپ جریانی کاربران پنل به صورت JSONL فشرده
+
+    کاربران از پاسخ API به صورت جریانی خوانده و خط‌به‌خط در فایل نوشته می‌شوند؛
+    در حافظه فقط هش ۸ بایتی هر کاربر نگه داشته می‌شود. اگر بکاپ قبلی وجود داشته
+    باشد فقط کاربران تغییر یافته و حذف‌شده نوشته می‌شوند (خط header نام بکاپ پایه
+    را دارد) و هر full_every بکاپ یک بار بکاپ کامل گرفته می‌شود.
+    """
+    compression = resolve_compression(compression)
+    os.makedirs(directory, exist_ok=True)
+    index_path = _index_path(directory, panel_id)
+    meta, previous = _Index.load(index_path)
+    base = meta.get("last")
+    if base and not os.path.exists(os.path.join(directory, base)):
+        base = None
+    incremental = bool(base) and meta.get("since_full", 0) < full_every
+    kind = "incr" if incremental else "full"
+    if not incremental:
+        previous = _Index()
+
+    name = f"panel-{panel_id}-{datetime.now():%Y%m%d-%H%M%S}.{kind}.jsonl.{EXTENSIONS[compression]}"
+    final_path = os.path.join(directory, name)
+    temp_path = os.path.join(directory, f".{name}.tmp")
+    current = _Index()
+    changed = 0
+
+    start = time.perf_counter()
+    try:
+        with open(temp_path, "wb") as raw:
+            out = compressed_writer(raw, compression)
+
+            def write(record: Dict):
+                out.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode() + b"\n")
+
+            write({
+                "type": "header",
+                "version": FORMAT_VERSION,
+                "panel_id": panel_id,
+                "domain": api.domain,
+                "kind": "incremental" if incremental else "full",
+                "base": base if incremental else None,
+                "created_at": datetime.now().isoformat(timespec="seconds")
+            })
+            for user in api.iter_users():
+                digest = _record_digest(user)
+                key = current.add(str(user.get("uuid")), digest)
+                if previous.digests.get(key) == digest:
+                    continue
+                write({"type": "user", "data": user})
+                changed += 1
+
+            deleted = 0
+            for key in previous.digests.keys() - current.digests.keys():
+                write({"type": "deleted", "uuid": previous.name(key)})
+                deleted += 1
+            write({"type": "footer", "users": len(current.digests), "changed": changed, "deleted": deleted})
+            out.close()
+            raw.flush()
+            os.fsync(raw.fileno())
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    os.replace(temp_path, final_path)
+    # ایندکس پس از فایل بکاپ نوشته می‌شود؛ اگر بین این دو قطع شود بکاپ بعدی نسبت به ایندکس قبلی محاسبه می‌شود
+    current.save(index_path, {
+        "last": name,
+        "since_full": meta.get("since_full", 0) + 1 if incremental else 0
+    })
+
+    duration = time.perf_counter() - start
+    PANEL_BACKUP_LATENCY.observe(duration, panel=api.domain, kind=kind)
+    PANEL_BACKUP_USERS.inc(changed, panel=api.domain, result="written")
+    PANEL_BACKUP_USERS.inc(len(current.digests) - changed, panel=api.domain, result="unchanged")
+    return PanelBackupResult(
+        path=final_path,
+        kind=kind,
+        base=base if incremental else None,
+        users=len(current.digests),
+        changed=changed,
+        deleted=deleted,
+        size=os.path.getsize(final_path),
+        duration=duration,
+        removed=rotate_panel_backups(panel_id, directory, keep_full)
+    )
+
+
+def read_panel_backup(path: str) -> Iterator[Dict]:
+    """خواندن جریانی رکوردهای یک فایل بکاپ پنل (بدون header و footer)"""
+    with open_backup(path) as stream:
+        complete = False
+        for line in stream:
+            record = json.loads(line)
+            if record["type"] == "footer":
+                complete = True
+            elif record["type"] != "header":
+                yield record
+        if not complete:
+            raise ValueError(f"Panel backup is truncated: {path}")
+
+
+def backup_chain(path: str) -> List[str]:
+    """فایل‌های لازم برای بازسازی وضعیت پنل، از بکاپ کامل تا path"""
+    chain = [path]
+    directory = os.path.dirname(path)
+    while True:
+        with open_backup(chain[0]) as stream:
+            header = json.loads(stream.readline())
+        if not header.get("base"):
+            return chain
+        chain.insert(0, os.path.join(directory, header["base"]))
+
+
+def format_panel_summary(result: PanelBackupResult, domain: str) -> str:
+    """متن گزارش بکاپ پنل برای ادمین"""
+    kind = "افزایشی" if result.kind == "incr" else "کامل"
+    message = (
+        f"💾 <b>بکاپ {kind} پنل {domain}</b>\n\n"
+        f"👥 کاربران پنل: <code>{result.users:,}</code>\n"
+        f"✏️ ذخیره‌شده: <code>{result.changed:,}</code>\n"
+    )
+    if result.kind == "incr":
+        message += f"🗑 حذف‌شده: <code>{result.deleted:,}</code>\n"
+        message += f"🔗 بکاپ پایه: <code>{result.base}</code>\n"
+    message += (
+        f"📦 حجم: <code>{format_size(result.size)}</code>\n"
+        f"⏱ مدت: <code>{result.duration:.1f}</code> ثانیه"
+    )
+    return message
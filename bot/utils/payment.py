@@ -6,6 +6,7 @@ from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup
 from config import ADMIN_TELEGRAM_ID
 
 from db import models, crud
+from bot.utils.callbacks import callback_data
 
 logger = logging.getLogger(__name__)
 
@@ -54,11 +55,11 @@ class PaymentManager:
                 [
                     InlineKeyboardButton(
                         "📸 ارسال رسید",
-                        callback_data=f"payment_confirm_{transaction.id}"
+                        callback_data=callback_data("payment_confirm", transaction.id)
                     ),
                     InlineKeyboardButton(
                         "❌ انصراف",
-                        callback_data=f"payment_cancel_{transaction.id}"
+                        callback_data=callback_data("payment_cancel", transaction.id)
                     )
                 ]
             ]
@@ -122,11 +123,11 @@ class PaymentManager:
                 [
                     InlineKeyboardButton(
                         "✅ تأیید پرداخت",
-                        callback_data=f"admin_confirm_{transaction.id}"
+                        callback_data=callback_data("admin_confirm", transaction.id)
                     ),
                     InlineKeyboardButton(
                         "❌ رد پرداخت",
-                        callback_data=f"admin_reject_{transaction.id}"
+                        callback_data=callback_data("admin_reject", transaction.id)
                     )
                 ]
             ]
@@ -0,0 +1,222 @@
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+
+from sqlalchemy.orm import Session
+from telegram.ext import BasePersistence, PersistenceInput
+
+from config import PERSISTENCE_FLUSH_INTERVAL, PERSISTENCE_STATE_TTL, PERSISTENCE_PURGE_INTERVAL
+from db import crud
+from bot.utils.executor import DB_POOL, run_blocking
+from bot.utils.metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+PERSISTENCE_LOADS = Counter(
+    "foxybot_persistence_loads_total",
+    "Conversation state lookups on a user's first update in this process",
+    ("bot", "result")
+)
+PERSISTENCE_WRITES = Counter(
+    "foxybot_persistence_rows_written_total",
+    "Conversation state rows upserted or deleted by write-behind flushes",
+    ("bot", "operation")
+)
+PERSISTENCE_FLUSH_LATENCY = Histogram(
+    "foxybot_persistence_flush_seconds",
+    "Duration of one write-behind flush batch",
+    ("bot",)
+)
+
+
+def _encode(data: Dict) -> Tuple[Dict, str]:
+    """حذف کلیدهای غیرقابل ذخیره در JSON و ساخت نسخه متنی برای تشخیص تغییر"""
+    clean = {}
+    for key, value in data.items():
+        try:
+            json.dumps(value)
+        except (TypeError, ValueError):
+            logger.warning(f"Skipping non-JSON conversation state key {key!r}")
+            continue
+        clean[str(key)] = value
+    return clean, json.dumps(clean, sort_keys=True)
+
+
+class DatabasePersistence(BasePersistence):
+    """ذخیره context.user_data در دیتابیس با بارگذاری تنبل و نوشتن دسته‌ای
+
+    داده هر کاربر فقط در اولین آپدیت او در این پروسه خوانده می‌شود. تغییرات
+    در فواصل update_interval توسط Application جمع‌آوری و در یک تراکنش نوشته
+    می‌شوند؛ ردیف‌هایی که بیش از TTL دست‌نخورده بمانند از جدول حذف می‌شوند.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session],
+        bot_name: str,
+        update_interval: float = PERSISTENCE_FLUSH_INTERVAL,
+        ttl: int = PERSISTENCE_STATE_TTL
+    ):
+        """مقداردهی اولیه"""
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval
+        )
+        self.session_factory = session_factory
+        self.bot_name = bot_name
+        self.ttl = ttl
+        # آخرین زمان استفاده هر کاربر بارگذاری‌شده (monotonic)
+        self._touched: Dict[int, float] = {}
+        # آخرین نسخه نوشته‌شده یا خوانده‌شده برای پرهیز از نوشتن داده بدون تغییر
+        self._written: Dict[int, str] = {}
+        # تغییرات در انتظار نوشتن؛ None یعنی حذف
+        self._dirty: Dict[int, Optional[Tuple[Dict, str]]] = {}
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+        # کاربرانی که فقط از حافظه خارج می‌شوند و ردیف آن‌ها باید بماند
+        self._released: Set[int] = set()
+
+    # داده‌ها به صورت تنبل و در refresh_user_data بارگذاری می‌شوند
+    async def get_user_data(self) -> Dict[int, Dict[Any, Any]]:
+        return {}
+
+    async def get_chat_data(self) -> Dict[int, Dict[Any, Any]]:
+        return {}
+
+    async def get_bot_data(self) -> Dict[Any, Any]:
+        return {}
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def get_conversations(self, name: str) -> Dict:
+        return {}
+
+    async def update_conversation(self, name: str, key: Tuple[int, ...], new_state: Optional[object]) -> None:
+        pass
+
+    async def update_chat_data(self, chat_id: int, data: Dict[Any, Any]) -> None:
+        pass
+
+    async def update_bot_data(self, data: Dict[Any, Any]) -> None:
+        pass
+
+    async def update_callback_data(self, data: Any) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Dict[Any, Any]) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: Dict[Any, Any]) -> None:
+        pass
+
+    async def refresh_user_data(self, user_id: int, user_data: Dict[Any, Any]) -> None:
+        """بارگذاری وضعیت ذخیره‌شده کاربر در اولین آپدیت او"""
+        first_contact = user_id not in self._touched
+        self._touched[user_id] = time.monotonic()
+        if not first_contact:
+            return
+
+        stored = await run_blocking(DB_POOL, self._load, user_id)
+        PERSISTENCE_LOADS.inc(bot=self.bot_name, result="hit" if stored else "miss")
+        if stored:
+            for key, value in stored.items():
+                user_data.setdefault(key, value)
+        self._written[user_id] = _encode(stored or {})[1]
+
+    async def update_user_data(self, user_id: int, data: Dict[Any, Any]) -> None:
+        """ثبت تغییرات کاربر برای نوشتن در دسته بعدی"""
+        encoded = _encode(data)
+        if self._written.get(user_id, "{}") == encoded[1]:
+            self._dirty.pop(user_id, None)
+            return
+        self._dirty[user_id] = encoded
+        self._schedule_flush()
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._touched.pop(user_id, None)
+        self._written.pop(user_id, None)
+        if user_id in self._released:
+            # خروج از حافظه؛ داده در آپدیت بعدی کاربر دوباره بارگذاری می‌شود
+            self._released.discard(user_id)
+            return
+        self._dirty[user_id] = None
+        self._schedule_flush()
+
+    def release(self, user_id: int):
+        """علامت‌گذاری کاربر تا drop_user_data بعدی فقط حافظه را آزاد کند و ردیف را حذف نکند"""
+        self._released.add(user_id)
+
+    def _schedule_flush(self):
+        # همه update_user_data های یک دور update_persistence پیش از اجرای این تسک ثبت می‌شوند
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self.flush())
+
+    async def flush(self) -> None:
+        """نوشتن همه تغییرات در انتظار در یک تراکنش"""
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+            batch, self._dirty = self._dirty, {}
+            start = time.perf_counter()
+            try:
+                await run_blocking(DB_POOL, self._write, batch)
+            except Exception as e:
+                logger.error(f"Error flushing conversation state for {self.bot_name} bot: {e}")
+                # تغییرات جدیدتر بر نسخه ناموفق اولویت دارند
+                for user_id, entry in batch.items():
+                    self._dirty.setdefault(user_id, entry)
+                return
+            finally:
+                PERSISTENCE_FLUSH_LATENCY.observe(time.perf_counter() - start, bot=self.bot_name)
+
+            for user_id, entry in batch.items():
+                if entry is not None and user_id in self._touched:
+                    self._written[user_id] = entry[1]
+
+    def _load(self, user_id: int) -> Optional[dict]:
+        db = self.session_factory()
+        try:
+            return crud.get_conversation_state(
+                db, self.bot_name, user_id, datetime.utcnow() - timedelta(seconds=self.ttl)
+            )
+        finally:
+            db.close()
+
+    def _write(self, batch: Dict[int, Optional[Tuple[Dict, str]]]):
+        upserts = {user_id: entry[0] for user_id, entry in batch.items() if entry is not None and entry[0]}
+        # دیکشنری خالی یعنی فرایندی در جریان نیست؛ ردیف حذف می‌شود تا جدول کوچک بماند
+        deletes = [user_id for user_id, entry in batch.items() if entry is None or not entry[0]]
+        db = self.session_factory()
+        try:
+            crud.upsert_conversation_states(db, self.bot_name, upserts)
+            crud.delete_conversation_states(db, self.bot_name, deletes)
+        finally:
+            db.close()
+        PERSISTENCE_WRITES.inc(len(upserts), bot=self.bot_name, operation="upsert")
+        PERSISTENCE_WRITES.inc(len(deletes), bot=self.bot_name, operation="delete")
+
+    async def run(self):
+        """حذف دوره‌ای ردیف‌های منقضی تا زمان لغو"""
+        while True:
+            await asyncio.sleep(PERSISTENCE_PURGE_INTERVAL)
+            try:
+                purged = await run_blocking(DB_POOL, self.purge)
+                if purged:
+                    logger.info(f"Purged {purged} expired conversation state rows")
+            except Exception as e:
+                logger.error(f"Error purging conversation state: {e}")
+
+    def purge(self) -> int:
+        """حذف ردیف‌هایی که در TTL به‌روز نشده‌اند"""
+        db = self.session_factory()
+        try:
+            return crud.purge_conversation_states(db, datetime.utcnow() - timedelta(seconds=self.ttl))
+        finally:
+            db.close()
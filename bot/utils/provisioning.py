@@ -0,0 +1,278 @@
+import asyncio
+import logging
+import random
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+import requests
+from sqlalchemy.orm import Session
+from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup
+
+from config import (
+    PROVISIONING_POLL_INTERVAL,
+    PROVISIONING_BATCH_SIZE,
+    PROVISIONING_PANEL_CONCURRENCY,
+    PROVISIONING_MAX_BACKOFF,
+    PROVISIONING_LOCK_TIMEOUT
+)
+from db import models, crud
+from bot.utils.hiddify import HiddifyAPI
+from bot.utils.ratelimit import BACKGROUND, run_panel
+from bot.utils.callbacks import callback_data
+from bot.utils.executor import DB_POOL, run_blocking
+
+logger = logging.getLogger(__name__)
+
+# ورکر فعال در همین پروسه (برای بیدار کردن فوری پس از افزودن کار جدید)
+_active_worker: Optional["ProvisioningWorker"] = None
+
+# پیام موفقیت و شکست برای کارهایی که به کاربر اطلاع داده می‌شوند؛ بقیه انواع کار پیامی ندارند
+NOTIFICATIONS = {
+    models.PanelJobType.CREATE: (
+        "✅ <b>اشتراک شما آماده است</b>\n\n"
+        "حساب شما روی سرور ایجاد شد. برای دریافت کانفیگ از دکمه زیر استفاده کنید.",
+        "❌ آماده‌سازی اشتراک شما روی سرور با خطا مواجه شد.\n"
+        "لطفاً با پشتیبانی تماس بگیرید."
+    ),
+    models.PanelJobType.EXTEND: (
+        "✅ <b>اشتراک شما تمدید شد</b>\n\n"
+        "تمدید روی سرور اعمال شد. برای دریافت کانفیگ از دکمه زیر استفاده کنید.",
+        "❌ اعمال تمدید اشتراک شما روی سرور با خطا مواجه شد.\n"
+        "لطفاً با پشتیبانی تماس بگیرید."
+    ),
+}
+
+
+def build_user_payload(subscription: models.Subscription, plan: models.Plan, telegram_user) -> Dict:
+    """ساخت اطلاعات کاربر هیدیفای برای یک اشتراک"""
+    return {
+        "name": f"t{telegram_user.id}",
+        "usage_limit_GB": plan.traffic_gb,
+        "package_days": plan.duration_days,
+        "start_date": subscription.start_date.strftime("%Y-%m-%d"),
+        "comment": f"Telegram User: {telegram_user.first_name} {telegram_user.last_name}",
+        "enable": True
+    }
+
+
+def enqueue_panel_job(
+    db: Session,
+    job_type: models.PanelJobType,
+    panel_id: int,
+    uuid: str,
+    payload: Optional[Dict] = None,
+    subscription_id: Optional[int] = None,
+    notify_chat_id: Optional[int] = None
+) -> models.PanelJob:
+    """ثبت عملیات پنل در صف و بیدار کردن ورکر بدون انتظار برای پنل"""
+    job = crud.enqueue_panel_job(
+        db,
+        job_type=job_type,
+        panel_id=panel_id,
+        uuid=uuid,
+        payload=payload,
+        subscription_id=subscription_id,
+        notify_chat_id=notify_chat_id
+    )
+    wake_worker()
+    return job
+
+
+def wake_worker():
+    """بیدار کردن ورکر صف در همین پروسه (در صورت وجود) پس از ثبت کار جدید"""
+    if _active_worker is not None:
+        _active_worker.wake()
+
+
+def _is_not_found(error: Exception) -> bool:
+    response = getattr(error, "response", None)
+    return response is not None and response.status_code == 404
+
+
+def execute_panel_job(hiddify: HiddifyAPI, job_type: models.PanelJobType, uuid: str, payload: Dict) -> Dict:
+    """اجرای یک عملیات پنل؛ همه عملیات‌ها idempotent هستند تا تکرار آن‌ها بی‌خطر باشد"""
+    if job_type == models.PanelJobType.CREATE:
+        try:
+            hiddify.get_user(uuid)
+        except requests.HTTPError as e:
+            if not _is_not_found(e):
+                raise
+            return hiddify.create_user(dict(payload, uuid=uuid))
+        # کاربر در تلاش قبلی ساخته شده ولی پاسخ به ما نرسیده است
+        return hiddify.update_user(uuid, payload)
+
+    if job_type == models.PanelJobType.EXTEND:
+        return hiddify.update_user(uuid, payload)
+
+    if job_type == models.PanelJobType.DISABLE:
+        return hiddify.update_user(uuid, dict(payload, enable=False))
+
+    if job_type == models.PanelJobType.DELETE:
+        try:
+            return hiddify.delete_user(uuid)
+        except requests.HTTPError as e:
+            if _is_not_found(e):
+                return {}
+            raise
+
+    raise ValueError(f"Unknown panel job type: {job_type}")
+
+
+def retry_delay(attempts: int) -> float:
+    """تأخیر نمایی با کمی نویز برای جلوگیری از هجوم همزمان تلاش‌ها"""
+    delay = min(PROVISIONING_MAX_BACKOFF, 5 * 2 ** max(attempts - 1, 0))
+    return delay * random.uniform(0.8, 1.2)
+
+
+class ProvisioningWorker:
+    """ورکر پس‌زمینه برای اجرای صف عملیات پنل با تلاش مجدد و محدودیت همزمانی هر پنل"""
+
+    def __init__(self, session_factory: Callable[[], Session], bot: Bot):
+        """مقداردهی اولیه"""
+        self.session_factory = session_factory
+        self.bot = bot
+        self._panel_limits: Dict[int, asyncio.Semaphore] = {}
+        self._tasks = set()
+        self._wakeup = asyncio.Event()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def wake(self):
+        """بیدار کردن ورکر برای بررسی فوری صف (از هر نخی قابل فراخوانی است)"""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def run(self):
+        """حلقه اصلی ورکر تا زمان لغو"""
+        global _active_worker
+        self._loop = asyncio.get_running_loop()
+        _active_worker = self
+        logger.info("Provisioning worker started")
+        try:
+            while True:
+                try:
+                    await self.dispatch_due_jobs()
+                except Exception as e:
+                    logger.error(f"Error dispatching panel jobs: {e}")
+
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=PROVISIONING_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+        finally:
+            _active_worker = None
+            for task in self._tasks:
+                task.cancel()
+            logger.info("Provisioning worker stopped")
+
+    async def dispatch_due_jobs(self) -> int:
+        """دریافت کارهای سررسید شده به اندازه ظرفیت آزاد و اجرای آن‌ها"""
+        capacity = PROVISIONING_BATCH_SIZE - len(self._tasks)
+        if capacity <= 0:
+            return 0
+
+        jobs = await run_blocking(DB_POOL, self._claim_jobs, capacity)
+        for job in jobs:
+            task = asyncio.create_task(self._run_job(job))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return len(jobs)
+
+    def _claim_jobs(self, limit: int) -> List[Dict]:
+        db = self.session_factory()
+        try:
+            jobs = crud.claim_panel_jobs(db, limit, PROVISIONING_LOCK_TIMEOUT)
+            # اشیاء پس از بستن نشست قابل استفاده نیستند، پس یک کپی ساده برمی‌گردانیم
+            return [
+                {
+                    "id": job.id,
+                    "job_type": job.job_type,
+                    "uuid": job.uuid,
+                    "payload": dict(job.payload or {}),
+                    "attempts": job.attempts,
+                    "max_attempts": job.max_attempts,
+                    "notify_chat_id": job.notify_chat_id,
+                    "subscription_id": job.subscription_id,
+                    "panel_id": job.panel_id,
+                    "panel_domain": job.panel.domain,
+                    "panel_proxy_path": job.panel.proxy_path,
+                    "panel_api_key": job.panel.api_key,
+                    "panel_rate_limit": job.panel.rate_limit,
+                    "panel_max_concurrency": job.panel.max_concurrency
+                }
+                for job in jobs
+            ]
+        finally:
+            db.close()
+
+    def _finish_job(self, job_id: int, error: Optional[str], retry_at: Optional[datetime]):
+        db = self.session_factory()
+        try:
+            if error is None:
+                crud.complete_panel_job(db, job_id)
+            else:
+                crud.fail_panel_job(db, job_id, error, retry_at)
+        finally:
+            db.close()
+
+    def _panel_limit(self, panel_id: int) -> asyncio.Semaphore:
+        if panel_id not in self._panel_limits:
+            self._panel_limits[panel_id] = asyncio.Semaphore(PROVISIONING_PANEL_CONCURRENCY)
+        return self._panel_limits[panel_id]
+
+    async def _run_job(self, job: Dict):
+        hiddify = HiddifyAPI(
+            job["panel_domain"],
+            job["panel_proxy_path"],
+            job["panel_api_key"],
+            lane=BACKGROUND,
+            rate_limit=job["panel_rate_limit"],
+            max_concurrency=job["panel_max_concurrency"]
+        )
+
+        async with self._panel_limit(job["panel_id"]):
+            try:
+                await run_panel(
+                    hiddify, execute_panel_job, hiddify, job["job_type"], job["uuid"], job["payload"]
+                )
+            except Exception as e:
+                gave_up = job["attempts"] >= job["max_attempts"]
+                retry_at = None if gave_up else datetime.utcnow() + timedelta(seconds=retry_delay(job["attempts"]))
+                logger.warning(
+                    f"Panel job {job['id']} ({job['job_type'].value}) failed "
+                    f"on attempt {job['attempts']}/{job['max_attempts']}: {e}"
+                )
+                await run_blocking(DB_POOL, self._finish_job, job["id"], str(e), retry_at)
+                if gave_up:
+                    await self._notify(job, succeeded=False)
+                return
+
+        await run_blocking(DB_POOL, self._finish_job, job["id"], None, None)
+        logger.info(f"Panel job {job['id']} ({job['job_type'].value}) completed")
+        await self._notify(job, succeeded=True)
+
+    async def _notify(self, job: Dict, succeeded: bool):
+        """اطلاع‌رسانی نتیجه کار به کاربر (فقط برای انواع کار موجود در NOTIFICATIONS)"""
+        messages = NOTIFICATIONS.get(job["job_type"])
+        if not job["notify_chat_id"] or messages is None:
+            return
+
+        success_text, failure_text = messages
+        try:
+            if succeeded:
+                keyboard = [
+                    [InlineKeyboardButton("📥 دریافت کانفیگ", callback_data=callback_data("get_config", job['subscription_id']))]
+                ]
+                await self.bot.send_message(
+                    chat_id=job["notify_chat_id"],
+                    text=success_text,
+                    reply_markup=InlineKeyboardMarkup(keyboard),
+                    parse_mode='HTML'
+                )
+            else:
+                await self.bot.send_message(
+                    chat_id=job["notify_chat_id"],
+                    text=failure_text
+                )
+        except Exception as e:
+            logger.error(f"Error notifying user about panel job {job['id']}: {e}")
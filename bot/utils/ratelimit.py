@@ -0,0 +1,256 @@
+import asyncio
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from config import (
+    PANEL_RATE_LIMIT,
+    PANEL_RATE_BURST,
+    PANEL_MAX_CONCURRENCY,
+    PANEL_BACKGROUND_SHARE,
+    PANEL_QUEUE_TIMEOUT
+)
+from bot.utils.executor import PANEL_POOL, PANEL_BACKGROUND_POOL, run_blocking
+from bot.utils.metrics import Counter, Gauge, Histogram
+
+# مسیرهای ترافیک پنل: درخواست‌های کاربران و ادمین در برابر کارهای دسته‌ای
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+
+LIMITER_WAIT = Histogram(
+    "foxybot_panel_limiter_wait_seconds",
+    "Time a panel request waited for a concurrency slot or rate token",
+    ("panel", "lane", "kind")
+)
+LIMITER_REJECTED = Counter(
+    "foxybot_panel_limiter_rejected_total",
+    "Panel requests rejected because the panel's lane stayed saturated",
+    ("panel", "lane", "kind")
+)
+LIMITER_IN_FLIGHT = Gauge(
+    "foxybot_panel_limiter_in_flight",
+    "Panel requests currently holding a concurrency slot",
+    ("panel", "lane")
+)
+
+
+class PanelBusyError(Exception):
+    """ظرفیت مسیر پنل در زمان مجاز آزاد نشد"""
+
+
+class TokenBucket:
+    """محدودکننده نرخ با سطل توکن (امن برای چند نخ)"""
+
+    def __init__(self, rate: float, burst: float):
+        """rate توکن در ثانیه و حداکثر burst توکن ذخیره"""
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, timeout: float) -> Optional[float]:
+        """رزرو یک توکن؛ زمان انتظار لازم یا None اگر بیشتر از timeout باشد"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            wait = 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+            if wait > timeout:
+                return None
+            # توکن از همین حالا کم می‌شود تا منتظرهای بعدی پشت این درخواست صف بکشند
+            self._tokens -= 1
+            return wait
+
+
+class _Lane:
+    def __init__(self, rate: float, concurrency: int):
+        self.rate = rate
+        self.concurrency = concurrency
+        self.slots = threading.BoundedSemaphore(concurrency) if concurrency > 0 else None
+        self.bucket = TokenBucket(rate, PANEL_RATE_BURST * rate) if rate > 0 else None
+        self.in_flight = 0
+        self.lock = threading.Lock()
+        self._async_slots: Optional[Tuple[asyncio.AbstractEventLoop, asyncio.Semaphore]] = None
+
+    def add_in_flight(self, delta: int) -> int:
+        with self.lock:
+            self.in_flight += delta
+            return self.in_flight
+
+    def async_slots(self) -> Optional[asyncio.Semaphore]:
+        """سمافور همین حلقه رویداد (ابزارهای تست هر بار حلقه جدید می‌سازند)"""
+        if self.concurrency <= 0:
+            return None
+        loop = asyncio.get_running_loop()
+        if self._async_slots is None or self._async_slots[0] is not loop:
+            self._async_slots = (loop, asyncio.Semaphore(self.concurrency))
+        return self._async_slots[1]
+
+
+class _Permit:
+    """ظرفیتی که فراخوانی جاری در حلقه رویداد گرفته است (با contextvar به نخ استخر می‌رسد)"""
+
+    def __init__(self, limiter: "PanelLimiter", lane: str):
+        self.limiter = limiter
+        self.lane = lane
+        # اولین درخواست از توکنی استفاده می‌کند که permit پیشاپیش گرفته است
+        self.prepaid = True
+
+
+_permit: ContextVar[Optional[_Permit]] = ContextVar("foxybot_panel_permit", default=None)
+
+
+class PanelLimiter:
+    """محدودیت همزمانی (bulkhead) و نرخ درخواست یک پنل با سهم جدا برای هر مسیر
+
+    ظرفیت پنل بین مسیرها تقسیم می‌شود (سهم کارهای پس‌زمینه PANEL_BACKGROUND_SHARE)
+    تا کارهای دسته‌ای نتوانند ظرفیت درخواست‌های کاربران را بگیرند. ربات‌ها ظرفیت را با
+    permit (از طریق run_panel) در حلقه رویداد و پیش از رفتن به استخر نخ‌ها می‌گیرند تا
+    انتظار برای یک پنل کند هیچ نخ مشترکی را اشغال نکند؛ slot نسخه همگام برای
+    اسکریپت‌های خط فرمان است و داخل فراخوانی‌ای که permit دارد فقط توکن درخواست‌های
+    بعدی را می‌گیرد. انتظار برای هر مسیر به PANEL_QUEUE_TIMEOUT محدود است.
+    """
+
+    def __init__(self, panel: str, rate: float, concurrency: int, timeout: float = PANEL_QUEUE_TIMEOUT):
+        """مقداردهی اولیه"""
+        self.panel = panel
+        self.rate = rate
+        self.concurrency = concurrency
+        self.timeout = timeout
+        background_concurrency = max(1, round(concurrency * PANEL_BACKGROUND_SHARE)) if concurrency > 0 else 0
+        self._lanes = {
+            INTERACTIVE: _Lane(
+                rate * (1 - PANEL_BACKGROUND_SHARE),
+                max(1, concurrency - background_concurrency) if concurrency > 0 else 0
+            ),
+            BACKGROUND: _Lane(rate * PANEL_BACKGROUND_SHARE, background_concurrency)
+        }
+
+    def _take_token(self, state: _Lane, lane: str, timeout: float, sleep: Optional[Callable[[float], None]] = None) -> float:
+        """رزرو یک توکن؛ مدت انتظار را برمی‌گرداند (یا اگر sleep داده شود همان‌جا صبر می‌کند)"""
+        if state.bucket is None:
+            return 0.0
+        wait = state.bucket.reserve(timeout)
+        if wait is None:
+            LIMITER_REJECTED.inc(panel=self.panel, lane=lane, kind="rate")
+            raise PanelBusyError(f"Request rate for {lane} traffic to panel {self.panel} exceeded")
+        LIMITER_WAIT.observe(wait, panel=self.panel, lane=lane, kind="rate")
+        if wait and sleep is not None:
+            sleep(wait)
+            return 0.0
+        return wait
+
+    @asynccontextmanager
+    async def permit(self, lane: str = INTERACTIVE):
+        """گرفتن یک جای خالی و یک توکن در حلقه رویداد برای یک فراخوانی بلاک‌کننده پنل"""
+        state = self._lanes[lane]
+        slots = state.async_slots()
+        start = time.monotonic()
+        if slots is not None:
+            try:
+                await asyncio.wait_for(slots.acquire(), self.timeout)
+            except asyncio.TimeoutError:
+                LIMITER_REJECTED.inc(panel=self.panel, lane=lane, kind="concurrency")
+                raise PanelBusyError(f"No free {lane} slot for panel {self.panel}") from None
+            LIMITER_WAIT.observe(time.monotonic() - start, panel=self.panel, lane=lane, kind="concurrency")
+        try:
+            wait = self._take_token(state, lane, max(self.timeout - (time.monotonic() - start), 0.0))
+            if wait:
+                await asyncio.sleep(wait)
+            LIMITER_IN_FLIGHT.set(state.add_in_flight(1), panel=self.panel, lane=lane)
+            token = _permit.set(_Permit(self, lane))
+            try:
+                yield
+            finally:
+                _permit.reset(token)
+                LIMITER_IN_FLIGHT.set(state.add_in_flight(-1), panel=self.panel, lane=lane)
+        finally:
+            if slots is not None:
+                slots.release()
+
+    @contextmanager
+    def slot(self, lane: str = INTERACTIVE):
+        """گرفتن یک جای خالی و یک توکن پیش از ارسال درخواست به پنل (برای کدی که permit ندارد)"""
+        held = _permit.get()
+        if held is not None and held.limiter is self and held.lane == lane:
+            # جای خالی را permit نگه داشته؛ درخواست‌های بعدی همان فراخوانی فقط توکن می‌گیرند
+            if held.prepaid:
+                held.prepaid = False
+            else:
+                self._take_token(self._lanes[lane], lane, self.timeout, time.sleep)
+            yield
+            return
+        state = self._lanes[lane]
+        start = time.monotonic()
+        if state.slots is not None:
+            if not state.slots.acquire(timeout=self.timeout):
+                LIMITER_REJECTED.inc(panel=self.panel, lane=lane, kind="concurrency")
+                raise PanelBusyError(f"No free {lane} slot for panel {self.panel}")
+            LIMITER_WAIT.observe(time.monotonic() - start, panel=self.panel, lane=lane, kind="concurrency")
+        try:
+            self._take_token(state, lane, max(self.timeout - (time.monotonic() - start), 0.0), time.sleep)
+            LIMITER_IN_FLIGHT.set(state.add_in_flight(1), panel=self.panel, lane=lane)
+            try:
+                yield
+            finally:
+                LIMITER_IN_FLIGHT.set(state.add_in_flight(-1), panel=self.panel, lane=lane)
+        finally:
+            if state.slots is not None:
+                state.slots.release()
+
+
+_limiters: Dict[str, PanelLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_panel_limiter(panel: str, rate: Optional[float] = None, concurrency: Optional[int] = None) -> PanelLimiter:
+    """محدودکننده مشترک یک پنل؛ با تغییر تنظیمات پنل در دیتابیس دوباره ساخته می‌شود"""
+    settings: Tuple[float, int] = (
+        PANEL_RATE_LIMIT if rate is None else rate,
+        PANEL_MAX_CONCURRENCY if concurrency is None else concurrency
+    )
+    limiter = _limiters.get(panel)
+    if limiter is not None and (limiter.rate, limiter.concurrency) == settings:
+        return limiter
+    with _limiters_lock:
+        limiter = _limiters.get(panel)
+        if limiter is None or (limiter.rate, limiter.concurrency) != settings:
+            # درخواست‌های در حال اجرا جای خود را در محدودکننده قبلی آزاد می‌کنند
+            limiter = _limiters[panel] = PanelLimiter(panel, *settings)
+        return limiter
+
+
+async def run_panel(api: Any, func: Callable, *args, **kwargs):
+    """اجرای func (که با api به پنل درخواست می‌دهد) در استخر مسیر api پس از گرفتن permit
+
+    همه درخواست‌های func یک جای خالی از سهم مسیر api می‌گیرند و هر کدام یک توکن.
+    """
+    pool = PANEL_BACKGROUND_POOL if api.lane == BACKGROUND else PANEL_POOL
+    async with api.limiter.permit(api.lane):
+        return await run_blocking(pool, func, *args, **kwargs)
+
+
+class _PanelNamespace:
+    """نسخه awaitable متدهای HiddifyAPI که هر کدام با run_panel اجرا می‌شوند"""
+
+    def __init__(self, api: Any):
+        self._api = api
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._api, name)
+        if not callable(attr):
+            return attr
+
+        async def call(*args, **kwargs):
+            return await run_panel(self._api, attr, *args, **kwargs)
+        call.__name__ = name
+        self.__dict__[name] = call
+        return call
+
+
+def offload_panel(api: Any) -> _PanelNamespace:
+    """مثل offload_module برای کلاینت پنل، با گرفتن ظرفیت پنل در حلقه رویداد"""
+    return _PanelNamespace(api)
@@ -0,0 +1,430 @@
+import asyncio
+import heapq
+import json
+import logging
+import os
+import re
+import tempfile
+import time
+from collections import Counter as CountMap
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy.orm import Session
+from telegram import Bot
+
+from config import (
+    ADMIN_TELEGRAM_ID,
+    RECONCILE_INTERVAL,
+    RECONCILE_APPLY,
+    RECONCILE_PANEL_CONCURRENCY,
+    RECONCILE_SORT_BUFFER,
+    RECONCILE_REPORT_DIR
+)
+from db import models, crud
+from bot.utils.hiddify import HiddifyAPI
+from bot.utils.ratelimit import BACKGROUND, run_panel
+from bot.utils.provisioning import execute_panel_job
+from bot.utils.executor import DB_POOL, run_blocking
+from bot.utils.metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+RECONCILE_DISCREPANCIES = Counter(
+    "foxybot_reconcile_discrepancies_total",
+    "Differences found between panels and the subscriptions table",
+    ("panel", "kind")
+)
+RECONCILE_FIXES = Counter(
+    "foxybot_reconcile_fixes_total",
+    "Reconciliation repairs by outcome",
+    ("panel", "action", "result")
+)
+
+# انواع اختلاف
+MISSING = "missing"        # اشتراک فعال در دیتابیس که کاربری در پنل ندارد
+ORPHANED = "orphaned"      # کاربر فعال پنل بدون اشتراک در دیتابیس
+MISMATCH = "mismatch"      # حجم، تاریخ انقضا یا وضعیت فعال بودن متفاوت است
+RELINK = "relink"          # کاربر t{telegram_id} پنل که uuid آن در اشتراک ذخیره نشده است
+UNMANAGED = "unmanaged"    # کاربر فعال پنل بدون اشتراک که ربات آن را نساخته؛ فقط گزارش می‌شود
+
+# نام کاربرانی که ربات در پنل می‌سازد (provisioning)
+BOT_USER_NAME = re.compile(r"t\d+")
+
+
+class PanelUser(NamedTuple):
+    uuid: str
+    name: str
+    usage_limit_GB: Optional[float]
+    package_days: Optional[int]
+    start_date: Optional[str]
+    enable: bool
+
+
+@dataclass
+class Fix:
+    action: str
+    uuid: str
+    payload: Dict = field(default_factory=dict)
+    subscription_id: Optional[int] = None
+
+
+@dataclass
+class ReconcileResult:
+    panel_id: int
+    domain: str
+    subscriptions: int = 0
+    panel_users: int = 0
+    counts: Dict[str, int] = field(default_factory=dict)
+    fixed: int = 0
+    failed: int = 0
+    report_path: Optional[str] = None
+    duration: float = 0.0
+
+
+def _panel_user(user: Dict) -> PanelUser:
+    return PanelUser(
+        uuid=str(user.get("uuid", "")).lower(),
+        name=user.get("name") or "",
+        usage_limit_GB=user.get("usage_limit_GB"),
+        package_days=user.get("package_days"),
+        start_date=user.get("start_date"),
+        enable=bool(user.get("enable", True))
+    )
+
+
+def _uuid(user: PanelUser) -> str:
+    return user.uuid
+
+
+def _read_run(path: str) -> Iterator[PanelUser]:
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            yield PanelUser(*json.loads(line))
+
+
+def sorted_panel_users(users: Iterable[Dict], buffer_size: int = RECONCILE_SORT_BUFFER) -> Iterator[PanelUser]:
+    """مرتب‌سازی جریانی کاربران پنل بر اساس uuid با حافظه محدود
+
+    پنل لیست را مرتب برنمی‌گرداند؛ هر buffer_size کاربر مرتب شده و در یک فایل موقت
+    نوشته می‌شوند و در پایان فایل‌ها با heapq.merge ادغام می‌شوند. اگر همه کاربران
+    در یک بافر جا شوند چیزی روی دیسک نوشته نمی‌شود.
+    """
+    runs: List[str] = []
+    buffer: List[PanelUser] = []
+    try:
+        for user in users:
+            buffer.append(_panel_user(user))
+            if len(buffer) >= buffer_size:
+                buffer.sort(key=_uuid)
+                descriptor, path = tempfile.mkstemp(prefix="foxybot-reconcile-", suffix=".jsonl")
+                runs.append(path)
+                with os.fdopen(descriptor, "w", encoding="utf-8") as f:
+                    for entry in buffer:
+                        f.write(json.dumps(entry) + "\n")
+                buffer = []
+        buffer.sort(key=_uuid)
+        if not runs:
+            yield from buffer
+            return
+        yield from heapq.merge(buffer, *(_read_run(path) for path in runs), key=_uuid)
+    finally:
+        for path in runs:
+            os.remove(path)
+
+
+def merge_sorted(db_rows: Iterable, panel_users: Iterable[PanelUser]) -> Iterator[Tuple[Optional[object], Optional[PanelUser]]]:
+    """ادغام خطی دو جریان مرتب بر اساس uuid؛ جفت‌های (ردیف دیتابیس، کاربر پنل) با None برای سمت ناموجود"""
+    db_iter = iter(db_rows)
+    panel_iter = iter(panel_users)
+    row = next(db_iter, None)
+    user = next(panel_iter, None)
+    last_db = last_panel = ""
+    while row is not None or user is not None:
+        db_key = row.uuid.lower() if row is not None else None
+        panel_key = user.uuid if user is not None else None
+        if db_key is not None and db_key < last_db or panel_key is not None and panel_key < last_panel:
+            raise ValueError("Reconciliation input is not sorted by uuid")
+
+        if panel_key is None or (db_key is not None and db_key < panel_key):
+            yield row, None
+            last_db = db_key
+            row = next(db_iter, None)
+        elif db_key is None or panel_key < db_key:
+            yield None, user
+            last_panel = panel_key
+            user = next(panel_iter, None)
+        else:
+            yield row, user
+            last_db, last_panel = db_key, panel_key
+            row = next(db_iter, None)
+            user = next(panel_iter, None)
+
+
+def expected_panel_state(row, now: datetime) -> Dict:
+    """وضعیتی که کاربر پنل بر اساس اشتراک دیتابیس باید داشته باشد"""
+    state = {
+        "name": f"t{row.telegram_id}",
+        "package_days": max((row.end_date.date() - row.start_date.date()).days, 0),
+        "start_date": row.start_date.strftime("%Y-%m-%d"),
+        "enable": bool(row.is_active and row.end_date > now)
+    }
+    if row.traffic_gb is not None:
+        state["usage_limit_GB"] = row.traffic_gb
+    return state
+
+
+def compare(row, user: PanelUser, now: datetime) -> Dict[str, list]:
+    """فیلدهای متفاوت به شکل {field: [مقدار دیتابیس، مقدار پنل]}"""
+    differences = {}
+    if row.traffic_gb is not None and abs((user.usage_limit_GB or 0) - row.traffic_gb) > 0.001:
+        differences["usage_limit_GB"] = [row.traffic_gb, user.usage_limit_GB]
+    try:
+        panel_end = datetime.strptime(user.start_date, "%Y-%m-%d").date() + timedelta(days=user.package_days or 0)
+    except (TypeError, ValueError):
+        panel_end = None
+    # یک روز اختلاف به خاطر گرد شدن تاریخ شروع در پنل مجاز است
+    if panel_end is None or abs((panel_end - row.end_date.date()).days) > 1:
+        differences["expiry"] = [row.end_date.strftime("%Y-%m-%d"), panel_end and panel_end.isoformat()]
+    enable = bool(row.is_active and row.end_date > now)
+    if enable != user.enable:
+        differences["enable"] = [enable, user.enable]
+    return differences
+
+
+def _counted(rows: Iterable, result: ReconcileResult, attribute: str) -> Iterator:
+    for row in rows:
+        setattr(result, attribute, getattr(result, attribute) + 1)
+        yield row
+
+
+def diff_panel(
+    session_factory: Callable[[], Session],
+    panel_id: int,
+    api: HiddifyAPI,
+    report,
+    now: Optional[datetime] = None
+) -> Tuple[ReconcileResult, List[Fix]]:
+    """محاسبه اختلاف‌های یک پنل در یک گذر و نوشتن آن‌ها در گزارش (بلاک‌کننده)"""
+    now = now or datetime.utcnow()
+    result = ReconcileResult(panel_id=panel_id, domain=api.domain)
+    counts = CountMap()
+    fixes: List[Fix] = []
+    # اشتراک‌های بدون کاربر پنل و کاربران بدون اشتراک با نام t{telegram_id} برای اتصال دوباره
+    unmatched_rows: Dict[str, list] = {}
+    unmatched_users: Dict[str, list] = {}
+
+    def record(kind: str, entry: Dict):
+        counts[kind] += 1
+        report.write(json.dumps(dict(entry, panel_id=panel_id, kind=kind), ensure_ascii=False, default=str) + "\n")
+
+    def check_pair(row, user: PanelUser):
+        differences = compare(row, user, now)
+        if differences:
+            record(MISMATCH, {"uuid": user.uuid, "subscription_id": row.id, "fields": differences})
+            payload = expected_panel_state(row, now)
+            payload.pop("name")
+            fixes.append(Fix("update", user.uuid, payload, row.id))
+
+    db = session_factory()
+    panel_users = _counted(sorted_panel_users(api.iter_users()), result, "panel_users")
+    db_rows = _counted(crud.iter_panel_subscriptions(db, panel_id), result, "subscriptions")
+    try:
+        pending = crud.get_open_panel_job_subscription_ids(db, panel_id)
+        for row, user in merge_sorted(db_rows, panel_users):
+            if row is not None and user is not None:
+                check_pair(row, user)
+            elif row is not None:
+                # اشتراک‌هایی که ساخت آن‌ها هنوز در صف است یا غیرفعال شده‌اند اختلاف نیستند
+                if row.id in pending or not (row.is_active and row.end_date > now):
+                    continue
+                unmatched_rows.setdefault(f"t{row.telegram_id}", []).append(row)
+            else:
+                unmatched_users.setdefault(user.name, []).append(user)
+    finally:
+        # جریان‌ها پیش از بستن نشست بسته می‌شوند تا cursor و فایل‌های موقت در همین نخ آزاد شوند
+        panel_users.close()
+        db_rows.close()
+        db.close()
+
+    relinks: Dict[int, str] = {}
+    for name, rows in unmatched_rows.items():
+        users = unmatched_users.get(name, [])
+        if len(rows) == 1 and len(users) == 1:
+            row, user = rows[0], users.pop()
+            record(RELINK, {"uuid": user.uuid, "subscription_id": row.id, "previous_uuid": row.uuid})
+            relinks[row.id] = user.uuid
+            check_pair(row, user)
+            continue
+        for row in rows:
+            record(MISSING, {"uuid": row.uuid, "subscription_id": row.id, "telegram_id": row.telegram_id})
+            fixes.append(Fix("create", row.uuid, expected_panel_state(row, now), row.id))
+    for users in unmatched_users.values():
+        # کاربران غیرفعال بدون اشتراک مشکلی ایجاد نمی‌کنند
+        for user in filter(lambda user: user.enable, users):
+            # کاربرانی که ادمین مستقیم در پنل ساخته نباید خودکار غیرفعال شوند
+            if not BOT_USER_NAME.fullmatch(user.name or ""):
+                record(UNMANAGED, {"uuid": user.uuid, "name": user.name})
+                continue
+            record(ORPHANED, {"uuid": user.uuid, "name": user.name})
+            fixes.append(Fix("disable", user.uuid))
+    if relinks:
+        fixes.append(Fix("relink", "", {"uuids": relinks}))
+
+    result.counts = dict(counts)
+    for kind, count in counts.items():
+        RECONCILE_DISCREPANCIES.inc(count, panel=api.domain, kind=kind)
+    return result, fixes
+
+
+_FIX_JOBS = {
+    "create": models.PanelJobType.CREATE,
+    "update": models.PanelJobType.EXTEND,
+    "disable": models.PanelJobType.DISABLE
+}
+
+
+class Reconciler:
+    """مقایسه دوره‌ای جدول اشتراک‌ها با کاربران هر پنل و در صورت نیاز اصلاح اختلاف‌ها"""
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session],
+        bot: Optional[Bot] = None,
+        apply: bool = RECONCILE_APPLY,
+        report_dir: str = RECONCILE_REPORT_DIR
+    ):
+        """مقداردهی اولیه"""
+        self.session_factory = session_factory
+        self.bot = bot
+        self.apply = apply
+        self.report_dir = report_dir
+
+    async def run(self):
+        """اجرای دوره‌ای تا زمان لغو"""
+        if RECONCILE_INTERVAL <= 0:
+            return
+        logger.info("Reconciliation worker started")
+        while True:
+            await asyncio.sleep(RECONCILE_INTERVAL)
+            try:
+                results = await self.run_once()
+                await self._notify(results)
+            except Exception as e:
+                logger.error(f"Error reconciling panels: {e}")
+
+    def _load_panels(self, panel_id: Optional[int]) -> List[Tuple[int, HiddifyAPI]]:
+        db = self.session_factory()
+        try:
+            panels = [crud.get_panel(db, panel_id)] if panel_id else crud.get_active_panels(db)
+            return [
+                (panel.id, HiddifyAPI.for_panel(panel, BACKGROUND))
+                for panel in panels if panel is not None
+            ]
+        finally:
+            db.close()
+
+    async def run_once(self, panel_id: Optional[int] = None) -> List[ReconcileResult]:
+        """مقایسه همه پنل‌های فعال (یا فقط panel_id) به صورت همزمان"""
+        panels = await run_blocking(DB_POOL, self._load_panels, panel_id)
+        results = await asyncio.gather(
+            *[self.reconcile_panel(panel_id, api) for panel_id, api in panels],
+            return_exceptions=True
+        )
+        for (panel_id, api), result in zip(panels, results):
+            if isinstance(result, Exception):
+                logger.error(f"Reconciliation of panel {api.domain} failed: {result}")
+        return [result for result in results if isinstance(result, ReconcileResult)]
+
+    async def reconcile_panel(self, panel_id: int, api: HiddifyAPI) -> ReconcileResult:
+        """مقایسه یک پنل، نوشتن گزارش JSONL و اعمال اصلاحات با همزمانی محدود"""
+        start = time.perf_counter()
+        os.makedirs(self.report_dir, exist_ok=True)
+        path = os.path.join(self.report_dir, f"reconcile-panel-{panel_id}-{datetime.now():%Y%m%d-%H%M%S}.jsonl")
+        with open(path, "w", encoding="utf-8") as report:
+            # خواندن پنل و دیتابیس بلاک‌کننده است و در استخر نخ‌های پنل اجرا می‌شود
+            result, fixes = await run_panel(api, diff_panel, self.session_factory, panel_id, api, report)
+            if self.apply and fixes:
+                result.fixed, result.failed = await self._apply_fixes(api, fixes)
+            result.report_path = path
+            result.duration = time.perf_counter() - start
+            summary = {
+                "kind": "summary",
+                "panel_id": panel_id,
+                "domain": api.domain,
+                "subscriptions": result.subscriptions,
+                "panel_users": result.panel_users,
+                "counts": result.counts,
+                "applied": self.apply,
+                "fixed": result.fixed,
+                "failed": result.failed,
+                "duration": round(result.duration, 3)
+            }
+            report.write(json.dumps(summary) + "\n")
+        logger.info(
+            f"Reconciled panel {api.domain}: {result.counts or 'no drift'}"
+            + (f", fixed {result.fixed}, failed {result.failed}" if self.apply else "")
+        )
+        return result
+
+    def _relink(self, uuids: Dict[int, str]):
+        db = self.session_factory()
+        try:
+            crud.relink_subscription_uuids(db, uuids)
+        finally:
+            db.close()
+
+    async def _apply_fixes(self, api: HiddifyAPI, fixes: List[Fix]) -> Tuple[int, int]:
+        """اعمال اصلاحات؛ همه عملیات پنل idempotent هستند و حداکثر RECONCILE_PANEL_CONCURRENCY همزمان اجرا می‌شوند"""
+        limit = asyncio.Semaphore(RECONCILE_PANEL_CONCURRENCY)
+        outcome = CountMap()
+
+        async def apply(fix: Fix):
+            async with limit:
+                try:
+                    if fix.action == "relink":
+                        await run_blocking(DB_POOL, self._relink, fix.payload["uuids"])
+                        fixed = len(fix.payload["uuids"])
+                    else:
+                        await run_panel(api, execute_panel_job, api, _FIX_JOBS[fix.action], fix.uuid, fix.payload)
+                        fixed = 1
+                except Exception as e:
+                    logger.warning(f"Reconciliation {fix.action} of {fix.uuid or 'subscriptions'} on {api.domain} failed: {e}")
+                    RECONCILE_FIXES.inc(panel=api.domain, action=fix.action, result="error")
+                    outcome["failed"] += 1
+                    return
+            RECONCILE_FIXES.inc(fixed, panel=api.domain, action=fix.action, result="ok")
+            outcome["fixed"] += fixed
+
+        # اتصال دوباره uuidها قبل از به‌روزرسانی کاربران همان اشتراک‌ها انجام می‌شود
+        relinks = [fix for fix in fixes if fix.action == "relink"]
+        for fix in relinks:
+            await apply(fix)
+        await asyncio.gather(*[apply(fix) for fix in fixes if fix.action != "relink"])
+        return outcome["fixed"], outcome["failed"]
+
+    async def _notify(self, results: List[ReconcileResult]):
+        if not self.bot or not ADMIN_TELEGRAM_ID or not any(result.counts for result in results):
+            return
+        try:
+            await self.bot.send_message(chat_id=ADMIN_TELEGRAM_ID, text=format_summary(results, self.apply), parse_mode='HTML')
+        except Exception as e:
+            logger.error(f"Error sending reconciliation summary to admin: {e}")
+
+
+def format_summary(results: List[ReconcileResult], applied: bool) -> str:
+    """متن گزارش مغایرت‌گیری برای ادمین"""
+    labels = {MISSING: "بدون کاربر پنل", ORPHANED: "کاربر بدون اشتراک", MISMATCH: "مغایرت مشخصات", RELINK: "uuid ذخیره نشده", UNMANAGED: "کاربر خارج از ربات (بدون اصلاح)"}
+    message = "🔍 <b>مغایرت‌گیری پنل‌ها و دیتابیس</b>\n\n"
+    for result in results:
+        message += f"🔷 <b>{result.domain}</b> ({result.subscriptions:,} اشتراک، {result.panel_users:,} کاربر پنل)\n"
+        if not result.counts:
+            message += "✅ مغایرتی یافت نشد\n\n"
+            continue
+        for kind, count in result.counts.items():
+            message += f"- {labels.get(kind, kind)}: <code>{count:,}</code>\n"
+        if applied:
+            message += f"🛠 اصلاح‌شده: <code>{result.fixed:,}</code> | ناموفق: <code>{result.failed:,}</code>\n"
+        message += f"📄 <code>{result.report_path}</code>\n\n"
+    return message
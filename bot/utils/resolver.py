@@ -0,0 +1,173 @@
+import asyncio
+import ipaddress
+import logging
+import socket
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from config import DNS_CACHE_ENABLED, DNS_CACHE_TTL, DNS_CACHE_MAX_TTL, DNS_QUERY_TIMEOUT, WARMUP_TIMEOUT
+from bot.utils.hiddify import HiddifyAPI
+from bot.utils.executor import PANEL_POOL, run_blocking
+from bot.utils.ratelimit import run_panel
+from bot.utils.metrics import Counter, Histogram
+from bot.utils.singleflight import SingleFlight
+
+try:
+    import aiodns
+except ImportError:  # بدون aiodns همه رکوردها با DNS_CACHE_TTL کش می‌شوند
+    aiodns = None
+
+logger = logging.getLogger(__name__)
+
+TELEGRAM_API_HOST = "api.telegram.org"
+
+DNS_LOOKUPS = Counter(
+    "foxybot_dns_lookups_total",
+    "Hostname lookups by cache outcome (hit, miss or stale after a failed refresh)",
+    ("result",)
+)
+WARMUP_DURATION = Histogram(
+    "foxybot_connection_warmup_seconds",
+    "Time to resolve and open the first connection to a host at startup",
+    ("host",)
+)
+
+_Key = Tuple[str, object, int, int, int, int]
+
+
+def _is_literal(host: str) -> bool:
+    try:
+        ipaddress.ip_address(host.split("%", 1)[0])
+        return True
+    except ValueError:
+        return host == "localhost"
+
+
+class DNSCache:
+    """کش getaddrinfo برای همه کلاینت‌های HTTP (requests برای پنل‌ها و httpx برای تلگرام)
+
+    آدرس‌ها از getaddrinfo سیستم گرفته می‌شوند تا /etc/hosts و ترتیب IPv4/IPv6 مثل قبل
+    رعایت شود و در صورت نصب بودن aiodns، TTL رکورد از DNS خوانده می‌شود (حداکثر
+    DNS_CACHE_MAX_TTL). جستجوهای همزمان یک نام با هم یکی می‌شوند و اگر به‌روزرسانی
+    یک رکورد منقضی ناموفق باشد، آخرین آدرس شناخته‌شده استفاده می‌شود.
+    """
+
+    def __init__(
+        self,
+        getaddrinfo: Callable = socket.getaddrinfo,
+        default_ttl: float = DNS_CACHE_TTL,
+        max_ttl: float = DNS_CACHE_MAX_TTL
+    ):
+        """مقداردهی اولیه"""
+        self._getaddrinfo = getaddrinfo
+        self.default_ttl = default_ttl
+        self.max_ttl = max_ttl
+        self._entries: Dict[_Key, Tuple[float, List]] = {}
+        self._lock = threading.Lock()
+        self._flights = SingleFlight()
+
+    def getaddrinfo(self, host, port, family=0, type=0, proto=0, flags=0):
+        """جایگزین socket.getaddrinfo با همان امضا"""
+        if isinstance(host, bytes):
+            host = host.decode("idna")
+        if not isinstance(host, str) or _is_literal(host):
+            return self._getaddrinfo(host, port, family, type, proto, flags)
+
+        key = (host.lower(), port, family, type, proto, flags)
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            DNS_LOOKUPS.inc(result="hit")
+            return list(entry[1])
+
+        try:
+            addresses, _ = self._flights.do(key, lambda: self._refresh(key))
+        except OSError as e:
+            if entry is None:
+                raise
+            DNS_LOOKUPS.inc(result="stale")
+            logger.warning(f"Could not resolve {host}, using the last known addresses: {e}")
+            return list(entry[1])
+        DNS_LOOKUPS.inc(result="miss")
+        return list(addresses)
+
+    def _refresh(self, key: _Key) -> List:
+        addresses = self._getaddrinfo(*key)
+        ttl = self._record_ttl(key[0], key[2])
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, addresses)
+        return addresses
+
+    def _record_ttl(self, host: str, family: int) -> float:
+        if aiodns is None:
+            return self.default_ttl
+        try:
+            asyncio.get_running_loop()
+            # getaddrinfo مستقیم از داخل حلقه رویداد صدا زده شده؛ نمی‌توان حلقه دیگری اجرا کرد
+            return self.default_ttl
+        except RuntimeError:
+            pass
+        try:
+            ttl = asyncio.run(_query_ttl(host, family))
+        except Exception as e:
+            # مثلاً نام فقط در /etc/hosts تعریف شده است
+            logger.debug(f"Could not read the DNS TTL of {host}: {e}")
+            return self.default_ttl
+        return min(max(ttl, 0), self.max_ttl)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+async def _query_ttl(host: str, family: int) -> float:
+    resolver = aiodns.DNSResolver(timeout=DNS_QUERY_TIMEOUT, tries=1)
+    records = await resolver.query(host, "AAAA" if family == socket.AF_INET6 else "A")
+    return min(record.ttl for record in records)
+
+
+_cache: Optional[DNSCache] = None
+
+
+def install() -> Optional[DNSCache]:
+    """فعال کردن کش DNS برای کل پروسه (یک بار)"""
+    global _cache
+    if not DNS_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        _cache = DNSCache(socket.getaddrinfo)
+        socket.getaddrinfo = _cache.getaddrinfo
+    return _cache
+
+
+def _warm_host(host: str, port: int):
+    start = time.perf_counter()
+    socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+    WARMUP_DURATION.observe(time.perf_counter() - start, host=host)
+
+
+def _warm_panel(api: HiddifyAPI):
+    start = time.perf_counter()
+    api.warm_up(WARMUP_TIMEOUT)
+    WARMUP_DURATION.observe(time.perf_counter() - start, host=api.domain)
+
+
+async def warm_up(panels: Iterable):
+    """آماده کردن DNS و اتصال‌های پنل‌های فعال پیش از اولین درخواست کاربران
+
+    برای هر پنل یک اتصال TLS در استخر اتصال مشترک آن باز می‌ماند. اتصال ربات‌ها به
+    api.telegram.org را application.initialize() (با getMe) باز می‌کند و اینجا فقط نام آن
+    از قبل resolve می‌شود.
+    """
+    start = time.perf_counter()
+    panels = [HiddifyAPI.for_panel(panel) for panel in panels]
+    results = await asyncio.gather(
+        run_blocking(PANEL_POOL, _warm_host, TELEGRAM_API_HOST, 443),
+        *[run_panel(api, _warm_panel, api) for api in panels],
+        return_exceptions=True
+    )
+    for target, result in zip([TELEGRAM_API_HOST] + [api.domain for api in panels], results):
+        if isinstance(result, Exception):
+            logger.warning(f"Could not warm up the connection to {target}: {result}")
+    warmed = sum(1 for result in results[1:] if not isinstance(result, Exception))
+    logger.info(f"Warmed up connections to {warmed}/{len(panels)} panels in {time.perf_counter() - start:.2f}s")
@@ -0,0 +1,331 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import Any, Awaitable, Callable, Collection, Dict, List, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from config import UPDATE_WORKERS, UPDATE_QUEUE_DEPTH, UPDATE_SHED_WAIT, UPDATE_USER_BACKLOG
+from bot.utils.instrumentation import callback_route
+from bot.utils.metrics import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+# کلاس‌های اولویت (عدد کمتر زودتر اجرا می‌شود)
+ADMIN = 0         # ربات ادمین؛ منتظر جای خالی نمی‌ماند
+PAYMENT = 1       # کالبک‌ها و رسیدهای پرداخت؛ هیچ‌وقت حذف نمی‌شوند
+INTERACTIVE = 2   # کلیک دکمه‌ها
+NORMAL = 3        # دستورها و پیام‌ها (مثل /start)
+BULK = 4          # بقیه آپدیت‌ها (تغییر عضویت و ...)
+
+PRIORITY_NAMES = {ADMIN: "admin", PAYMENT: "payment", INTERACTIVE: "interactive", NORMAL: "normal", BULK: "bulk"}
+
+BUSY_MESSAGE = "⏳ ربات در حال حاضر شلوغ است؛ لطفاً چند لحظه دیگر دوباره امتحان کنید."
+
+UPDATE_QUEUE_DEPTH_GAUGE = Gauge(
+    "foxybot_update_queue_depth",
+    "Updates waiting for a handler slot",
+    ("priority",)
+)
+UPDATE_QUEUE_WAIT = Histogram(
+    "foxybot_update_queue_wait_seconds",
+    "Time an update waited for a handler slot",
+    ("bot", "priority")
+)
+UPDATES_SHED = Counter(
+    "foxybot_updates_shed_total",
+    "Updates answered with a busy notice instead of being handled",
+    ("bot", "priority", "reason")
+)
+UPDATE_WORKERS_BUSY = Gauge(
+    "foxybot_update_workers_busy",
+    "Handler slots in use"
+)
+UPDATE_USER_WAITING = Gauge(
+    "foxybot_update_user_waiting",
+    "Updates waiting behind an earlier update of the same user"
+)
+
+
+class _Ticket:
+    __slots__ = ("priority", "future", "abandoned")
+
+    def __init__(self, priority: int, future: asyncio.Future):
+        self.priority = priority
+        self.future = future
+        self.abandoned = False
+
+
+class UpdateScheduler:
+    """صف اولویت‌دار مشترک هر دو ربات جلوی هندلرها
+
+    حداکثر workers آپدیت همزمان اجرا می‌شوند و بقیه به ترتیب اولویت و سپس زمان رسیدن
+    منتظر می‌مانند؛ آپدیت‌های ادمین که تعدادشان کم است بدون انتظار اجرا می‌شوند.
+    آپدیت‌های یک کاربر مثل قبل به ترتیب و پشت سر هم اجرا می‌شوند. آپدیت‌های غیر
+    پرداختی اگر بیش از shed_wait ثانیه منتظر بمانند (چه پشت آپدیت قبلی همان کاربر و
+    چه در صف)، یا صف پر باشد (و آپدیتی با اولویت پایین‌تر برای حذف نباشد)، یا کاربر
+    بیش از user_backlog آپدیت در جریان داشته باشد با پیام «شلوغ است» جواب داده می‌شوند.
+    """
+
+    def __init__(
+        self,
+        workers: int = UPDATE_WORKERS,
+        max_depth: int = UPDATE_QUEUE_DEPTH,
+        shed_wait: float = UPDATE_SHED_WAIT,
+        user_backlog: int = UPDATE_USER_BACKLOG
+    ):
+        """مقداردهی اولیه"""
+        self.workers = max(workers, 1)
+        self.max_depth = max_depth
+        self.shed_wait = shed_wait
+        self.user_backlog = max(user_backlog, 1)
+        self._busy = 0
+        self._heap: List[Tuple[int, int, _Ticket]] = []
+        self._depth: Dict[int, int] = {priority: 0 for priority in PRIORITY_NAMES}
+        self._seq = itertools.count()
+        self._abandoned = 0
+        # قفل هر کاربر و تعداد آپدیت‌هایی که از آن استفاده می‌کنند
+        self._user_locks: Dict[tuple, List] = {}
+
+    @property
+    def depth(self) -> int:
+        return sum(self._depth.values())
+
+    def _set_depth(self, priority: int, delta: int):
+        self._depth[priority] += delta
+        UPDATE_QUEUE_DEPTH_GAUGE.set(self._depth[priority], priority=PRIORITY_NAMES[priority])
+
+    def _set_busy(self, delta: int):
+        self._busy += delta
+        UPDATE_WORKERS_BUSY.set(self._busy)
+
+    def _dispatch(self):
+        """دادن جای خالی به آپدیت‌های منتظر با بالاترین اولویت"""
+        while self._busy < self.workers and self._heap:
+            _, _, ticket = heapq.heappop(self._heap)
+            if ticket.abandoned:
+                self._abandoned -= 1
+                continue
+            self._set_depth(ticket.priority, -1)
+            self._set_busy(1)
+            ticket.future.set_result(True)
+
+    def _evict_for(self, priority: int) -> bool:
+        """حذف جدیدترین آپدیت منتظر با اولویت پایین‌تر از priority برای باز کردن جا در صف"""
+        victim = None
+        for entry in self._heap:
+            ticket = entry[2]
+            if ticket.abandoned or ticket.priority <= priority:
+                continue
+            if victim is None or entry[:2] > victim[:2]:
+                victim = entry
+        if victim is None:
+            return False
+        self._abandon(victim[2])
+        victim[2].future.set_result(False)
+        return True
+
+    def _abandon(self, ticket: _Ticket):
+        ticket.abandoned = True
+        self._abandoned += 1
+        self._set_depth(ticket.priority, -1)
+        # آپدیت‌های حذف‌شده تا رسیدن نوبتشان در heap می‌مانند؛ اگر زیاد شوند heap بازسازی می‌شود
+        if self._abandoned > len(self._heap) // 2:
+            self._heap = [entry for entry in self._heap if not entry[2].abandoned]
+            heapq.heapify(self._heap)
+            self._abandoned = 0
+
+    async def _acquire(self, priority: int, timeout: Optional[float]) -> Optional[str]:
+        """گرفتن جای اجرا؛ در صورت حذف شدن دلیل آن برمی‌گردد"""
+        if priority == ADMIN or (self._busy < self.workers and not self.depth):
+            self._set_busy(1)
+            return None
+
+        # پرداخت‌ها حتی با صف پر پذیرفته می‌شوند ولی اگر بتوانند جای آپدیت کم‌اهمیت‌تری را می‌گیرند
+        if self.depth >= self.max_depth and not self._evict_for(priority) and priority != PAYMENT:
+            return "queue_full"
+
+        ticket = _Ticket(priority, asyncio.get_running_loop().create_future())
+        heapq.heappush(self._heap, (priority, next(self._seq), ticket))
+        self._set_depth(priority, 1)
+        try:
+            await asyncio.wait({ticket.future}, timeout=timeout)
+        except asyncio.CancelledError:
+            if not ticket.future.done():
+                self._abandon(ticket)
+            elif ticket.future.result():
+                self._release()
+            raise
+        if not ticket.future.done():
+            self._abandon(ticket)
+            return "wait"
+        return None if ticket.future.result() else "queue_full"
+
+    def _release(self):
+        self._set_busy(-1)
+        self._dispatch()
+
+    def _user_lock(self, key: tuple) -> asyncio.Lock:
+        entry = self._user_locks.get(key)
+        if entry is None:
+            entry = self._user_locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        return entry[0]
+
+    def _unref_user_lock(self, key: tuple):
+        entry = self._user_locks[key]
+        entry[1] -= 1
+        if not entry[1]:
+            del self._user_locks[key]
+
+    def _user_backlog(self, key: tuple) -> int:
+        entry = self._user_locks.get(key)
+        return entry[1] if entry else 0
+
+    async def _lock_user(self, lock: asyncio.Lock, timeout: Optional[float]) -> bool:
+        """انتظار برای پایان آپدیت‌های قبلی کاربر تا timeout؛ False یعنی نوبت نرسید"""
+        if not lock.locked() or timeout is None:
+            await lock.acquire()
+            return True
+        # wait_for در پایتون ۳.۱۱ ممکن است قفلِ گرفته‌شده همزمان با timeout را گم کند
+        task = asyncio.ensure_future(lock.acquire())
+        UPDATE_USER_WAITING.inc()
+        try:
+            await asyncio.wait({task}, timeout=timeout)
+        except asyncio.CancelledError:
+            if not task.cancel() and not task.cancelled() and task.exception() is None:
+                lock.release()
+            raise
+        finally:
+            UPDATE_USER_WAITING.dec()
+        if task.done():
+            return True
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            return False
+        # قفل درست قبل از لغو گرفته شد
+        lock.release()
+        return False
+
+    async def _shed(
+        self,
+        bot_name: str,
+        update: object,
+        priority: int,
+        coroutine: Awaitable[Any],
+        on_shed: Callable[[object], Awaitable[None]],
+        reason: str
+    ):
+        """جواب «شلوغ است» به جای اجرای آپدیت"""
+        UPDATES_SHED.inc(bot=bot_name, priority=PRIORITY_NAMES[priority], reason=reason)
+        coroutine.close()
+        await on_shed(update)
+
+    async def run(
+        self,
+        bot_name: str,
+        update: object,
+        priority: int,
+        coroutine: Awaitable[Any],
+        on_shed: Callable[[object], Awaitable[None]]
+    ) -> bool:
+        """اجرای coroutine آپدیت در نوبت خود؛ اگر آپدیت حذف شود on_shed صدا زده شده و False برمی‌گردد"""
+        user = update.effective_user if isinstance(update, Update) else None
+        key = (bot_name, user.id) if user else None
+        sheddable = priority not in (ADMIN, PAYMENT)
+        # آپدیت‌هایی که پشت قفل کاربر منتظرند در صف شمرده نمی‌شوند؛ سیل آپدیت یک کاربر اینجا محدود می‌شود
+        if key and sheddable and self._user_backlog(key) >= self.user_backlog:
+            await self._shed(bot_name, update, priority, coroutine, on_shed, "user_backlog")
+            return False
+        lock = self._user_lock(key) if key else None
+        try:
+            start = time.perf_counter()
+            if lock and not await self._lock_user(lock, self.shed_wait if sheddable else None):
+                await self._shed(bot_name, update, priority, coroutine, on_shed, "wait")
+                return False
+            try:
+                # زمان انتظار پشت آپدیت‌های قبلی کاربر هم از shed_wait کم می‌شود
+                timeout = max(self.shed_wait - (time.perf_counter() - start), 0) if priority != PAYMENT else None
+                reason = await self._acquire(priority, timeout)
+                UPDATE_QUEUE_WAIT.observe(time.perf_counter() - start, bot=bot_name, priority=PRIORITY_NAMES[priority])
+                if reason:
+                    await self._shed(bot_name, update, priority, coroutine, on_shed, reason)
+                    return False
+                try:
+                    await coroutine
+                finally:
+                    self._release()
+                return True
+            finally:
+                if lock:
+                    lock.release()
+        finally:
+            if key:
+                self._unref_user_lock(key)
+
+
+# مشترک بین هر دو ربات تا آپدیت‌های ادمین پشت آپدیت‌های کاربران نمانند
+UPDATE_SCHEDULER = UpdateScheduler()
+
+
+def classify_update(update: object, payment_routes: Collection[str] = ()) -> int:
+    """کلاس اولویت آپدیت‌های ربات کاربر؛ payment_routes پیشوند کالبک‌های پرداخت است"""
+    if not isinstance(update, Update):
+        return BULK
+    if update.callback_query:
+        route = callback_route(update.callback_query.data or "")
+        return PAYMENT if route in payment_routes else INTERACTIVE
+    message = update.message
+    if message is None:
+        return BULK
+    if message.photo:
+        # رسید پرداخت
+        return PAYMENT
+    return NORMAL
+
+
+async def answer_busy(update: object):
+    """پیام «شلوغ است» برای آپدیت حذف‌شده (کالبک با query.answer، پیام با پاسخ متنی)"""
+    if not isinstance(update, Update):
+        return
+    try:
+        if update.callback_query:
+            await update.callback_query.answer(BUSY_MESSAGE)
+        elif update.message:
+            await update.message.reply_text(BUSY_MESSAGE)
+    except Exception as e:
+        logger.debug(f"Could not send busy notice: {e}")
+
+
+class PriorityUpdateProcessor(BaseUpdateProcessor):
+    """پردازش آپدیت‌های یک ربات از طریق UpdateScheduler مشترک"""
+
+    def __init__(
+        self,
+        bot_name: str,
+        classify: Callable[[object], int],
+        scheduler: UpdateScheduler = UPDATE_SCHEDULER,
+        on_shed: Callable[[object], Awaitable[None]] = answer_busy
+    ):
+        """مقداردهی اولیه"""
+        # سمافور خود PTB نباید آپدیت‌ها را قبل از رسیدن به صف اولویت‌دار به ترتیب ورود نگه دارد؛
+        # سقف واقعی را scheduler تعیین می‌کند
+        super().__init__(max_concurrent_updates=scheduler.workers + scheduler.max_depth + 1000)
+        self.bot_name = bot_name
+        self.classify = classify
+        self.scheduler = scheduler
+        self.on_shed = on_shed
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        await self.scheduler.run(self.bot_name, update, self.classify(update), coroutine, self.on_shed)
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
@@ -31,6 +31,11 @@ def send_telegram_message(bot_token, chat_id, message, parse_mode="HTML"):
         logger.error(f"Failed to send message: {e}")
         return False
 
+async def send_telegram_message_async(bot_token, chat_id, message, parse_mode="HTML"):
+    """Send a Telegram message from async code without blocking the event loop."""
+    from bot.utils.executor import HTTP_POOL, run_blocking
+    return await run_blocking(HTTP_POOL, send_telegram_message, bot_token, chat_id, message, parse_mode)
+
 def load_env_file(env_path):
     """Load environment variables from .env file."""
     env_vars = {}
@@ -0,0 +1,44 @@
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+
+class SingleFlight:
+    """اشتراک یک فراخوانی در حال اجرا بین نخ‌هایی که همزمان همان کلید را می‌خواهند
+
+    اولین نخ تابع را اجرا می‌کند و بقیه منتظر نتیجه (یا خطای) همان فراخوانی
+    می‌مانند. نتیجه بین همه فراخواننده‌ها مشترک است و نباید تغییر داده شود.
+    چیزی کش نمی‌شود؛ پس از پایان فراخوانی درخواست بعدی دوباره اجرا می‌شود، پس
+    کش TTL می‌تواند جلوی آن قرار بگیرد و فقط در صورت نبود داده از آن استفاده کند.
+    """
+
+    def __init__(self):
+        """مقداردهی اولیه"""
+        self._calls: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, func: Callable[[], Any]) -> Tuple[Any, bool]:
+        """اجرای func یا پیوستن به اجرای در حال انجام؛ (نتیجه، آیا پیوسته) برمی‌گرداند"""
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+
+        if not leader:
+            return future.result(), True
+
+        try:
+            result = func()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def in_flight(self) -> int:
+        return len(self._calls)
@@ -0,0 +1,170 @@
+import asyncio
+import logging
+import sys
+import time
+from collections import OrderedDict
+from typing import Dict, List
+
+from telegram import Update
+from telegram.ext import Application, ContextTypes, TypeHandler
+
+from config import STATE_SWEEP_INTERVAL, STATE_IDLE_HOURS, STATE_MAX_ENTRIES
+from bot.utils.metrics import Counter, Gauge
+from bot.utils.persistence import DatabasePersistence
+
+logger = logging.getLogger(__name__)
+
+STATE_ENTRIES = Gauge(
+    "foxybot_state_entries",
+    "user_data/chat_data entries held in memory",
+    ("bot", "kind")
+)
+STATE_BYTES = Gauge(
+    "foxybot_state_bytes",
+    "Approximate memory used by user_data/chat_data dicts",
+    ("bot", "kind")
+)
+STATE_EVICTIONS = Counter(
+    "foxybot_state_evictions_total",
+    "user_data/chat_data entries evicted from memory",
+    ("bot", "kind", "reason")
+)
+
+# گروه بسیار پایین تا پیش از همه هندلرها اجرا شود و جلوی آن‌ها را نگیرد
+TOUCH_HANDLER_GROUP = -100
+
+
+def deep_sizeof(obj, seen=None) -> int:
+    """اندازه تقریبی یک شیء به همراه محتوای دیکشنری‌ها و لیست‌های داخل آن"""
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(key, seen) + deep_sizeof(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(item, seen) for item in obj)
+    return size
+
+
+class StateSweeper:
+    """خارج کردن user_data/chat_data بلااستفاده از حافظه ربات
+
+    زمان آخرین آپدیت هر کاربر و چت با یک TypeHandler ثبت می‌شود. در هر دور،
+    ورودی‌هایی که بیش از STATE_IDLE_HOURS دست‌نخورده مانده‌اند و در صورت تعیین
+    STATE_MAX_ENTRIES قدیمی‌ترین ورودی‌های مازاد (LRU) حذف می‌شوند. پیش از حذف،
+    تغییرات در persistence نوشته می‌شوند تا در آپدیت بعدی کاربر بازیابی شوند.
+    """
+
+    def __init__(
+        self,
+        application: Application,
+        bot_name: str,
+        idle_seconds: float = STATE_IDLE_HOURS * 3600,
+        max_entries: int = STATE_MAX_ENTRIES
+    ):
+        """مقداردهی اولیه و ثبت هندلر ردیابی استفاده"""
+        self.application = application
+        self.bot_name = bot_name
+        self.idle_seconds = idle_seconds
+        self.max_entries = max_entries
+        # ترتیب درج همان ترتیب LRU است (قدیمی‌ترین در ابتدا)
+        self._user_touches: "OrderedDict[int, float]" = OrderedDict()
+        self._chat_touches: "OrderedDict[int, float]" = OrderedDict()
+        application.add_handler(TypeHandler(Update, self._touch), group=TOUCH_HANDLER_GROUP)
+
+    async def _touch(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        now = time.monotonic()
+        if update.effective_user:
+            self._user_touches[update.effective_user.id] = now
+            self._user_touches.move_to_end(update.effective_user.id)
+        if update.effective_chat:
+            self._chat_touches[update.effective_chat.id] = now
+            self._chat_touches.move_to_end(update.effective_chat.id)
+
+    async def run(self):
+        """اجرای دوره‌ای تا زمان لغو"""
+        logger.info(f"State sweeper started for {self.bot_name} bot")
+        while True:
+            await asyncio.sleep(STATE_SWEEP_INTERVAL)
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"Error sweeping {self.bot_name} bot state: {e}")
+
+    async def sweep(self) -> Dict[str, int]:
+        """یک دور حذف و به‌روزرسانی گزارش حافظه؛ تعداد حذف‌شده‌های هر نوع را برمی‌گرداند"""
+        started = time.monotonic()
+        users = self._candidates(self.application.user_data, self._user_touches, started)
+        chats = self._candidates(self.application.chat_data, self._chat_touches, started)
+
+        if users or chats:
+            persistence = self.application.persistence
+            if persistence is None:
+                # بدون persistence فقط ورودی‌های خالی حذف می‌شوند تا فرایند نیمه‌کاره‌ای از دست نرود
+                users = [user_id for user_id in users if not self.application.user_data.get(user_id)]
+                chats = [chat_id for chat_id in chats if not self.application.chat_data.get(chat_id)]
+            else:
+                await self.application.update_persistence()
+                await persistence.flush()
+
+            # ورودی‌هایی که در حین نوشتن استفاده شده‌اند نگه داشته می‌شوند
+            users = self._evict(users, self._user_touches, started, "user")
+            chats = self._evict(chats, self._chat_touches, started, "chat")
+            if persistence is not None:
+                # ثبت فوری حذف‌ها تا بازگشت کاربر با حذف در انتظار تداخل نکند
+                await self.application.update_persistence()
+
+        self.report()
+        if users or chats:
+            logger.info(f"Evicted idle state from {self.bot_name} bot: {len(users)} users, {len(chats)} chats")
+        return {"user": len(users), "chat": len(chats)}
+
+    def _candidates(self, data, touches: "OrderedDict[int, float]", now: float) -> List[int]:
+        # ورودی‌هایی که پیش از شروع ردیابی ساخته شده‌اند از همین لحظه شمرده می‌شوند
+        for key in data:
+            if key not in touches:
+                touches[key] = now
+        for key in [key for key in touches if key not in data]:
+            del touches[key]
+
+        candidates = []
+        cutoff = now - self.idle_seconds
+        for key, touched in touches.items():
+            if touched >= cutoff:
+                break
+            candidates.append(key)
+        if self.max_entries and len(touches) - len(candidates) > self.max_entries:
+            overflow = len(touches) - self.max_entries
+            candidates = list(touches)[:overflow]
+        return candidates
+
+    def _evict(self, keys: List[int], touches: "OrderedDict[int, float]", started: float, kind: str) -> List[int]:
+        cutoff = started - self.idle_seconds
+        evicted = []
+        for key in keys:
+            touched = touches.get(key)
+            if touched is None or touched > started:
+                continue
+            if kind == "user":
+                if isinstance(self.application.persistence, DatabasePersistence):
+                    self.application.persistence.release(key)
+                self.application.drop_user_data(key)
+            else:
+                self.application.drop_chat_data(key)
+            del touches[key]
+            evicted.append(key)
+            STATE_EVICTIONS.inc(bot=self.bot_name, kind=kind, reason="idle" if touched < cutoff else "capacity")
+        return evicted
+
+    def report(self) -> Dict[str, Dict[str, int]]:
+        """تعداد و حافظه تقریبی user_data/chat_data این ربات"""
+        result = {}
+        for kind, data in (("user", self.application.user_data), ("chat", self.application.chat_data)):
+            size = sys.getsizeof(data) + sum(deep_sizeof(key) + deep_sizeof(value) for key, value in data.items())
+            STATE_ENTRIES.set(len(data), bot=self.bot_name, kind=kind)
+            STATE_BYTES.set(size, bot=self.bot_name, kind=kind)
+            result[kind] = {"entries": len(data), "bytes": size}
+        return result
@@ -0,0 +1,124 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+from config import USER_THROTTLE_RATE, USER_THROTTLE_BURST, USER_THROTTLE_CACHE_TTL
+
+# هزینه هر کلیک بر حسب توکن
+MENU = 1        # منوهای ثابت و داده‌های درون حافظه
+DATABASE = 2    # نمایش‌هایی که چند کوئری دیتابیس می‌زنند
+PANEL = 6       # نمایش‌هایی که اطلاعات را از پنل می‌گیرند
+
+# حداکثر تعداد کاربرانی که شمارنده تخلف آن‌ها نگه داشته می‌شود
+MAX_OFFENDERS = 1000
+
+COOLDOWN_MESSAGE = "⏳ لطفاً کمی آهسته‌تر؛ {seconds} ثانیه دیگر دوباره امتحان کنید."
+
+
+class Offender:
+    __slots__ = ("count", "route", "first_seen", "last_seen")
+
+    def __init__(self, now: float):
+        self.count = 0
+        self.route = ""
+        self.first_seen = now
+        self.last_seen = now
+
+
+class UserThrottle:
+    """سطل توکن هر کاربر (بر اساس شناسه تلگرام) برای کلیک دکمه‌ها
+
+    هر مسیر کالبک بسته به کاری که انجام می‌دهد هزینه‌ای دارد (MENU، DATABASE یا PANEL).
+    سطل با rate توکن در ثانیه تا burst پر می‌شود و کاربرانی که سطلشان دوباره پر شده از
+    حافظه حذف می‌شوند. کلیک‌های رد شده برای نمایش در ربات ادمین شمرده می‌شوند. فقط از
+    حلقه رویداد استفاده می‌شود و قفل ندارد.
+    """
+
+    def __init__(self, rate: float = USER_THROTTLE_RATE, burst: float = USER_THROTTLE_BURST):
+        """مقداردهی اولیه"""
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self.started_at = time.time()
+        self._buckets: Dict[int, Tuple[float, float]] = {}
+        self._offenders: Dict[int, Offender] = {}
+        self._last_sweep = time.monotonic()
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def consume(self, user_id: int, route: str, cost: float) -> Optional[float]:
+        """کم کردن هزینه کلیک از سطل کاربر؛ اگر توکن کافی نباشد ثانیه‌های لازم تا مجاز شدن برمی‌گردد"""
+        if not self.enabled:
+            return None
+        now = time.monotonic()
+        cost = min(cost, self.burst)
+        tokens, updated = self._buckets.get(user_id, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        if tokens >= cost:
+            self._buckets[user_id] = (tokens - cost, now)
+            self._sweep(now)
+            return None
+        self._buckets[user_id] = (tokens, now)
+        self._record(user_id, route)
+        return (cost - tokens) / self.rate
+
+    def _sweep(self, now: float):
+        """حذف سطل کاربرانی که از آخرین کلیکشان به اندازه پر شدن کامل سطل گذشته"""
+        refill = self.burst / self.rate
+        if now - self._last_sweep < max(refill, 60):
+            return
+        self._last_sweep = now
+        self._buckets = {
+            user_id: entry for user_id, entry in self._buckets.items() if now - entry[1] < refill
+        }
+
+    def _record(self, user_id: int, route: str):
+        now = time.time()
+        offender = self._offenders.get(user_id)
+        if offender is None:
+            if len(self._offenders) >= MAX_OFFENDERS:
+                oldest = min(self._offenders, key=lambda key: self._offenders[key].last_seen)
+                del self._offenders[oldest]
+            offender = self._offenders[user_id] = Offender(now)
+        offender.count += 1
+        offender.route = route
+        offender.last_seen = now
+
+    def offenders(self, limit: int = 20) -> List[Tuple[int, Offender]]:
+        """کاربران با بیشترین کلیک رد شده از شروع پروسه"""
+        return sorted(self._offenders.items(), key=lambda item: item[1].count, reverse=True)[:limit]
+
+    def tracked_users(self) -> int:
+        return len(self._buckets)
+
+
+class ViewCache:
+    """آخرین نمایش هر کاربر (متن و دکمه‌ها) برای جواب دادن به کلیک‌های محدودشده بدون رفتن سراغ پنل"""
+
+    def __init__(self, ttl: float = USER_THROTTLE_CACHE_TTL, max_entries: int = 10000):
+        """مقداردهی اولیه"""
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+
+    def put(self, key: Hashable, view: Any):
+        if self.ttl <= 0:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, view)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self._entries[key]
+            return None
+        return entry[1]
+
+
+# مشترک بین ربات کاربران (شمارش) و ربات ادمین (نمایش کاربران محدودشده)
+USER_THROTTLE = UserThrottle()
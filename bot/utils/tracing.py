@@ -0,0 +1,264 @@
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+import requests
+
+from config import (
+    TRACING_EXPORTER,
+    TRACING_JSONL_PATH,
+    TRACING_OTLP_ENDPOINT,
+    TRACING_SAMPLE_RATE,
+    TRACING_SLOW_THRESHOLD,
+    TRACING_SLOW_SAMPLE_RATE
+)
+
+logger = logging.getLogger(__name__)
+slow_logger = logging.getLogger("foxybot.slow_traces")
+
+_current_span: ContextVar[Optional["Span"]] = ContextVar("foxybot_current_span", default=None)
+
+
+class Trace:
+    """مجموعه اسپن‌های یک آپدیت"""
+
+    def __init__(self):
+        self.trace_id = os.urandom(16).hex()
+        self.spans: List["Span"] = []
+        self._lock = threading.Lock()
+
+    def add(self, span: "Span"):
+        with self._lock:
+            self.spans.append(span)
+
+
+class Span:
+    """یک بازه زمانی با نام و ویژگی‌ها در درخت یک trace"""
+
+    def __init__(self, trace: Trace, name: str, parent: Optional["Span"], attributes: Dict):
+        self.trace = trace
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = attributes
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.error: Optional[str] = None
+
+    def finish(self, error: Optional[BaseException] = None):
+        if self.duration is not None:
+            return
+        self.duration = time.perf_counter() - self._start
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        self.trace.add(self)
+
+    def to_dict(self) -> Dict:
+        return {
+            "trace_id": self.trace.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start_time,
+            "duration_ms": round(self.duration * 1000, 3),
+            "attributes": self.attributes,
+            "error": self.error
+        }
+
+
+class JsonlExporter:
+    """نوشتن اسپن‌ها به صورت یک JSON در هر خط در پس‌زمینه (مثل OtlpHttpExporter)"""
+
+    def __init__(self, path: str, max_queue: int = 1000):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._queue: "queue.Queue[List[Span]]" = queue.Queue(maxsize=max_queue)
+        threading.Thread(target=self._worker, name="foxybot-trace-jsonl", daemon=True).start()
+
+    def export(self, spans: List[Span]):
+        # سریال‌سازی و نوشتن فایل در نخ پس‌زمینه انجام می‌شود تا حلقه رویداد منتظر دیسک نماند
+        try:
+            self._queue.put_nowait(spans)
+        except queue.Full:
+            logger.debug("Dropping trace, JSONL export queue is full")
+
+    def _worker(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < 100:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                lines = "".join(
+                    json.dumps(span.to_dict(), ensure_ascii=False) + "\n"
+                    for spans in batch for span in spans
+                )
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(lines)
+            except Exception as e:
+                logger.debug(f"Error writing traces to {self.path}: {e}")
+
+
+class OtlpHttpExporter:
+    """ارسال اسپن‌ها با فرمت OTLP/JSON به یک collector در پس‌زمینه"""
+
+    def __init__(self, endpoint: str, max_queue: int = 1000):
+        self.url = endpoint.rstrip("/") + "/v1/traces"
+        self._queue: "queue.Queue[List[Span]]" = queue.Queue(maxsize=max_queue)
+        threading.Thread(target=self._worker, name="foxybot-otlp", daemon=True).start()
+
+    def export(self, spans: List[Span]):
+        try:
+            self._queue.put_nowait(spans)
+        except queue.Full:
+            logger.debug("Dropping trace, OTLP export queue is full")
+
+    @staticmethod
+    def _attributes(attributes: Dict) -> List[Dict]:
+        return [{"key": key, "value": {"stringValue": str(value)}} for key, value in attributes.items()]
+
+    def _payload(self, batch: List[List[Span]]) -> Dict:
+        spans = []
+        for trace_spans in batch:
+            for span in trace_spans:
+                item = {
+                    "traceId": span.trace.trace_id,
+                    "spanId": span.span_id,
+                    "name": span.name,
+                    "kind": 1,
+                    "startTimeUnixNano": int(span.start_time * 1e9),
+                    "endTimeUnixNano": int((span.start_time + span.duration) * 1e9),
+                    "attributes": self._attributes(span.attributes),
+                    "status": {"code": 2, "message": span.error} if span.error else {"code": 1}
+                }
+                if span.parent_id:
+                    item["parentSpanId"] = span.parent_id
+                spans.append(item)
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": self._attributes({"service.name": "foxybot"})},
+                "scopeSpans": [{"scope": {"name": "foxybot"}, "spans": spans}]
+            }]
+        }
+
+    def _worker(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < 100:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                requests.post(self.url, json=self._payload(batch), timeout=5)
+            except Exception as e:
+                logger.debug(f"Error exporting traces: {e}")
+
+
+def _build_exporter():
+    if TRACING_EXPORTER == "jsonl":
+        return JsonlExporter(TRACING_JSONL_PATH)
+    if TRACING_EXPORTER == "otlp":
+        return OtlpHttpExporter(TRACING_OTLP_ENDPOINT)
+    return None
+
+
+_exporter = _build_exporter()
+
+
+def set_exporter(exporter):
+    """جایگزینی خروجی trace (برای ابزارهای بنچمارک یا تست)"""
+    global _exporter
+    _exporter = exporter
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def begin_span(name: str, **attributes) -> Optional[Span]:
+    """شروع یک اسپن برگ در trace جاری بدون تغییر اسپن جاری؛ خارج از trace هیچ کاری نمی‌کند"""
+    parent = _current_span.get()
+    if parent is None:
+        return None
+    return Span(parent.trace, name, parent, attributes)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """اسپن فرزند در trace جاری (خارج از trace بدون اثر)"""
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+
+    child = Span(parent.trace, name, parent, attributes)
+    token = _current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.finish(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        child.finish()
+
+
+@contextmanager
+def start_trace(name: str, **attributes):
+    """شروع trace جدید برای یک آپدیت و خروجی گرفتن از آن پس از پایان"""
+    root = Span(Trace(), name, None, attributes)
+    token = _current_span.set(root)
+    try:
+        yield root
+    except BaseException as e:
+        root.finish(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        root.finish()
+        _complete(root)
+
+
+def _complete(root: Span):
+    spans = sorted(root.trace.spans, key=lambda s: s.start_time)
+    if _exporter is not None and random.random() < TRACING_SAMPLE_RATE:
+        try:
+            _exporter.export(spans)
+        except Exception as e:
+            logger.error(f"Error exporting trace: {e}")
+
+    if root.duration >= TRACING_SLOW_THRESHOLD and random.random() < TRACING_SLOW_SAMPLE_RATE:
+        slow_logger.warning(format_trace(root, spans))
+
+
+def format_trace(root: Span, spans: List[Span]) -> str:
+    """نمایش درختی یک trace برای لاگ کندی"""
+    children: Dict[Optional[str], List[Span]] = {}
+    for item in spans:
+        children.setdefault(item.parent_id, []).append(item)
+
+    lines = [f"Slow trace {root.trace.trace_id} ({root.duration * 1000:.0f} ms)"]
+
+    def walk(node: Span, depth: int):
+        offset = (node.start_time - root.start_time) * 1000
+        attrs = " ".join(f"{k}={v}" for k, v in node.attributes.items())
+        error = f" ERROR {node.error}" if node.error else ""
+        lines.append(f"{'  ' * depth}+{offset:.0f}ms {node.name} {node.duration * 1000:.1f}ms {attrs}{error}")
+        for child in children.get(node.span_id, []):
+            walk(child, depth + 1)
+
+    walk(root, 0)
+    return "\n".join(lines)
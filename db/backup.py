@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import argparse
+import logging
+from datetime import datetime
+from sqlalchemy import create_engine
+
+# اضافه کردن مسیر پروژه به سیستم
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from config import DATABASE_URL, BACKUP_DIR, BACKUP_KEEP, BACKUP_COMPRESSION
+from bot.utils.backup import dump_database, list_backups, restore_database, format_size
+
+# تنظیمات لاگینگ
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="FoxyBot database backup and restore")
+    parser.add_argument("--directory", default=BACKUP_DIR, help="Backup directory")
+    parser.add_argument("--keep", type=int, default=BACKUP_KEEP, help="Number of backups to keep")
+    parser.add_argument("--compression", default=BACKUP_COMPRESSION, choices=("gzip", "zstd"))
+    parser.add_argument("--list", action="store_true", help="List existing backups")
+    parser.add_argument("--restore", metavar="FILE", help="Restore the database from a backup file")
+    parser.add_argument("--yes", action="store_true", help="Do not ask for confirmation before restoring")
+    return parser.parse_args()
+
+
+def main() -> int:
+    """اجرای بکاپ، فهرست بکاپ‌ها یا بازگردانی از خط فرمان"""
+    args = parse_args()
+
+    if args.list:
+        for path in list_backups(args.directory):
+            modified = datetime.fromtimestamp(os.path.getmtime(path))
+            print(f"{modified:%Y-%m-%d %H:%M}  {format_size(os.path.getsize(path)):>10}  {path}")
+        return 0
+
+    engine = create_engine(DATABASE_URL)
+    try:
+        if args.restore:
+            if not os.path.exists(args.restore):
+                logger.error(f"Backup file not found: {args.restore}")
+                return 1
+            if not args.yes:
+                answer = input(f"All data in the backed up tables will be replaced by {args.restore}. Continue? [y/N] ")
+                if answer.strip().lower() not in ("y", "yes"):
+                    return 1
+            rows = restore_database(engine, args.restore)
+            for table, count in rows.items():
+                logger.info(f"Restored {count} rows into {table}")
+            logger.info("Database restored successfully!")
+            return 0
+
+        result = dump_database(engine, args.directory, args.compression, args.keep)
+        for table, count in result.rows.items():
+            logger.info(f"Backed up {count} rows from {table}")
+        logger.info(
+            f"Backup written to {result.path} "
+            f"({format_size(result.size)}, {result.compression}, {result.duration:.1f}s)"
+        )
+        for path in result.removed:
+            logger.info(f"Removed old backup {path}")
+        return 0
+    except Exception as e:
+        logger.error(f"Database backup failed: {e}")
+        return 1
+    finally:
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -13,6 +13,7 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')
 
 from config import DATABASE_URL
 from db.models import Base
+from db.schema import add_missing_columns, add_missing_indexes
 
 # تنظیمات لاگینگ
 logging.basicConfig(
@@ -30,6 +31,8 @@ def create_tables():
         # ایجاد جداول
         logger.info("Creating database tables...")
         Base.metadata.create_all(engine)
+        add_missing_columns(engine)
+        add_missing_indexes(engine)
         
         # تست دیتابیس
         SessionLocal = sessionmaker(bind=engine)
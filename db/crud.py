@@ -1,7 +1,7 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session, joinedload
+from sqlalchemy import and_, or_, select, update
 from datetime import datetime, timedelta
-from typing import List, Optional
+from typing import Callable, Dict, List, Optional
 from . import models
 from config import TRAFFIC_ALERT_THRESHOLD
 
@@ -32,6 +32,30 @@ def update_panel_status(db: Session, panel_id: int, status: models.PanelStatus)
         db.refresh(db_panel)
     return db_panel
 
+def begin_panel_migration(db: Session, panel_id: int) -> None:
+    """بردن پنل به حالت MAINTENANCE و نگه داشتن وضعیت قبلی آن؛ کارهای صف پنل تا پایان انتقال متوقف می‌مانند"""
+    db_panel = get_panel(db, panel_id)
+    if db_panel is None:
+        return
+    # وضعیت ثبت‌شده از انتقال نیمه‌کاره قبلی حفظ می‌شود؛ وگرنه بعداً MAINTENANCE بازگردانده می‌شد
+    if db_panel.status_before_migration is None:
+        db_panel.status_before_migration = db_panel.status
+    db_panel.status = models.PanelStatus.MAINTENANCE
+    db.commit()
+
+def end_panel_migration(db: Session, panel_id: int) -> None:
+    """بازگرداندن وضعیت پنل پیش از شروع انتقال (اگر انتقالی در کار نباشد کاری نمی‌کند)"""
+    db_panel = get_panel(db, panel_id)
+    if db_panel is None or db_panel.status_before_migration is None:
+        return
+    db_panel.status = db_panel.status_before_migration
+    db_panel.status_before_migration = None
+    db.commit()
+
+def get_migrating_panel_ids(db: Session) -> List[int]:
+    rows = db.query(models.Panel.id).filter(models.Panel.status_before_migration.isnot(None)).all()
+    return [row.id for row in rows]
+
 # User CRUD
 def create_user(db: Session, telegram_id: int, username: str, first_name: str, last_name: str) -> models.User:
     db_user = models.User(
@@ -48,6 +72,19 @@ def create_user(db: Session, telegram_id: int, username: str, first_name: str, l
 def get_user(db: Session, telegram_id: int) -> Optional[models.User]:
     return db.query(models.User).filter(models.User.telegram_id == telegram_id).first()
 
+def get_users(db: Session, limit: int) -> List[models.User]:
+    return db.query(models.User).order_by(models.User.id).limit(limit).all()
+
+def get_users_by_telegram_ids(db: Session, telegram_ids: List[int]) -> List[models.User]:
+    return db.query(models.User).filter(models.User.telegram_id.in_(telegram_ids)).all()
+
+def search_users(db: Session, term: str) -> List[models.User]:
+    return db.query(models.User).filter(
+        models.User.username.ilike(f"%{term}%") |
+        models.User.first_name.ilike(f"%{term}%") |
+        models.User.last_name.ilike(f"%{term}%")
+    ).all()
+
 def update_user_wallet(db: Session, user_id: int, amount: float) -> Optional[models.User]:
     db_user = db.query(models.User).filter(models.User.id == user_id).first()
     if db_user:
@@ -70,6 +107,9 @@ def create_plan(db: Session, name: str, description: str, duration_days: int, tr
     db.refresh(db_plan)
     return db_plan
 
+def get_plan(db: Session, plan_id: int) -> Optional[models.Plan]:
+    return db.get(models.Plan, plan_id)
+
 def get_active_plans(db: Session) -> List[models.Plan]:
     return db.query(models.Plan).filter(models.Plan.is_active == True).all()
 
@@ -96,6 +136,70 @@ def create_subscription(
     db.refresh(db_subscription)
     return db_subscription
 
+def purchase_plan(
+    db: Session,
+    user_id: int,
+    plan: models.Plan,
+    panel_id: int,
+    uuid: str,
+    start_date: datetime,
+    build_payload: Callable[[models.Subscription], dict],
+    notify_chat_id: Optional[int] = None
+) -> Optional[models.Subscription]:
+    """خرید پلن از کیف پول در یک تراکنش؛ اگر موجودی کافی نباشد None برمی‌گردد
+
+    کسر موجودی یک UPDATE شرطی است تا خریدهای همزمان موجودی را منفی نکنند. تراکنش،
+    اشتراک و کار CREATE پنل در یک commit ثبت می‌شوند تا خطا چیزی را نیمه‌کاره نگذارد.
+    """
+    debited = db.execute(
+        update(models.User).where(
+            and_(models.User.id == user_id, models.User.wallet_balance >= plan.price)
+        ).values(wallet_balance=models.User.wallet_balance - plan.price)
+    ).rowcount
+    if not debited:
+        db.rollback()
+        return None
+    db.add(models.Transaction(
+        user_id=user_id,
+        amount=-plan.price,
+        description=f"خرید پلن {plan.name}",
+        status=models.TransactionStatus.COMPLETED
+    ))
+    db_subscription = models.Subscription(
+        user_id=user_id,
+        panel_id=panel_id,
+        plan_id=plan.id,
+        uuid=uuid,
+        start_date=start_date,
+        end_date=start_date + timedelta(days=plan.duration_days)
+    )
+    db.add(db_subscription)
+    db.flush()
+    db.add(models.PanelJob(
+        job_type=models.PanelJobType.CREATE,
+        panel_id=panel_id,
+        uuid=uuid,
+        payload=build_payload(db_subscription),
+        subscription_id=db_subscription.id,
+        notify_chat_id=notify_chat_id
+    ))
+    subscription_id = db_subscription.id
+    db.commit()
+    return get_subscription(db, subscription_id)
+
+def get_subscription(db: Session, subscription_id: int) -> Optional[models.Subscription]:
+    return db.get(
+        models.Subscription,
+        subscription_id,
+        options=[
+            joinedload(models.Subscription.user),
+            joinedload(models.Subscription.plan),
+            joinedload(models.Subscription.panel)
+        ],
+        # نمونه منقضی‌شده (پس از commit) در identity map هم همراه رابطه‌هایش دوباره خوانده شود
+        populate_existing=True
+    )
+
 def get_user_subscriptions(db: Session, user_id: int) -> List[models.Subscription]:
     return db.query(models.Subscription).filter(models.Subscription.user_id == user_id).all()
 
@@ -107,6 +211,55 @@ def get_active_subscriptions(db: Session) -> List[models.Subscription]:
         )
     ).all()
 
+def deactivate_lapsed_subscriptions(db: Session, limit: int) -> List[tuple]:
+    """غیرفعال کردن دسته‌ای از اشتراک‌های منقضی یا تمام‌حجم
+
+    کار DISABLE پنل هر اشتراک در همان تراکنش ثبت می‌شود (outbox) تا با کرش، اشتراک
+    غیرفعال روی پنل فعال نماند. ردیف‌ها با SKIP LOCKED قفل می‌شوند تا چند ورکر کنار هم
+    اجرا شوند؛ برای هر اشتراک غیرفعال‌شده (id, uuid, panel_id) برمی‌گردد.
+    """
+    now = datetime.utcnow()
+    rows = db.query(
+        models.Subscription.id,
+        models.Subscription.uuid,
+        models.Subscription.panel_id
+    ).join(models.Plan, models.Subscription.plan_id == models.Plan.id, isouter=True).filter(
+        and_(
+            models.Subscription.is_active == True,
+            or_(
+                models.Subscription.end_date <= now,
+                and_(
+                    models.Plan.traffic_gb > 0,
+                    models.Subscription.traffic_used >= models.Plan.traffic_gb
+                )
+            )
+        )
+    ).order_by(models.Subscription.id).limit(limit).with_for_update(
+        skip_locked=True, of=models.Subscription
+    ).all()
+    if rows:
+        db.query(models.Subscription).filter(
+            and_(
+                models.Subscription.id.in_([row.id for row in rows]),
+                models.Subscription.is_active == True
+            )
+        ).update(
+            {models.Subscription.is_active: False, models.Subscription.updated_at: now},
+            synchronize_session=False
+        )
+        db.add_all([
+            models.PanelJob(
+                job_type=models.PanelJobType.DISABLE,
+                panel_id=row.panel_id,
+                uuid=row.uuid,
+                payload={},
+                subscription_id=row.id
+            )
+            for row in rows if row.panel_id is not None
+        ])
+    db.commit()
+    return [tuple(row) for row in rows]
+
 def update_subscription_traffic(db: Session, subscription_id: int, traffic_used: float) -> Optional[models.Subscription]:
     db_subscription = db.query(models.Subscription).filter(models.Subscription.id == subscription_id).first()
     if db_subscription:
@@ -154,10 +307,15 @@ def create_transaction(
     return db_transaction
 
 def get_pending_transactions(db: Session) -> List[models.Transaction]:
-    return db.query(models.Transaction).filter(
+    return db.query(models.Transaction).options(joinedload(models.Transaction.user)).filter(
         models.Transaction.status == models.TransactionStatus.PENDING
     ).all()
 
+def get_user_transactions(db: Session, user_id: int, limit: int) -> List[models.Transaction]:
+    return db.query(models.Transaction).filter(
+        models.Transaction.user_id == user_id
+    ).order_by(models.Transaction.created_at.desc()).limit(limit).all()
+
 def update_transaction_status(
     db: Session,
     transaction_id: int,
@@ -168,4 +326,260 @@ def update_transaction_status(
         db_transaction.status = status
         db.commit()
         db.refresh(db_transaction)
-    return db_transaction 
\ No newline at end of file
+    return db_transaction
+
+# Panel job CRUD
+def enqueue_panel_job(
+    db: Session,
+    job_type: models.PanelJobType,
+    panel_id: int,
+    uuid: str,
+    payload: Optional[dict] = None,
+    subscription_id: Optional[int] = None,
+    notify_chat_id: Optional[int] = None
+) -> models.PanelJob:
+    db_job = models.PanelJob(
+        job_type=job_type,
+        panel_id=panel_id,
+        uuid=uuid,
+        payload=payload or {},
+        subscription_id=subscription_id,
+        notify_chat_id=notify_chat_id
+    )
+    db.add(db_job)
+    db.commit()
+    db.refresh(db_job)
+    return db_job
+
+def get_open_panel_job(db: Session, subscription_id: int, job_type: models.PanelJobType) -> Optional[models.PanelJob]:
+    return db.query(models.PanelJob).filter(
+        and_(
+            models.PanelJob.subscription_id == subscription_id,
+            models.PanelJob.job_type == job_type,
+            models.PanelJob.status.in_([models.PanelJobStatus.PENDING, models.PanelJobStatus.RUNNING])
+        )
+    ).order_by(models.PanelJob.id.desc()).first()
+
+def get_last_panel_job(db: Session, subscription_id: int, job_type: models.PanelJobType) -> Optional[models.PanelJob]:
+    return db.query(models.PanelJob).filter(
+        and_(
+            models.PanelJob.subscription_id == subscription_id,
+            models.PanelJob.job_type == job_type
+        )
+    ).order_by(models.PanelJob.id.desc()).first()
+
+def claim_panel_jobs(db: Session, limit: int, lock_timeout: int) -> List[models.PanelJob]:
+    """برداشتن کارهای موعدرسیده؛ SKIP LOCKED مانع برداشتن یک ردیف توسط دو ورکر می‌شود"""
+    now = datetime.utcnow()
+    # کارهای پنلی که کاربرانش در حال انتقال هستند تا پایان انتقال منتظر می‌مانند
+    migrating = select(models.Panel.id).where(models.Panel.status_before_migration.isnot(None))
+    jobs = db.query(models.PanelJob).filter(
+        models.PanelJob.panel_id.notin_(migrating),
+        or_(
+            and_(
+                models.PanelJob.status == models.PanelJobStatus.PENDING,
+                models.PanelJob.next_attempt_at <= now
+            ),
+            and_(
+                models.PanelJob.status == models.PanelJobStatus.RUNNING,
+                models.PanelJob.locked_at < now - timedelta(seconds=lock_timeout)
+            )
+        )
+    ).order_by(models.PanelJob.next_attempt_at).limit(limit).with_for_update(skip_locked=True).all()
+    for job in jobs:
+        job.status = models.PanelJobStatus.RUNNING
+        job.locked_at = now
+        job.attempts += 1
+    db.commit()
+    return jobs
+
+def count_running_panel_jobs(db: Session, panel_id: int, lock_timeout: int) -> int:
+    """تعداد کارهای پنل که ورکری زنده در حال اجرای آن‌هاست (قفل قدیمی‌تر از lock_timeout رهاشده است)"""
+    return db.query(models.PanelJob).filter(
+        and_(
+            models.PanelJob.panel_id == panel_id,
+            models.PanelJob.status == models.PanelJobStatus.RUNNING,
+            models.PanelJob.locked_at >= datetime.utcnow() - timedelta(seconds=lock_timeout)
+        )
+    ).count()
+
+def requeue_abandoned_panel_jobs(db: Session, panel_id: int, lock_timeout: int) -> int:
+    """برگرداندن کارهای RUNNING پنل که ورکرشان از کار افتاده به PENDING (همان کاری که claim_panel_jobs می‌کرد)"""
+    requeued = db.query(models.PanelJob).filter(
+        and_(
+            models.PanelJob.panel_id == panel_id,
+            models.PanelJob.status == models.PanelJobStatus.RUNNING,
+            models.PanelJob.locked_at < datetime.utcnow() - timedelta(seconds=lock_timeout)
+        )
+    ).update(
+        {models.PanelJob.status: models.PanelJobStatus.PENDING, models.PanelJob.locked_at: None},
+        synchronize_session=False
+    )
+    db.commit()
+    return requeued
+
+def complete_panel_job(db: Session, job_id: int) -> None:
+    db.query(models.PanelJob).filter(models.PanelJob.id == job_id).update(
+        {
+            models.PanelJob.status: models.PanelJobStatus.COMPLETED,
+            models.PanelJob.locked_at: None,
+            models.PanelJob.last_error: None
+        },
+        synchronize_session=False
+    )
+    db.commit()
+
+def fail_panel_job(db: Session, job_id: int, error: str, retry_at: Optional[datetime]) -> None:
+    """زمان‌بندی دوباره کار ناموفق، یا FAILED کردن آن اگر retry_at برابر None باشد"""
+    values = {
+        models.PanelJob.locked_at: None,
+        models.PanelJob.last_error: error[:500]
+    }
+    if retry_at is None:
+        values[models.PanelJob.status] = models.PanelJobStatus.FAILED
+    else:
+        values[models.PanelJob.status] = models.PanelJobStatus.PENDING
+        values[models.PanelJob.next_attempt_at] = retry_at
+    db.query(models.PanelJob).filter(models.PanelJob.id == job_id).update(values, synchronize_session=False)
+    db.commit()
+
+# Reconciliation CRUD
+def iter_panel_subscriptions(db: Session, panel_id: int, batch_size: int = 5000):
+    """خواندن جریانی اشتراک‌های پنل به ترتیب بایتی uuid (همان ترتیب مقایسه رشته‌ها در پایتون)"""
+    key = models.Subscription.uuid
+    if db.get_bind().dialect.name == "postgresql":
+        key = key.collate("C")
+    return db.query(
+        models.Subscription.id,
+        models.Subscription.uuid,
+        models.Subscription.start_date,
+        models.Subscription.end_date,
+        models.Subscription.is_active,
+        models.Plan.traffic_gb,
+        models.User.telegram_id
+    ).outerjoin(models.Plan, models.Subscription.plan_id == models.Plan.id).outerjoin(
+        models.User, models.Subscription.user_id == models.User.id
+    ).filter(models.Subscription.panel_id == panel_id).order_by(key).yield_per(batch_size)
+
+def get_open_panel_job_subscription_ids(db: Session, panel_id: int) -> set:
+    rows = db.query(models.PanelJob.subscription_id).filter(
+        and_(
+            models.PanelJob.panel_id == panel_id,
+            models.PanelJob.subscription_id.isnot(None),
+            models.PanelJob.status.in_([models.PanelJobStatus.PENDING, models.PanelJobStatus.RUNNING])
+        )
+    ).all()
+    return {row.subscription_id for row in rows}
+
+def relink_subscription_uuids(db: Session, uuids: Dict[int, str]) -> None:
+    """اصلاح uuid اشتراک‌ها به کاربری که واقعاً روی پنل ساخته شده است، با یک UPDATE دسته‌ای"""
+    if not uuids:
+        return
+    db.execute(
+        update(models.Subscription),
+        [{"id": subscription_id, "uuid": uuid} for subscription_id, uuid in uuids.items()]
+    )
+    db.commit()
+
+def move_panel_users(db: Session, uuids: List[str], source_panel_id: int, target_panel_id: int) -> int:
+    """انتقال اشتراک‌ها و کارهای منتظر کاربران منتقل‌شده به پنل مقصد؛ تعداد اشتراک‌های منتقل‌شده برمی‌گردد
+
+    فقط کارهای PENDING منتقل می‌شوند؛ کار RUNNING هنوز با پنل مبدأ در ارتباط است.
+    """
+    moved = db.query(models.Subscription).filter(
+        and_(
+            models.Subscription.panel_id == source_panel_id,
+            models.Subscription.uuid.in_(uuids)
+        )
+    ).update({models.Subscription.panel_id: target_panel_id}, synchronize_session=False)
+    db.query(models.PanelJob).filter(
+        and_(
+            models.PanelJob.panel_id == source_panel_id,
+            models.PanelJob.uuid.in_(uuids),
+            models.PanelJob.status == models.PanelJobStatus.PENDING
+        )
+    ).update({models.PanelJob.panel_id: target_panel_id}, synchronize_session=False)
+    db.commit()
+    return moved
+
+# Conversation state CRUD
+def get_conversation_state(db: Session, bot: str, user_id: int, updated_after: datetime) -> Optional[dict]:
+    row = db.query(models.ConversationState.data).filter(
+        and_(
+            models.ConversationState.bot == bot,
+            models.ConversationState.user_id == user_id,
+            models.ConversationState.updated_at > updated_after
+        )
+    ).first()
+    return row.data if row else None
+
+def upsert_conversation_states(db: Session, bot: str, states: Dict[int, dict]) -> None:
+    """ذخیره وضعیت چند کاربر با یک دستور (در صورت پشتیبانی INSERT ... ON CONFLICT)"""
+    if not states:
+        return
+    now = datetime.utcnow()
+    rows = [{"bot": bot, "user_id": user_id, "data": data, "updated_at": now} for user_id, data in states.items()]
+    dialect = db.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        statement = insert(models.ConversationState)
+        db.execute(statement.on_conflict_do_update(
+            index_elements=["bot", "user_id"],
+            set_={"data": statement.excluded.data, "updated_at": statement.excluded.updated_at}
+        ), rows)
+    else:
+        db.query(models.ConversationState).filter(
+            and_(
+                models.ConversationState.bot == bot,
+                models.ConversationState.user_id.in_(list(states))
+            )
+        ).delete(synchronize_session=False)
+        db.execute(models.ConversationState.__table__.insert(), rows)
+    db.commit()
+
+def delete_conversation_states(db: Session, bot: str, user_ids: List[int]) -> None:
+    if not user_ids:
+        return
+    db.query(models.ConversationState).filter(
+        and_(
+            models.ConversationState.bot == bot,
+            models.ConversationState.user_id.in_(user_ids)
+        )
+    ).delete(synchronize_session=False)
+    db.commit()
+
+def purge_conversation_states(db: Session, updated_before: datetime) -> int:
+    deleted = db.query(models.ConversationState).filter(
+        models.ConversationState.updated_at < updated_before
+    ).delete(synchronize_session=False)
+    db.commit()
+    return deleted
+
+def add_callback_states(db: Session, states: Dict[str, tuple]) -> None:
+    """درج ردیف‌های token -> (data, expires_at) با یک دستور"""
+    if not states:
+        return
+    db.execute(models.CallbackState.__table__.insert(), [
+        {"token": token, "data": data, "expires_at": expires_at}
+        for token, (data, expires_at) in states.items()
+    ])
+    db.commit()
+
+def get_callback_state(db: Session, token: str, now: datetime) -> Optional[dict]:
+    row = db.query(models.CallbackState.data).filter(
+        and_(
+            models.CallbackState.token == token,
+            models.CallbackState.expires_at > now
+        )
+    ).first()
+    return row.data if row else None
+
+def purge_callback_states(db: Session, now: datetime) -> int:
+    deleted = db.query(models.CallbackState).filter(
+        models.CallbackState.expires_at <= now
+    ).delete(synchronize_session=False)
+    db.commit()
+    return deleted
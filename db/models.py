@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, ForeignKey, Enum
+from sqlalchemy import Column, Integer, BigInteger, String, Float, DateTime, Boolean, ForeignKey, Enum, JSON, Index, UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -20,6 +20,11 @@ class Panel(Base):
     proxy_path = Column(String, nullable=False)
     api_key = Column(String, nullable=False)
     status = Column(Enum(PanelStatus), default=PanelStatus.ACTIVE)
+    # محدودیت درخواست به پنل؛ خالی یعنی مقدار پیش‌فرض config و صفر یعنی بدون محدودیت
+    rate_limit = Column(Float)
+    max_concurrency = Column(Integer)
+    # وضعیت پنل پیش از شروع انتقال کاربران؛ تا پایان انتقال پر است و کارهای صف این پنل متوقف می‌مانند
+    status_before_migration = Column(Enum(PanelStatus))
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -77,6 +82,10 @@ class Subscription(Base):
     panel = relationship("Panel", back_populates="subscriptions")
     plan_id = Column(Integer, ForeignKey('plans.id'))
     plan = relationship("Plan", back_populates="subscriptions")
+    
+    __table_args__ = (
+        Index('ix_subscriptions_active_end_date', 'is_active', 'end_date'),
+    )
 
 class TransactionStatus(enum.Enum):
     PENDING = "pending"
@@ -96,4 +105,72 @@ class Transaction(Base):
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     user_id = Column(Integer, ForeignKey('users.id'))
-    user = relationship("User", back_populates="transactions") 
\ No newline at end of file
+    user = relationship("User", back_populates="transactions")
+
+class PanelJobType(enum.Enum):
+    CREATE = "create"
+    EXTEND = "extend"
+    DISABLE = "disable"
+    DELETE = "delete"
+
+class PanelJobStatus(enum.Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
+class PanelJob(Base):
+    """صف پایدار عملیات پنل (outbox) که توسط ورکر پس‌زمینه اجرا می‌شود"""
+    __tablename__ = 'panel_jobs'
+    
+    id = Column(Integer, primary_key=True)
+    job_type = Column(Enum(PanelJobType), nullable=False)
+    status = Column(Enum(PanelJobStatus), default=PanelJobStatus.PENDING, nullable=False)
+    uuid = Column(String, nullable=False)
+    payload = Column(JSON, default=dict)
+    attempts = Column(Integer, default=0, nullable=False)
+    max_attempts = Column(Integer, default=8, nullable=False)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    locked_at = Column(DateTime)
+    last_error = Column(String)
+    notify_chat_id = Column(Integer)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    panel_id = Column(Integer, ForeignKey('panels.id'), nullable=False)
+    panel = relationship("Panel")
+    subscription_id = Column(Integer, ForeignKey('subscriptions.id'))
+    subscription = relationship("Subscription")
+    
+    __table_args__ = (
+        Index('ix_panel_jobs_status_next_attempt', 'status', 'next_attempt_at'),
+        Index('ix_panel_jobs_subscription', 'subscription_id'),
+    )
+
+class ConversationState(Base):
+    """وضعیت گفتگوی کاربران (context.user_data) تا فرایندهای نیمه‌کاره پس از ری‌استارت از دست نروند"""
+    __tablename__ = 'conversation_states'
+    
+    id = Column(Integer, primary_key=True)
+    bot = Column(String, nullable=False)
+    user_id = Column(BigInteger, nullable=False)
+    data = Column(JSON, nullable=False, default=dict)
+    updated_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    
+    __table_args__ = (
+        UniqueConstraint('bot', 'user_id', name='uq_conversation_states_bot_user'),
+        Index('ix_conversation_states_updated_at', 'updated_at'),
+    )
+
+class CallbackState(Base):
+    """آرگومان‌های دکمه‌هایی که در ۶۴ بایت callback_data جا نمی‌شوند تا پس از ری‌استارت هم کار کنند"""
+    __tablename__ = 'callback_states'
+    
+    id = Column(Integer, primary_key=True)
+    token = Column(String, unique=True, nullable=False)
+    data = Column(JSON, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+    
+    __table_args__ = (
+        Index('ix_callback_states_expires_at', 'expires_at'),
+    )
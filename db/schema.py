@@ -0,0 +1,54 @@
+import logging
+from typing import List, Tuple
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+
+from db.models import Base
+
+logger = logging.getLogger(__name__)
+
+
+def schema_differences(engine: Engine) -> Tuple[List[str], List[str], List[str]]:
+    """جداول، ستون‌ها (به شکل table.column) و ایندکس‌هایی که در مدل‌ها تعریف شده‌اند ولی در دیتابیس وجود ندارند"""
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    missing_tables = []
+    missing_columns = []
+    missing_indexes = []
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            missing_tables.append(table.name)
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        missing_columns.extend(f"{table.name}.{column.name}" for column in table.columns if column.name not in existing)
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        missing_indexes.extend(index.name for index in table.indexes if index.name not in existing)
+    return missing_tables, missing_columns, missing_indexes
+
+
+def add_missing_columns(engine: Engine):
+    """اضافه کردن ستون‌های جدید و nullable مدل‌ها به جداول موجود (create_all جداول موجود را تغییر نمی‌دهد)"""
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing or not column.nullable:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                logger.info(f"Adding column {table.name}.{column.name} ({column_type})")
+                connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN "{column.name}" {column_type}'))
+
+
+def add_missing_indexes(engine: Engine):
+    """ساختن ایندکس‌های جدید مدل‌ها روی جداول موجود (create_all فقط همراه جدول جدید ایندکس می‌سازد)"""
+    existing_tables = set(inspect(engine).get_table_names())
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
@@ -0,0 +1,8 @@
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from config import DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW
+
+# یک engine و استخر اتصال مشترک برای هر دو ربات و کارهای پس‌زمینه
+engine = create_engine(DATABASE_URL, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW)
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -388,10 +388,13 @@ After=network.target postgresql.service
 Wants=postgresql.service
 
 [Service]
+Type=notify
+NotifyAccess=all
 User=root
 Group=root
 WorkingDirectory=${INSTALL_DIR}
 ExecStart=${INSTALL_DIR}/venv/bin/python ${INSTALL_DIR}/bot/main.py
+ExecReload=${INSTALL_DIR}/venv/bin/python ${INSTALL_DIR}/bot/handoff.py
 Environment=PYTHONPATH=${INSTALL_DIR}
 Restart=always
 RestartSec=5
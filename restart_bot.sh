@@ -14,6 +14,21 @@ echo -e "${BLUE}================================================${NC}"
 # Installation directory
 INSTALL_DIR=${INSTALL_DIR:-"/opt/foxybot"}
 
+# Restart without downtime when the running bot and the systemd unit support a handoff
+# (systemctl reload runs bot/handoff.py); otherwise fall back to a plain restart
+restart_service() {
+    if systemctl is-active --quiet foxybot.service \
+        && systemctl cat foxybot.service 2>/dev/null | grep -q "^ExecReload=.*handoff.py" \
+        && python bot/handoff.py --check; then
+        echo -e "${YELLOW}🔄 Handing over to a new bot process...${NC}"
+        if systemctl reload foxybot.service; then
+            return 0
+        fi
+        echo -e "${RED}❌ Handoff failed, restarting the service instead...${NC}"
+    fi
+    systemctl restart foxybot.service
+}
+
 # Check if installation directory exists
 if [ ! -d "$INSTALL_DIR" ]; then
     echo -e "${RED}❌ Error: Installation directory $INSTALL_DIR not found!${NC}"
@@ -23,10 +38,6 @@ fi
 # Navigate to installation directory
 cd "$INSTALL_DIR" || exit 1
 
-# Stop the service
-echo -e "${YELLOW}🔄 Stopping the service...${NC}"
-systemctl stop foxybot.service
-
 # Activate virtual environment
 echo -e "${YELLOW}🔄 Activating virtual environment...${NC}"
 source venv/bin/activate
@@ -53,9 +64,9 @@ except Exception as e:
     sys.exit(1)
 "
 
-# Start the service
-echo -e "${YELLOW}🔄 Starting the service...${NC}"
-systemctl start foxybot.service
+# Restart the service
+echo -e "${YELLOW}🔄 Restarting the service...${NC}"
+restart_service
 
 # Wait for service to start
 echo -e "${YELLOW}🔄 Waiting for service to start...${NC}"
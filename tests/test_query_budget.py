@@ -0,0 +1,88 @@
+"""
+تعداد کوئری مسیرهای پرتکرار ربات کاربر
+
+هر مسیر با همان Bot API و پنل محلی که bench/load_test.py استفاده می‌کند اجرا می‌شود و
+تعداد کوئری‌ها نباید از بودجه آن در DB_ROUTE_QUERY_BUDGETS بیشتر شود. اگر تغییری
+کوئری اضافه کند (مثلاً بارگذاری تنبل N+1) این تست شکست می‌خورد و لیست کوئری‌ها را
+نشان می‌دهد.
+
+    python -m pytest -q tests
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+
+# اضافه کردن مسیر پروژه به سیستم
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from bench.load_test import USER_ID_BASE, UpdateFactory, configure_environment, seed
+
+# config باید پس از تنظیم متغیرهای محیطی import شود
+configure_environment(argparse.Namespace(database_url=None, throttle=False))
+
+from bench.fake_telegram import FakeTelegramServer
+from bench.fake_panel import FakePanelServer
+
+
+async def _run_routes():
+    from telegram import Update
+    from bot.user_bot import UserBot, SessionLocal, engine
+    from bot.utils.callbacks import callback_data
+    from bot.utils.catalog import CATALOG
+    from bot.utils.instrumentation import assert_max_queries, query_budget, update_route
+    from db import models
+
+    telegram_server = FakeTelegramServer().start()
+    panel_server = FakePanelServer().start()
+    bot = None
+    try:
+        models.Base.metadata.create_all(engine)
+        seeded = seed(SessionLocal, panel_server, 1)
+        # مثل bot/main.py پلن‌ها و پنل‌ها پیش از اولین آپدیت در حافظه هستند
+        CATALOG.load(SessionLocal)
+        bot = UserBot(base_url=telegram_server.base_url)
+        application = bot.application
+        errors = []
+
+        async def on_error(update, context):
+            errors.append(context.error)
+        application.add_error_handler(on_error)
+        await application.initialize()
+
+        factory = UpdateFactory(application.bot.bot.to_dict())
+        telegram_id = USER_ID_BASE
+        plan_id = seeded["plan_id"]
+
+        async def send(data):
+            update = Update.de_json(data, application.bot)
+            await application.process_update(update)
+            return update
+
+        # قدم‌های قبلی همان مسیری که کاربر طی می‌کند
+        await send(factory.command(telegram_id, "/start"))
+        await send(factory.callback(telegram_id, callback_data("buy_plan", plan_id)))
+
+        counts = {}
+        for route, data in (
+            ("confirm_buy", factory.callback(telegram_id, callback_data("confirm_buy", plan_id))),
+            ("view_subscriptions", factory.callback(telegram_id, "view_subscriptions")),
+        ):
+            with assert_max_queries(query_budget(route), route) as scope:
+                update = await send(data)
+            assert update_route(update) == route
+            counts[route] = scope.count
+        assert not errors, errors
+        return counts
+    finally:
+        if bot is not None:
+            await bot.application.shutdown()
+        telegram_server.stop()
+        panel_server.stop()
+
+
+def test_hot_routes_stay_within_query_budget():
+    counts = asyncio.run(_run_routes())
+    # خرید باید واقعاً انجام شده باشد و نه اینکه زودتر با خطا برگشته باشد
+    assert counts["confirm_buy"] > 1
@@ -13,6 +13,22 @@ echo -e "${BLUE}================================================${NC}"
 
 # Installation directory
 INSTALL_DIR=${INSTALL_DIR:-"/opt/foxybot"}
+SERVICE_FILE="/etc/systemd/system/foxybot.service"
+
+# Restart without downtime when the running bot and the systemd unit support a handoff
+# (systemctl reload runs bot/handoff.py); otherwise fall back to a plain restart
+restart_service() {
+    if systemctl is-active --quiet foxybot.service \
+        && systemctl cat foxybot.service 2>/dev/null | grep -q "^ExecReload=.*handoff.py" \
+        && python bot/handoff.py --check; then
+        echo -e "${YELLOW}🔄 Handing over to a new bot process...${NC}"
+        if systemctl reload foxybot.service; then
+            return 0
+        fi
+        echo -e "${RED}❌ Handoff failed, restarting the service instead...${NC}"
+    fi
+    systemctl restart foxybot.service
+}
 
 # Check if installation directory exists
 if [ ! -d "$INSTALL_DIR" ]; then
@@ -20,10 +36,6 @@ if [ ! -d "$INSTALL_DIR" ]; then
     exit 1
 fi
 
-# Stop the service
-echo -e "${YELLOW}🔄 Stopping the service...${NC}"
-systemctl stop foxybot.service
-
 # Navigate to installation directory
 cd "$INSTALL_DIR" || exit 1
 
@@ -79,14 +91,26 @@ except Exception as e:
     sys.exit(1)
 "
 
+# Create new tables and columns added since the last update
+echo -e "${YELLOW}🔄 Updating database schema...${NC}"
+python db/create_tables.py
+
 # Make update_notification.py executable
 if [ -f bot/utils/send_notification.py ]; then
     chmod +x bot/utils/send_notification.py
 fi
 
-# Restart the service
+# Enable zero-downtime restarts in systemd units created by older versions of install.sh
+if [ -f "$SERVICE_FILE" ] && ! grep -q "^ExecReload=.*handoff.py" "$SERVICE_FILE"; then
+    echo -e "${YELLOW}🔄 Enabling zero-downtime restarts in the systemd unit...${NC}"
+    sed -i '/^Type=/d' "$SERVICE_FILE"
+    sed -i "/^\[Service\]/a Type=notify\nNotifyAccess=all\nExecReload=${INSTALL_DIR}/venv/bin/python ${INSTALL_DIR}/bot/handoff.py" "$SERVICE_FILE"
+    systemctl daemon-reload
+fi
+
+# Restart the service; the running bot keeps serving users until the new version takes over
 echo -e "${YELLOW}🔄 Restarting the service...${NC}"
-systemctl start foxybot.service
+restart_service
 
 # Wait for service to start
 echo -e "${YELLOW}🔄 Waiting for service to start...${NC}"